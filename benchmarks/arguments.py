@@ -0,0 +1,151 @@
+"""
+Measures how fast command arguments are parsed.
+The legacy parser (schema objects, Or(schema, default) for optional arguments
+and zip_longest over the tokens) is reproduced here for comparison with
+the parsers built by plugins.base.converters.compile_arguments.
+
+The commands are a mix of the ones that take arguments: !roll, !acc, !silence,
+!mp start, !mp map, !mp set, !mp team and !mp mods, valid and not.
+
+Run with `python -m benchmarks.arguments [calls]`
+"""
+import random
+import sys
+import time
+from itertools import zip_longest
+from typing import List, Dict, Any, Tuple, Callable
+
+from schema import Schema, And, Use, Or, SchemaError
+
+from constants.game_modes import GameMode
+from constants.mods import Mod, ModSpecialMode
+from constants.scoring_types import ScoringType
+from constants.silence_units import SilenceUnit
+from constants.team_types import TeamType
+from constants.teams import Team
+from plugins.base import Arg, BotSyntaxError, converters
+
+LEGACY = {
+    "roll": (Arg("number", And(Use(int), lambda x: x > 0), default=100, optional=True),),
+    "acc": (Arg("accuracy", And(str, Use(float), Use(lambda x: round(x, 2)), lambda x: 0 < x <= 100)),),
+    "silence": (
+        Arg("username", Schema(str)),
+        Arg("how_many", Schema(Use(int))),
+        Arg("unit", And(str, Use(SilenceUnit))),
+        Arg("reason", Schema(str), rest=True),
+    ),
+    "mp start": (
+        Arg("seconds", And(Use(int), lambda x: x >= 0), default=0, optional=True),
+        Arg("force", And(str, Use(lambda x: x == "force")), default=False, optional=True),
+    ),
+    "mp map": (
+        Arg("beatmap_id", And(Use(int))),
+        Arg("game_mode", And(Use(int), Use(GameMode)), optional=True, default=None),
+    ),
+    "mp set": (
+        Arg("team_type", And(Use(int), Use(TeamType))),
+        Arg("scoring_type", And(Use(int), Use(ScoringType)), optional=True, default=None),
+        Arg("size", Use(int), optional=True, default=None),
+    ),
+    "mp team": (
+        Arg("username", Schema(str)),
+        Arg("colour", And(Use(lambda x: Team[x.strip().upper()]), lambda x: x != Team.NEUTRAL)),
+    ),
+    "mp mods": (
+        Arg("mods", And(
+            str,
+            Use(lambda x: x.split(" ")),
+            Use(lambda x: (
+                ModSpecialMode.FREE_MODS if any(y == "freemod" for y in x) else ModSpecialMode.NORMAL,
+                Mod.iterable_factory(x)
+            ))
+        ), rest=True),
+    ),
+}
+CURRENT = {
+    "roll": (Arg("number", converters.integer(min_=1), default=100, optional=True),),
+    "acc": (Arg("accuracy", converters.real(0, 100, min_exclusive=True, digits=2)),),
+    "silence": (
+        Arg("username"),
+        Arg("how_many", converters.integer()),
+        Arg("unit", converters.enum_value(SilenceUnit, type_=str)),
+        Arg("reason", rest=True),
+    ),
+    "mp start": (
+        Arg("seconds", converters.integer(min_=0), default=0, optional=True),
+        Arg("force", converters.flag("force", ignore_case=False), default=False, optional=True),
+    ),
+    "mp map": (
+        Arg("beatmap_id", converters.integer()),
+        Arg("game_mode", converters.enum_value(GameMode), optional=True, default=None),
+    ),
+    "mp set": (
+        Arg("team_type", converters.enum_value(TeamType)),
+        Arg("scoring_type", converters.enum_value(ScoringType), optional=True, default=None),
+        Arg("size", converters.integer(), optional=True, default=None),
+    ),
+    "mp team": (
+        Arg("username"),
+        Arg("colour", converters.enum_name(Team, exclude=(Team.NEUTRAL,))),
+    ),
+    "mp mods": (Arg("mods", converters.mods_and_special_mode, rest=True),),
+}
+MESSAGES = (
+    ("roll", ""), ("roll", "1000"), ("roll", "-5"), ("acc", "98.5"), ("acc", "101"),
+    ("silence", "Some_User 10 m spamming in #osu"), ("silence", "Some_User ten m spam"),
+    ("mp start", ""), ("mp start", "10"), ("mp start", "10 force"), ("mp map", "1234"), ("mp map", "1234 3"),
+    ("mp set", "2 3 16"), ("mp set", "1"), ("mp team", "Some_User red"), ("mp team", "Some_User green"),
+    ("mp mods", "DT HD freemod"),
+)
+
+
+def legacy_parser(args: Tuple[Arg, ...]) -> Callable[[List[str]], Dict[str, Any]]:
+    schemas = [Or(x.converter, x.default) if x.optional else x.converter for x in args]
+
+    def parse(parts: List[str]) -> Dict[str, Any]:
+        validated_args = {}
+        if args:
+            if args[-1].rest:
+                parts = [y for y in parts[:len(args) - 1]] + ([" ".join(parts[len(args) - 1:])] if parts[len(args) - 1:] else [])
+            for (arg, schema), part in zip_longest(zip(args, schemas), parts, fillvalue=(None, None)):
+                try:
+                    if arg is None:
+                        raise ValueError()
+                    v = schema.validate(part)
+                    if v is None:
+                        raise ValueError()
+                    validated_args[arg.key] = v
+                except (SchemaError, ValueError):
+                    if arg is not None and arg.optional:
+                        validated_args[arg.key] = arg.default
+                    else:
+                        raise BotSyntaxError(args)
+        return validated_args
+    return parse
+
+
+def run(parsers: Dict[str, Callable], calls: List[Tuple[str, List[str]]]) -> Tuple[float, List[Any]]:
+    results = []
+    start = time.perf_counter()
+    for command, parts in calls:
+        try:
+            results.append(parsers[command](parts))
+        except BotSyntaxError:
+            results.append(None)
+    return (time.perf_counter() - start) / len(calls), results
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    random.seed(1337)
+    calls = [(c, m.split(" ") if m else []) for c, m in (random.choice(MESSAGES) for _ in range(n))]
+    legacy_time, legacy_results = run({k: legacy_parser(v) for k, v in LEGACY.items()}, calls)
+    compiled_time, compiled_results = run({k: converters.compile_arguments(v) for k, v in CURRENT.items()}, calls)
+    assert legacy_results == compiled_results
+    print(f"  legacy: {legacy_time * 1e6:.2f} us/command")
+    print(f"compiled: {compiled_time * 1e6:.2f} us/command")
+    print(f" speedup: {legacy_time / compiled_time:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Measures how fast on_message finds the command triggered by a chat message.
+The legacy lookup (nested dicts, issubclass at every level and a second split
+of the message to build the arguments) is reproduced here for comparison.
+
+The corpus is mostly plain chat, like #osu on a busy evening, with some
+commands, unknown commands and /np actions mixed in.
+
+Run with `python -m benchmarks.commands [messages]`
+"""
+import random
+import sys
+import time
+from typing import List, Tuple, Optional, Any, Dict
+
+from plugins.base import Command, CommandWrapper
+from plugins.base.registry import CommandRegistry
+
+COMMANDS = (
+    "roll", "help", "bloodcat", "mirror", "b", "last", "with", "acc", "mode", "moderated", "kick", "rtx", "ban",
+    "unban", "restrict", "silence", "removesilence", "faq", "modfaq", "lsfaq", "delfaq", "alert", "alertuser",
+    "system info", "system shutdown", "system recycle", "t create",
+    "mp make", "mp join", "mp close", "mp size", "mp move", "mp host", "mp clearhost", "mp start", "mp abort",
+    "mp invite", "mp kick", "mp map", "mp password", "mp removepassword", "mp randompassword", "mp mods",
+    "mp team", "mp set", "mp scorev", "mp help", "mp info",
+)
+ACTIONS = ("is playing", "is listening to", "is watching")
+
+CHAT = (
+    "hello", "anyone up for multi?", "gg", "lol", "how do i get pp", "what's the best skin",
+    "nice pass", "this map is so hard", "brb", "who wants to 1v1", "o/", "thanks!",
+)
+COMMAND_MESSAGES = (
+    "!roll", "!roll 1000", "!faq rules", "!last", "!with HD", "!acc 98.5", "!mp start 10", "!mp map 1234 0",
+    "!mp invite Some_User", "!mp help", "!system info", "!b", "!unknowncommand", "!mp unknownsubcommand",
+    "!FAQ Rules", "!Mp Start",
+)
+ACTION_MESSAGES = (
+    "\x01ACTION is listening to [https://osu.ppy.sh/b/1234 Artist - Title]\x01",
+    "\x01ACTION is playing [https://osu.ppy.sh/b/1234 Artist - Title [Insane]] +Hidden\x01",
+    "\x01ACTION dances\x01",
+)
+
+
+def corpus(n: int) -> List[str]:
+    random.seed(1337)
+    messages = []
+    for _ in range(n):
+        r = random.random()
+        if r < 0.8:
+            messages.append(random.choice(CHAT))
+        elif r < 0.95:
+            messages.append(random.choice(COMMAND_MESSAGES))
+        else:
+            messages.append(random.choice(ACTION_MESSAGES))
+    return messages
+
+
+def build_legacy(names) -> Dict[str, Any]:
+    root = {}
+    for name in names:
+        parts = name.split(" ")
+        d = root
+        for part in parts[:-1]:
+            if part not in d:
+                d[part] = {}
+            d = d[part]
+        d[parts[-1]] = CommandWrapper(name, None)
+    return root
+
+
+def build_registry(names) -> CommandRegistry:
+    registry = CommandRegistry()
+    for name in names:
+        registry.add(name, CommandWrapper(name, None))
+    return registry
+
+
+def legacy_lookup(commands, actions, message: str) -> Optional[Tuple[Command, List[str]]]:
+    message = message.strip()
+    is_command = message.startswith("!")
+    is_action = message.startswith("\x01ACTION")
+    if not is_command and not is_action:
+        return None
+    raw_message = message[len("!" if is_command else "\x01ACTION"):].lower().strip()
+    dispatcher = commands if is_command else actions
+    parts = raw_message.split(" ")
+    for i, part in enumerate(parts):
+        if part not in dispatcher:
+            return None
+        if issubclass(type(dispatcher[part]), Command):
+            k = " ".join(parts[:i+1])
+            command_name_length = len(k.split(" "))
+            return dispatcher[part], message.split(" ")[command_name_length:]
+        else:
+            dispatcher = dispatcher[part]
+    return None
+
+
+def registry_lookup(commands, actions, message: str) -> Optional[Tuple[Command, List[str]]]:
+    message = message.strip()
+    is_command = message.startswith("!")
+    is_action = message.startswith("\x01ACTION")
+    if not is_command and not is_action:
+        return None
+    tokens = message[len("!" if is_command else "\x01ACTION"):].lstrip().split(" ")
+    command, n = (commands if is_command else actions).lookup(tokens)
+    if command is None:
+        return None
+    return command, tokens[n:]
+
+
+def run(lookup, commands, actions, messages: List[str]) -> Tuple[float, int]:
+    found = 0
+    start = time.perf_counter()
+    for message in messages:
+        if lookup(commands, actions, message) is not None:
+            found += 1
+    return len(messages) / (time.perf_counter() - start), found
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    messages = corpus(n)
+    for name, lookup, build in (("legacy", legacy_lookup, build_legacy), ("trie", registry_lookup, build_registry)):
+        mps, found = run(lookup, build(COMMANDS), build(ACTIONS), messages)
+        print(f"{name:>8}: {mps:,.0f} messages/s ({found} commands found in {n} messages)")
+    # Commands only, the case the trie is meant to speed up
+    messages = [x for x in messages if x.startswith("!")]
+    for name, lookup, build in (("legacy", legacy_lookup, build_legacy), ("trie", registry_lookup, build_registry)):
+        mps, found = run(lookup, build(COMMANDS), build(ACTIONS), messages)
+        print(f"{name:>8}: {mps:,.0f} commands/s ({found} commands found in {len(messages)} commands)")
+
+
+if __name__ == '__main__':
+    main()
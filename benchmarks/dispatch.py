@@ -0,0 +1,151 @@
+"""
+Measures the overhead of calling a command handler through its decorators.
+The command is shaped like the !mp ones: multiplayer_only -> resolve_mp ->
+tournament_staff_or_host -> arguments -> handler, triggered by tournament staff
+so no api call is made.
+
+The legacy decorators (one nested coroutine per decorator, signatures inspected
+on every call) are reproduced here for comparison with the same decorators
+compiled by plugins.base.pipeline.
+
+Run with `python -m benchmarks.dispatch [calls]`
+"""
+import asyncio
+import inspect
+import sys
+import time
+from itertools import zip_longest
+from typing import Callable, Dict, Any, List
+
+from schema import Schema, Use, Or, SchemaError
+
+import plugins.base
+from constants.privileges import Privileges
+from plugins.base import Arg, BotSyntaxError, filters
+from plugins.base.pipeline import compile_command
+
+SENDER = {"privileges": int(Privileges.USER_TOURNAMENT_STAFF), "username": "Staff", "user_id": 1000}
+RECIPIENT = {"name": "#multi_1234", "display_name": "#multiplayer"}
+ARGS = (
+    Arg("seconds", Use(int)),
+    Arg("force", Schema(str), default=None, optional=True),
+)
+
+
+async def handler(match_id: int, seconds: int, force: str) -> str:
+    return f"Match {match_id} starts in {seconds} seconds"
+
+
+def legacy_required_kwargs_only(f: Callable, **all_kwargs) -> Dict[str, Any]:
+    # Verbatim copy of the old plugins.base.utils.required_kwargs_only
+    f_kwargs_keys = {k for k in inspect.signature(f).parameters.keys()}
+    return {k: v for k, v in all_kwargs.items() if k in f_kwargs_keys & all_kwargs.keys()}
+
+
+def legacy_errors(f: Callable) -> Callable:
+    async def wrapper(*, command_name: str, **kwargs) -> Any:
+        try:
+            return await f(**kwargs)
+        except plugins.base.BOT_ERRORS as e:
+            return plugins.base.error_response(e, command_name)
+    return wrapper
+
+
+def legacy_multiplayer_only(f: Callable) -> Callable:
+    async def wrapper(**kwargs) -> Any:
+        if not all(x(**legacy_required_kwargs_only(x, **kwargs)) for x in (filters.is_multi,)):
+            return
+        return await f(**kwargs)
+    return wrapper
+
+
+def legacy_resolve_mp(f: Callable) -> Callable:
+    async def wrapper(*, recipient: Dict[str, Any], **kwargs):
+        assert recipient["display_name"] == "#multiplayer"
+        match_id = int(recipient["name"].split("_")[1])
+        return await f(match_id=match_id, recipient=recipient, **kwargs)
+    return wrapper
+
+
+def legacy_tournament_staff_or_host(f: Callable) -> Callable:
+    async def wrapper(*, sender: Dict[str, Any], match_id: int, **kwargs) -> Any:
+        if not Privileges(sender["privileges"]).has(Privileges.USER_TOURNAMENT_STAFF):
+            return "You must be the host of the match to trigger this command."
+        return await f(sender=sender, match_id=match_id, **kwargs)
+    return wrapper
+
+
+def legacy_arguments(*args: Arg) -> Callable:
+    args = [
+        Arg(x.key, Or(x.converter, x.default) if x.optional else x.converter, default=x.default, optional=x.optional)
+        for x in args
+    ]
+
+    def decorator(f: Callable) -> Callable:
+        async def wrapper(*, parts: List[str], **kwargs) -> Any:
+            validated_args = {}
+            for arg, part in zip_longest(args, parts, fillvalue=None):
+                try:
+                    if arg is None:
+                        raise ValueError()
+                    v = arg.converter.validate(part)
+                    if v is None:
+                        raise ValueError()
+                    validated_args[arg.key] = v
+                except (SchemaError, ValueError):
+                    if arg is not None and arg.optional:
+                        validated_args[arg.key] = arg.default
+                    else:
+                        raise BotSyntaxError(args)
+            return await f(**legacy_required_kwargs_only(f, **validated_args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def resolve_mp(f: Callable) -> Callable:
+    # Same as plugins.multiplayer.resolve_mp, which can't be imported without a bot
+    def resolve(kwargs: Dict[str, Any]) -> Any:
+        recipient = kwargs["recipient"]
+        assert recipient["display_name"] == "#multiplayer"
+        kwargs["match_id"] = int(recipient["name"].split("_")[1])
+        return plugins.base.Stage.CONTINUE
+    return plugins.base.staged(f, before=resolve)
+
+
+def build_legacy() -> Callable:
+    return legacy_errors(
+        legacy_multiplayer_only(legacy_resolve_mp(legacy_tournament_staff_or_host(legacy_arguments(*ARGS)(handler))))
+    )
+
+
+def build_pipeline() -> Callable:
+    return compile_command(
+        plugins.base.multiplayer_only(
+            resolve_mp(plugins.base.tournament_staff_or_host(plugins.base.arguments(*ARGS)(handler)))
+        )
+    )
+
+
+async def run(f: Callable, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        r = await f(
+            command_name="mp start", sender=SENDER, recipient=RECIPIENT, pm=False,
+            message="!mp start 10", parts=["10"] if i % 2 else ["10", "force"]
+        )
+        assert r is not None and r.startswith("Match 1234"), r
+    return (time.perf_counter() - start) / n
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    loop = asyncio.get_event_loop()
+    results = {}
+    for name, build in (("legacy", build_legacy), ("pipeline", build_pipeline)):
+        results[name] = loop.run_until_complete(run(build(), n))
+        print(f"{name:>8}: {results[name] * 1e6:.2f} us/call ({1 / results[name]:,.0f} calls/s)")
+    print(f"speedup: {results['legacy'] / results['pipeline']:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Measures how many frames per second WsClient's writer can push to the socket.
+The legacy writer (one message per iteration, stdlib json through send_json
+and an unconditional debug f-string) is reproduced here for comparison.
+
+Run with `python -m benchmarks.ws_writer [messages]`
+"""
+import asyncio
+import json as stdjson
+import logging
+import sys
+import time
+
+from ws.client import WsClient
+from ws.messages import WsChatMessage
+
+
+class FakeWs:
+    """
+    Mimics the parts of aiohttp.ClientWebSocketResponse used by the writer.
+    Frames are counted and thrown away.
+    """
+    def __init__(self, expected: int):
+        self.closed = False
+        self.frames = 0
+        self.expected = expected
+        self.done = asyncio.Event()
+
+    async def send_str(self, data: str) -> None:
+        self.frames += 1
+        if self.frames >= self.expected:
+            self.done.set()
+
+    async def send_json(self, data, dumps=stdjson.dumps) -> None:
+        await self.send_str(dumps(data))
+
+
+async def legacy_writer(client: WsClient) -> None:
+    queue = asyncio.Queue()
+    while client._writer_queue:
+        queue.put_nowait(client._writer_queue.popleft())
+    try:
+        while True:
+            message = await queue.get()
+            if message is None:
+                continue
+            if callable(getattr(message, "__dict__", None)):
+                message = message.__dict__()
+            else:
+                message = dict(message)
+            client.logger.debug(f"<- {message}")
+            await client.ws.send_json(message)
+    except asyncio.CancelledError:
+        pass
+
+
+async def run(writer_factory, messages: int) -> float:
+    client = WsClient("ws://127.0.0.1/api/v2/ws")
+    client.ws = FakeWs(messages)
+    for i in range(messages):
+        client.send(WsChatMessage(f"Match starts in {i} seconds.", "#multi_1234"))
+    start = time.perf_counter()
+    task = asyncio.ensure_future(writer_factory(client))
+    await client.ws.done.wait()
+    elapsed = time.perf_counter() - start
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return messages / elapsed
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    loop = asyncio.get_event_loop()
+    for name, writer in (("legacy", legacy_writer), ("batched", lambda c: c.writer())):
+        fps = loop.run_until_complete(run(writer, messages))
+        print(f"{name:>8}: {fps:,.0f} frames/s ({messages} messages)")
+
+
+if __name__ == '__main__':
+    main()
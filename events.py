@@ -1,33 +1,74 @@
 import logging
 import re
+import time
 from typing import Dict, Any
 
 import asyncio
 
+import plugins.base
 from constants.events import WsEvent
-from plugins.base import Command
 from singletons.bot import Bot
+from utils import metrics, tracing
 from utils.rippleapi import BanchoClientType
 from ws.client import LoginFailedError
 from ws.messages import WsSubscribe, WsAuth, WsJoinChatChannel, WsPong, WsChatMessage, WsResume, WsSuspend
 
 bot = Bot()
 
+RECONNECT_TIME = metrics.registry.histogram(
+    "fokabot_reconnect_seconds",
+    "Time between a disconnection and the bot being ready (or resumed) again",
+    ("outcome",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+)
+COMMAND_TIME = metrics.registry.histogram(
+    "fokabot_command_seconds",
+    "Time spent running command handlers, including their decorators",
+    ("kind", "command", "alias")
+)
+COMMAND_ERRORS = metrics.registry.counter(
+    "fokabot_command_errors_total",
+    "Command handlers that raised an unhandled exception",
+    ("kind", "command", "alias")
+)
+REGEX_TIME = metrics.registry.histogram(
+    "fokabot_regex_handler_seconds",
+    "Time spent running regex handlers",
+    ("handler",)
+)
+REGEX_ERRORS = metrics.registry.counter(
+    "fokabot_regex_handler_errors_total",
+    "Regex handlers that raised an unhandled exception",
+    ("handler",)
+)
+
 
 async def _login():
     try:
-        bot.client.send(WsAuth(bot.bancho_api_client.token))
-        results = await bot.client.wait("msg:auth_success", "msg:auth_failure")
-        if "msg:auth_failure" in results:
+        reply = await bot.client.request(WsAuth(bot.bancho_api_client.token), timeout=bot.login_request_timeout)
+        if reply.type_ == "auth_failure":
             bot.logger.error("Login failed")
             raise LoginFailedError()
         bot.logger.info("Logged in successfully")
     except LoginFailedError:
         bot.logger.error("Login failed! Now disposing.")
         bot.loop.stop()
+    except asyncio.TimeoutError:
+        # Don't sit on a half-open connection, let the reconnect loop try again
+        bot.logger.error("Timed out while logging in. Reconnecting.")
+        bot.client.stop()
+    except ConnectionError:
+        bot.logger.error("Disconnected while logging in.")
     else:
-        bot.client.send(WsSubscribe(WsEvent.CHAT_CHANNELS))
-        await bot.client.wait("msg:subscribed")
+        try:
+            await bot.client.request(WsSubscribe(WsEvent.CHAT_CHANNELS), timeout=bot.login_request_timeout)
+        except asyncio.TimeoutError:
+            bot.logger.error("Timed out while subscribing to chat channel events. Reconnecting.")
+            bot.client.stop()
+            return
+        except ConnectionError:
+            bot.logger.error("Disconnected while subscribing to chat channel events.")
+            return
         bot.logger.debug("Subscribed to chat channel events. Now joining channels")
         channels = await bot.bancho_api_client.get_all_channels()
         bot.login_channels_left |= {x["name"].lower() for x in channels}
@@ -40,17 +81,35 @@ async def _login():
 async def _resume():
     if not bot.suspended:
         raise RuntimeError("The bot must be suspended in order to resume")
-    bot.client.send(WsResume(bot.resume_token))
-    results = await bot.client.wait("msg:resume_success", "msg:resume_failure")
-    if "msg:resume_failure" in results:
-        bot.logger.error("Resume failed! Now disposing")
-        bot.loop.stop()
+    try:
+        reply = await bot.client.request(WsResume(bot.resume_token), timeout=bot.login_request_timeout)
+    except asyncio.TimeoutError:
+        # Retrying with the same token would most likely time out (or fail) again,
+        # and the state loaded from the previous instance (ready, joined channels)
+        # is valid only if the session gets resumed
+        bot.logger.error("Timed out while resuming! Logging in again")
+        reply = None
+    except ConnectionError:
+        bot.logger.error("Disconnected while resuming.")
+        return
+    if reply is None or reply.type_ == "resume_failure":
+        # The session expired (or was never ours). Start a new one, and send
+        # the messages we were holding back once we're logged in.
+        if reply is not None:
+            bot.logger.warning("Resume failed! Logging in again")
+        bot.resume_token = None
+        bot.reset()
+        await _login()
+        bot.client.flush_old_queue()
         return
 
     # We have logged back in!
     bot.resume_token = None
     bot.logger.info("Resumed connection. Flushing old queue.")
     bot.client.flush_old_queue()
+    if not bot.init_hooks_ran:
+        # Cold start, resuming the session of the previous instance
+        await bot.run_init_hooks()
     bot.client.trigger("resumed")
 
 
@@ -105,8 +164,34 @@ async def ping():
     bot.client.send(WsPong())
 
 
+@bot.client.on("msg:lobby_match_added")
+@bot.client.on("msg:match_update")
+async def match_update(**data) -> None:
+    bot.matches.update(data)
+
+
+@bot.client.on("msg:match_user_joined")
+async def match_user_joined(match: Dict[str, Any], **kwargs) -> None:
+    bot.matches.update(match)
+
+
+@bot.client.on("msg:lobby_match_removed")
+async def lobby_match_removed(**data) -> None:
+    bot.matches.remove(data["id"])
+
+
+@bot.client.on("msg:status_update")
+async def status_update(client: Dict[str, Any], **kwargs) -> None:
+    bot.presence.update(client)
+
+
 @bot.client.on("msg:chat_message")
 async def on_message(sender: Dict[str, Any], recipient: Dict[str, Any], pm: bool, message: str, **kwargs) -> None:
+    with tracing.tracer.trace("chat_message", sender=sender.get("username"), recipient=recipient.get("name")):
+        await _on_message(sender, recipient, pm, message)
+
+
+async def _on_message(sender: Dict[str, Any], recipient: Dict[str, Any], pm: bool, message: str) -> None:
     message = message.strip()
     is_command = message.startswith(bot.command_prefix)
     is_action = message.startswith("\x01ACTION")
@@ -125,45 +210,52 @@ async def on_message(sender: Dict[str, Any], recipient: Dict[str, Any], pm: bool
     result = None
     if is_command or is_action:
         # Check command-based handlers
-        raw_message = message[len(bot.command_prefix if is_command else "\x01ACTION"):].lower().strip()
-        dispatcher = bot.command_handlers if is_command else bot.action_handlers
-        parts = raw_message.split(" ")
-        for i, part in enumerate(parts):
-            if part not in dispatcher:
-                # Nothing to do
-                return
-            if issubclass(type(dispatcher[part]), Command):
-                # Handler found
-                k = " ".join(parts[:i+1])
-                bot.logger.debug(f"Triggered {dispatcher[part]} ({k}) [{'command' if is_command else 'action'}]")
-                command_name_length = len(k.split(" "))
-                result = await dispatcher[part].handler(
+        registry = bot.command_handlers if is_command else bot.action_handlers
+        tokens = message[len(bot.command_prefix if is_command else "\x01ACTION"):].lstrip().split(" ")
+        command, n = registry.lookup(tokens)
+        if command is None:
+            # Nothing to do
+            return
+        k = " ".join(tokens[:n]).lower()
+        kind = "command" if is_command else "action"
+        bot.logger.debug(f"Triggered {command} ({k}) [{kind}]")
+        labels = {
+            "kind": kind,
+            "command": command.root_name if type(command) is plugins.base.CommandAlias else command.name,
+            "alias": command.name
+        }
+        start = time.monotonic()
+        try:
+            with tracing.tracer.span("dispatch", **labels):
+                result = await command.handler(
                     sender=sender, recipient=recipient, pm=pm, message=message,
-                    parts=message.split(" ")[command_name_length:], command_name=k
+                    parts=tokens[n:], command_name=k
                 )
-                # Trigger only one command
-                break
-            else:
-                # Nested
-                dispatcher = dispatcher[part]
+        except Exception:
+            COMMAND_ERRORS.inc(**labels)
+            raise
+        finally:
+            COMMAND_TIME.observe(time.monotonic() - start, **labels)
     else:
-        # Not a command nor an action, check regex-based handlers
-        for handler in bot.regex_handlers:
-            # Test all pre first. If pre is True, test the regex
-            # This reduces the number of regexes that we test
-            if handler.pre is not None and not handler.pre(sender=sender, recipient=recipient, pm=pm, message=message):
-                # Pre returned False, skip
-                continue
-            # Pre returned True or no pre at all, test regex
-            match = handler.pattern.fullmatch(message)
-            if not match:
-                continue
-            result = await handler.handler(
-                sender=sender, recipient=recipient, pm=pm,
-                message=message, parts=match.groups(), command_name=handler.pattern
-            )
-            # Trigger only one command
-            break
+        # Not a command nor an action, check regex-based handlers.
+        # Handlers are grouped by pre, so each pre is called once
+        # and each group is tested with a single combined regex
+        found = bot.regex_handlers.match(sender=sender, recipient=recipient, pm=pm, message=message)
+        if found is not None:
+            handler, groups = found
+            name = metrics.handler_name(handler.handler)
+            start = time.monotonic()
+            try:
+                with tracing.tracer.span("dispatch", kind="regex", handler=name):
+                    result = await handler.handler(
+                        sender=sender, recipient=recipient, pm=pm,
+                        message=message, parts=groups, command_name=handler.pattern
+                    )
+            except Exception:
+                REGEX_ERRORS.inc(handler=name)
+                raise
+            finally:
+                REGEX_TIME.observe(time.monotonic() - start, handler=name)
 
     # Return result(s) as message
     if result is None:
@@ -203,32 +295,45 @@ async def on_disconnect(*args, **kwargs):
         bot.logger.warning("Got 'disconnect', but the bot is already reconnecting.")
         return
 
-    async def reconnect():
+    async def reconnect() -> str:
         """
         Performs the actual reconnection, wait for the 'ready' event and notifies '#admin'
 
-        :return:
+        :return: 'ready' or 'resumed'
         """
         await bot.client.start()
-        await bot.client.wait("ready", "resumed")
+        r = await bot.client.wait("ready", "resumed")
         bot.send_message("Reconnected.", "#admin")
+        return r[0]
 
     # Reset only if we haven't been disconnected for server recycle
     if not bot.suspended:
         bot.reset()
     bot.reconnecting = True
-    seconds = 5     # todo: backoff?
-    bot.logger.info(f"Disconnected! Starting reconnect loop in {seconds} seconds")
-    await asyncio.sleep(seconds)
+    disconnected_at = time.monotonic()
+    backoff = bot.reconnect_backoff
+    backoff.reset()
+    timeout = bot.reconnect_attempt_timeout
+    bot.logger.info("Disconnected! Starting reconnect loop")
     while True:
+        delay = backoff.next()
+        if delay > 0:
+            bot.logger.info(f"Retrying in {delay:.2f} seconds")
+            await asyncio.sleep(delay)
         try:
-            bot.logger.info(f"Trying to reconnect. Max timeout is {seconds} seconds.")
-            await asyncio.wait_for(reconnect(), timeout=seconds)
+            bot.logger.info(f"Trying to reconnect (attempt #{backoff.attempts}). Max timeout is {timeout} seconds.")
+            outcome = await asyncio.wait_for(reconnect(), timeout=timeout)
             break
         except ConnectionError:
-            bot.logger.warning(f"Connection failed! Retrying in {seconds} seconds")
-            await asyncio.sleep(seconds)
+            bot.logger.warning("Connection failed!")
         except asyncio.TimeoutError:
             bot.logger.warning("Server timeout")
+            if bot.client.reader_task is not None and not bot.client.reader_task.done():
+                # Connected, but not ready in time. Start over from a clean connection.
+                bot.client.stop()
+                await asyncio.wait([bot.client.reader_task])
+                if not bot.suspended:
+                    bot.reset()
+    RECONNECT_TIME.observe(time.monotonic() - disconnected_at, outcome=outcome)
     bot.reconnecting = False
     bot.logger.info("Reconnected!")
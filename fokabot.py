@@ -70,6 +70,39 @@ def main() -> None:
         redis_password=Config()["REDIS_PASSWORD"],
         redis_pool_size=Config()["REDIS_POOL_SIZE"],
         tinydb_path=Config()["TINYDB_PATH"],
+        http_pool_limit_per_host=Config()["HTTP_POOL_LIMIT_PER_HOST"],
+        http_dns_cache_ttl=Config()["HTTP_DNS_CACHE_TTL"],
+        http_keepalive_timeout=Config()["HTTP_KEEPALIVE_TIMEOUT"],
+        outbound_global_rate=Config()["OUTBOUND_GLOBAL_RATE"],
+        outbound_global_burst=Config()["OUTBOUND_GLOBAL_BURST"],
+        outbound_recipient_rate=Config()["OUTBOUND_RECIPIENT_RATE"],
+        outbound_recipient_burst=Config()["OUTBOUND_RECIPIENT_BURST"],
+        ws_handler_workers=Config()["WS_HANDLER_WORKERS"],
+        reconnect_backoff_base=Config()["RECONNECT_BACKOFF_BASE"],
+        reconnect_backoff_cap=Config()["RECONNECT_BACKOFF_CAP"],
+        reconnect_attempt_timeout=Config()["RECONNECT_ATTEMPT_TIMEOUT"],
+        outbound_max_buffered=Config()["OUTBOUND_MAX_BUFFERED"],
+        outbound_stats_max_recipients=Config()["OUTBOUND_STATS_MAX_RECIPIENTS"],
+        suspend_on_sigterm=Config()["SUSPEND_ON_SIGTERM"],
+        resume_state_ttl=Config()["RESUME_STATE_TTL"],
+        ws_capture_path=Config()["WS_CAPTURE_PATH"],
+        loop_monitor_interval=Config()["LOOP_MONITOR_INTERVAL"],
+        loop_block_threshold=Config()["LOOP_BLOCK_THRESHOLD"],
+        profiler_interval=Config()["PROFILER_INTERVAL"],
+        profiler_max_seconds=Config()["PROFILER_MAX_SECONDS"],
+        profiles_path=Config()["PROFILES_PATH"],
+        trace_sample_rate=Config()["TRACE_SAMPLE_RATE"],
+        trace_export_path=Config()["TRACE_EXPORT_PATH"],
+        username_cache_size=Config()["USERNAME_CACHE_SIZE"],
+        username_cache_ttl=Config()["USERNAME_CACHE_TTL"],
+        username_cache_negative_ttl=Config()["USERNAME_CACHE_NEGATIVE_TTL"],
+        username_cache_redis=Config()["USERNAME_CACHE_REDIS"],
+        match_registry_max_age=Config()["MATCH_REGISTRY_MAX_AGE"],
+        match_registry_reconcile_interval=Config()["MATCH_REGISTRY_RECONCILE_INTERVAL"],
+        presence_ttl=Config()["PRESENCE_TTL"],
+        presence_api_ttl=Config()["PRESENCE_API_TTL"],
+        user_batch_window=Config()["USER_BATCH_WINDOW"],
+        user_batch_size=Config()["USER_BATCH_SIZE"],
     )
     # Register all events
     import events
@@ -5,6 +5,7 @@ from aiohttp import web
 from plugins import pp
 from singletons.bot import Bot
 from singletons.config import Config
+from utils import metrics, profiler
 
 
 class FokaAPIError(Exception):
@@ -43,10 +44,14 @@ async def last(request):
         request_data = await request.json()
         if "user_id" not in request_data:
             raise FokaAPIError(400, "Missing required arguments.")
-        users = await Bot().ripple_api_client.get_user(user_id=request_data["user_id"])
-        if users is None or not users:
+        try:
+            user_id = int(request_data["user_id"])
+        except (TypeError, ValueError):
+            raise FokaAPIError(400, "Invalid user_id")
+        user = await Bot().users.load(user_id)
+        if user is None:
             raise FokaAPIError(404, "No such user")
-        username = users[0]["username"]
+        username = user["username"]
         msg = await pp.last_inner(username, pm=True)
         Bot().send_message(msg, username)
         resp = {"code": 200, "message": "ok"}
@@ -59,3 +64,71 @@ async def last(request):
         code = resp["code"] if "code" in resp else 200
         return web.json_response(resp, status=code)
 
+
+async def profile(request):
+    resp = {}
+    try:
+        secret = request.headers.get("Secret", None)
+        if secret is None or secret != Config()["INTERNAL_API_SECRET"]:
+            raise FokaAPIError(403, "Forbidden")
+        request_data = await request.json()
+        if "seconds" not in request_data:
+            raise FokaAPIError(400, "Missing required arguments.")
+        seconds = request_data["seconds"]
+        if type(seconds) not in (int, float) or not 0 < seconds <= Bot().profiler_max_seconds:
+            raise FokaAPIError(400, f"seconds must be between 0 and {Bot().profiler_max_seconds}")
+        try:
+            result = await profiler.profile(seconds, Bot().profiles_path, Bot().profiler_interval)
+        except profiler.ProfilerBusyError:
+            raise FokaAPIError(409, "Already profiling")
+        resp = {
+            "code": 200,
+            "message": "ok",
+            "file": result.path,
+            "samples": result.samples,
+            "idle_samples": result.idle,
+            "top": [{"handler": k, "samples": v, "ratio": r} for k, v, r in result.top(20)],
+        }
+    except FokaAPIError as e:
+        resp = {"code": e.status, "message": e.message}
+    except:
+        resp = {"code": 500, "message": "Internal server error"}
+        traceback.print_exc()
+    finally:
+        code = resp["code"] if "code" in resp else 200
+        return web.json_response(resp, status=code)
+
+
+async def outbound(request):
+    """
+    Per-recipient state of the outbound scheduler (queue depth, messages sent, queue wait)
+    """
+    resp = {}
+    try:
+        secret = request.headers.get("Secret", None)
+        if secret is None or secret != Config()["INTERNAL_API_SECRET"]:
+            raise FokaAPIError(403, "Forbidden")
+        resp = {
+            "code": 200,
+            "message": "ok",
+            "pending": Bot().outbound.pending,
+            "recipients": {str(k): v for k, v in Bot().outbound.stats().items()},
+        }
+    except FokaAPIError as e:
+        resp = {"code": e.status, "message": e.message}
+    except:
+        resp = {"code": 500, "message": "Internal server error"}
+        traceback.print_exc()
+    finally:
+        code = resp["code"] if "code" in resp else 200
+        return web.json_response(resp, status=code)
+
+
+async def metrics_(request):
+    """
+    Prometheus metrics. Not protected by the secret, Prometheus can't send it.
+    """
+    return web.Response(
+        text=metrics.registry.render(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
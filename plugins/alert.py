@@ -1,5 +1,3 @@
-from schema import Schema
-
 import plugins
 import plugins.base
 import plugins.base.utils
@@ -11,7 +9,7 @@ bot = Bot()
 
 @bot.command("alert")
 @plugins.base.protected(Privileges.ADMIN_SEND_ALERTS)
-@plugins.base.arguments(plugins.base.Arg("the_message", Schema(str), rest=True))
+@plugins.base.arguments(plugins.base.Arg("the_message", rest=True))
 async def alert(the_message: str) -> None:
     await bot.bancho_api_client.mass_alert(the_message)
 
@@ -19,8 +17,8 @@ async def alert(the_message: str) -> None:
 @bot.command("alertuser")
 @plugins.base.protected(Privileges.ADMIN_SEND_ALERTS)
 @plugins.base.arguments(
-    plugins.base.Arg("username", Schema(str)),
-    plugins.base.Arg("the_message", Schema(str), rest=True)
+    plugins.base.Arg("username"),
+    plugins.base.Arg("the_message", rest=True)
 )
 async def alert(username: str, the_message: str) -> None:
     api_identifier = await plugins.base.utils.username_to_client(username)
@@ -1,12 +1,12 @@
-from itertools import zip_longest
+import asyncio
 from typing import Optional, Any, Callable, List, Dict, Iterable
 
 from abc import ABC
-from schema import Or, SchemaError
 
 from constants.privileges import Privileges
 from plugins.base import utils
 from plugins.base import filters
+from plugins.base import converters
 from utils.rippleapi import RippleApiResponseError, RippleApiError
 
 
@@ -57,13 +57,19 @@ class Arg:
     forbidden_arg_names = ("sender", "recipient", "pm", "message")
 
     def __init__(
-        self, key: Optional[str] = None, schema=None,
+        self, key: Optional[str] = None, converter: Optional[Callable[[str], Any]] = None,
         default: Optional[Any] = None, rest: bool = False,
         optional: bool = False, example: Optional[str] = None
     ):
+        """
+        :param key: name of the kwarg passed to the handler
+        :param converter: a converter from plugins.base.converters (or any callable that
+        receives a str and raises ValueError if it's not valid). Defaults to str.
+        `schema` objects are supported as well.
+        """
         assert key not in Arg.forbidden_arg_names, "Forbidden key name"
         self.key = key
-        self.schema = schema
+        self.converter = converter if converter is not None else converters.string
         self.default = default
         self.rest = rest
         self.optional = optional
@@ -86,64 +92,110 @@ class BotSyntaxError(Exception):
         self.extra = extra
 
 
+class Stage:
+    """
+    What a decorator does, in a form that Bot.command can flatten into a single
+    pipeline, instead of nesting one coroutine per decorator (see plugins.base.pipeline).
+
+    `before(kwargs)` runs on the way in. It can edit kwargs in place, and it returns
+    Stage.CONTINUE to go on, or anything else to stop and use that as the result.
+    `after(result, kwargs)` runs on the way out and returns the new result.
+    It receives the kwargs as they were after `before`.
+    Both can be plain functions or coroutine functions.
+    If `filter_kwargs` is True, only the kwargs accepted by the next
+    function are passed to it (see utils.accepted_kwargs).
+    """
+    CONTINUE = object()
+    __slots__ = "before", "after", "filter_kwargs"
+
+    def __init__(self, before: Optional[Callable] = None, after: Optional[Callable] = None, filter_kwargs: bool = False):
+        self.before = before
+        self.after = after
+        self.filter_kwargs = filter_kwargs
+
+
+def staged(
+    f: Callable, before: Optional[Callable] = None, after: Optional[Callable] = None, filter_kwargs: bool = False
+) -> Callable:
+    """
+    Wraps `f` in a decorator stage.
+    The returned coroutine function can still be called as usual (eg: by event handlers),
+    Bot.command looks at its `stage` and `inner` attributes to flatten the chain.
+
+    :param f: the decorated function
+    :param before: see Stage
+    :param after: see Stage
+    :param filter_kwargs: see Stage
+    :return: the wrapper
+    """
+    stage = Stage(before, after, filter_kwargs)
+    before_async = asyncio.iscoroutinefunction(before)
+    after_async = asyncio.iscoroutinefunction(after)
+    f_async = asyncio.iscoroutinefunction(f)
+
+    async def wrapper(**kwargs) -> Any:
+        if before is not None:
+            r = await before(kwargs) if before_async else before(kwargs)
+            if r is not Stage.CONTINUE:
+                return r
+        f_kwargs = utils.required_kwargs_only(f, **kwargs) if filter_kwargs else kwargs
+        result = await f(**f_kwargs) if f_async else f(**f_kwargs)
+        if after is not None:
+            result = await after(result, kwargs) if after_async else after(result, kwargs)
+        return result
+    wrapper.stage = stage
+    wrapper.inner = f
+    return wrapper
+
+
 def arguments(*args: Arg, intersect_kwargs: bool = True) -> Callable:
     # TODO: Check optional args only at the end
-    for x in args:
-        if x.optional:
-            x.schema = Or(x.schema, x.default)
+    parse = converters.compile_arguments(args)
+
+    def validate(kwargs: Dict[str, Any]) -> Any:
+        kwargs.update(parse(kwargs.pop("parts")))
+        return Stage.CONTINUE
 
     def decorator(f: Callable) -> Callable:
-        async def wrapper(*, parts: List[str], **kwargs) -> Any:
-            # parts = message.split(" ")[1:]
-            validated_args = {}
-            if args:
-                if args[-1].rest:
-                    parts = [y for y in parts[:len(args) - 1]] + ([" ".join(parts[len(args) - 1:])] if parts[len(args) - 1:] else [])
-                for arg, part in zip_longest(args, parts, fillvalue=None):
-                    try:
-                        if arg is None:
-                            # More arguments than needed (zip_longest)
-                            raise ValueError()
-                        v = arg.schema.validate(part)
-                        if v is None:
-                            raise ValueError()
-                        validated_args[arg.key] = v
-                    except (SchemaError, ValueError) as e:
-                        if arg is not None and arg.optional:
-                            validated_args[arg.key] = arg.default
-                        else:
-                            raise BotSyntaxError(args)
-                        # print(e)
-                        # raise BotSyntaxError(args)
-
-            final_kwargs = {**validated_args, **kwargs}
-            if intersect_kwargs:
-                final_kwargs = utils.required_kwargs_only(f, **validated_args, **kwargs)
-            return await f(**final_kwargs)
-        return wrapper
+        return staged(f, before=validate, filter_kwargs=intersect_kwargs)
     return decorator
 
 
+def error_response(e: Exception, command_name: str) -> str:
+    """
+    Returns the message to send back when a command raises one of the BOT_ERRORS
+
+    :param e: the exception
+    :param command_name: name of the command, used for syntax errors
+    :return: the message
+    """
+    if isinstance(e, RippleApiResponseError):
+        msg = e.data.get("message", None)
+        if msg is None:
+            return f"API Error: {e}"
+        return msg
+    if isinstance(e, RippleApiError):
+        return f"General API error: {e}"
+    if isinstance(e, BotSyntaxError):
+        first_optional = next((x for x in e.args if x.optional), None)
+        if e.extra is not None:
+            return e.extra
+        return f"Syntax: !{command_name} {' '.join(f'<{x}>' if first_optional is None or x != first_optional else f'[<{str(x)}>' for x in e.args)}{']' if first_optional is not None else ''}"
+    return str(e)
+
+
+# Exceptions that are turned into a response by error_response
+BOT_ERRORS = (RippleApiError, GenericBotError, BotSyntaxError)
+
+
 def errors(f: Callable) -> Callable:
     async def wrapper(
         *, command_name: str, **kwargs
     ) -> Any:
         try:
             return await f(**kwargs)
-        except RippleApiResponseError as e:
-            msg = e.data.get("message", None)
-            if msg is None:
-                return f"API Error: {e}"
-            return msg
-        except RippleApiError as e:
-            return f"General API error: {e}"
-        except GenericBotError as e:
-            return str(e)
-        except BotSyntaxError as e:
-            first_optional = next((x for x in e.args if x.optional), None)
-            if e.extra is not None:
-                return e.extra
-            return f"Syntax: !{command_name} {' '.join(f'<{x}>' if first_optional is None or x != first_optional else f'[<{str(x)}>' for x in e.args)}{']' if first_optional is not None else ''}"
+        except BOT_ERRORS as e:
+            return error_response(e, command_name)
     return wrapper
 
 
@@ -152,12 +204,13 @@ def base(f: Callable) -> Callable:
 
 
 def protected(required_privileges: Privileges) -> Callable:
+    def check(kwargs: Dict[str, Any]) -> Any:
+        if not Privileges(kwargs["sender"]["privileges"]).has(required_privileges):
+            return "You don't have the required privileges to trigger this command."
+        return Stage.CONTINUE
+
     def decorator(f: Callable) -> Callable:
-        async def wrapper(*, sender: Dict[str, Any], **kwargs) -> Any:
-            if not Privileges(sender["privileges"]).has(required_privileges):
-                return "You don't have the required privileges to trigger this command."
-            return await f(sender=sender, **kwargs)
-        return wrapper
+        return staged(f, before=check)
     return decorator
 
 
@@ -176,26 +229,31 @@ def tournament_staff_or_host(f: Callable) -> Callable:
     """
     import singletons.bot
 
-    async def wrapper(*, sender: Dict[str, Any], match_id: int, **kwargs) -> Any:
+    async def check(kwargs: Dict[str, Any]) -> Any:
+        sender = kwargs["sender"]
         # TODO: Walrus
         can = Privileges(sender["privileges"]).has(Privileges.USER_TOURNAMENT_STAFF)
         if not can:
-            match_info = await singletons.bot.Bot().bancho_api_client.get_match_info(match_id)
+            match_info = await singletons.bot.Bot().matches.get(kwargs["match_id"])
             can = match_info["host_api_identifier"] == sender["api_identifier"] \
                 or match_info["api_owner_user_id"] == sender["user_id"]
         if not can:
             return "You must be the host of the match to trigger this command."
-        return await f(sender=sender, match_id=match_id, **kwargs)
-    return wrapper
+        return Stage.CONTINUE
+    return staged(f, before=check)
 
 
 def _trigger_filter(*filters_: Callable[..., bool], checker: Callable[..., bool] = None) -> Callable:
+    # Work out the arguments of each filter now, not on every message
+    filters_ = tuple((x, utils.accepted_kwargs(x)) for x in filters_)
+
+    def check(kwargs: Dict[str, Any]) -> Any:
+        if not checker(x(**utils.filter_kwargs(keys, kwargs)) for x, keys in filters_):
+            return
+        return Stage.CONTINUE
+
     def decorator(f: Callable) -> Callable:
-        async def wrapper(**kwargs) -> Any:
-            if not checker(x(**utils.required_kwargs_only(x, **kwargs)) for x in filters_):
-                return
-            return await f(**kwargs)
-        return wrapper
+        return staged(f, before=check)
     return decorator
 
 
@@ -229,12 +287,12 @@ def wrap_response(dest: Callable) -> Callable:
     """
     import singletons.bot
 
+    def send(msg: Any, kwargs: Dict[str, Any]) -> None:
+        if msg is not None:
+            singletons.bot.Bot().send_message(msg, dest(**kwargs))
+
     def decorator(f: Callable) -> Callable:
-        async def wrapper(**kwargs) -> Any:
-            msg = await f(**kwargs)
-            if msg is not None:
-                singletons.bot.Bot().send_message(msg, dest(**kwargs))
-        return wrapper
+        return staged(f, after=send)
     return decorator
 
 
@@ -249,8 +307,7 @@ def wrap_response_multiplayer(f: Callable) -> Callable:
 
 
 def wrap_caller(f: Callable) -> Callable:
-    async def wrapper(sender: Dict[str, Any], **kwargs) -> Any:
-        msg = await f(sender=sender, **kwargs)
+    def prepend_username(msg: Any, kwargs: Dict[str, Any]) -> Any:
         if msg is not None:
-            return f"{sender['username']}, {msg[0].lower() + msg[1:]}"
-    return wrapper
+            return f"{kwargs['sender']['username']}, {msg[0].lower() + msg[1:]}"
+    return staged(f, after=prepend_username)
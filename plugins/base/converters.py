@@ -0,0 +1,180 @@
+"""
+Argument converters for plugins.base.Arg.
+A converter is a callable that receives a single argument (str) and
+returns the converted value. It must raise ValueError (or KeyError/TypeError)
+if the argument is not valid. Returning None also means "not valid".
+"""
+from enum import Enum
+from typing import Callable, Optional, Any, Dict, List, Tuple, Type, Iterable
+
+from schema import SchemaError
+
+import plugins.base
+from constants.game_modes import GameMode
+from constants.mods import Mod, ModSpecialMode
+
+# Errors raised by converters when an argument is not valid
+CONVERSION_ERRORS = (ValueError, KeyError, TypeError, SchemaError)
+
+
+def string(x: str) -> str:
+    return x
+
+
+def integer(min_: Optional[int] = None, max_: Optional[int] = None) -> Callable[[str], int]:
+    """
+    :param min_: minimum value (inclusive)
+    :param max_: maximum value (inclusive)
+    :return: converter to int
+    """
+    def convert(x: str) -> int:
+        v = int(x)
+        if (min_ is not None and v < min_) or (max_ is not None and v > max_):
+            raise ValueError()
+        return v
+    return convert
+
+
+def real(
+    min_: Optional[float] = None, max_: Optional[float] = None, *,
+    min_exclusive: bool = False, digits: Optional[int] = None
+) -> Callable[[str], float]:
+    """
+    :param min_: minimum value (inclusive, unless min_exclusive is True)
+    :param max_: maximum value (inclusive)
+    :param min_exclusive: whether min_ is a valid value or not
+    :param digits: if not None, the value is rounded to this many digits before checking the bounds
+    :return: converter to float
+    """
+    def convert(x: str) -> float:
+        v = float(x)
+        if digits is not None:
+            v = round(v, digits)
+        # Written so that nan is never valid
+        if min_ is not None and not (v > min_ if min_exclusive else v >= min_):
+            raise ValueError()
+        if max_ is not None and not v <= max_:
+            raise ValueError()
+        return v
+    return convert
+
+
+def flag(word: str, ignore_case: bool = True) -> Callable[[str], bool]:
+    """
+    :param word: the word that sets the flag (eg: 'force')
+    :param ignore_case:
+    :return: converter to bool, True if the argument is `word`
+    """
+    if ignore_case:
+        word = word.lower()
+        return lambda x: x.lower() == word
+    return lambda x: x == word
+
+
+def enum_value(
+    cls: Type[Enum], type_: Callable[[str], Any] = int, exclude: Iterable[Enum] = ()
+) -> Callable[[str], Enum]:
+    """
+    :param cls: enum class
+    :param type_: type of the enum values
+    :param exclude: members that are not valid
+    :return: converter to a member of `cls`, from its value (eg: '2' -> TeamType.TEAM_VS)
+    """
+    exclude = frozenset(exclude)
+
+    def convert(x: str) -> Enum:
+        v = cls(type_(x))
+        if v in exclude:
+            raise ValueError()
+        return v
+    return convert
+
+
+def enum_name(cls: Type[Enum], exclude: Iterable[Enum] = ()) -> Callable[[str], Enum]:
+    """
+    :param cls: enum class
+    :param exclude: members that are not valid
+    :return: converter to a member of `cls`, from its name, case insensitive (eg: 'red' -> Team.RED)
+    """
+    exclude = frozenset(exclude)
+
+    def convert(x: str) -> Enum:
+        v = cls[x.strip().upper()]
+        if v in exclude:
+            raise ValueError()
+        return v
+    return convert
+
+
+def mods(x: str) -> Mod:
+    """
+    Short mods acronyms, with no spaces (eg: 'HDDT'), or 'relax'
+    """
+    return Mod.RELAX if x.lower() == "relax" else Mod.short_factory(x)
+
+
+def mods_and_special_mode(x: str) -> Tuple[ModSpecialMode, Mod]:
+    """
+    Space separated mods acronyms, optionally with 'freemod' (eg: 'DT freemod', 'DT HD HR')
+    """
+    parts = x.split(" ")
+    return (
+        ModSpecialMode.FREE_MODS if any(y == "freemod" for y in parts) else ModSpecialMode.NORMAL,
+        Mod.iterable_factory(parts)
+    )
+
+
+def game_mode(x: str) -> GameMode:
+    """
+    Db-like game mode (eg: 'std', 'taiko'). Defaults to std.
+    """
+    return GameMode.db_factory(x)
+
+
+def _converter(x: Any) -> Callable[[str], Any]:
+    # Old-style Arg, with a `schema` object
+    if hasattr(x, "validate"):
+        return x.validate
+    return x
+
+
+def compile_arguments(args: Tuple["plugins.base.Arg", ...]) -> Callable[[List[str]], Dict[str, Any]]:
+    """
+    Builds the parser for the arguments of a command, once.
+
+    Each argument is matched with the token at the same position. If an optional
+    argument is missing or not valid, it takes its default value.
+    If a required argument is missing or not valid, or if there are more tokens
+    than arguments, BotSyntaxError is raised.
+    If the last argument is `rest`, it receives all remaining tokens, joined by spaces.
+    Commands with no arguments ignore all tokens.
+
+    :param args: the arguments of the command
+    :return: function that receives the tokens and returns a dict of converted arguments
+    """
+    n = len(args)
+    rest = n > 0 and args[-1].rest
+    steps = tuple((x.key, _converter(x.converter), x.optional, x.default) for x in args)
+
+    def parse(parts: List[str]) -> Dict[str, Any]:
+        if n == 0:
+            return {}
+        if len(parts) > n:
+            if not rest:
+                raise plugins.base.BotSyntaxError(args)
+            parts = parts[:n - 1] + [" ".join(parts[n - 1:])]
+        result = {}
+        for i, (key, convert, optional, default) in enumerate(steps):
+            v = None
+            if i < len(parts):
+                try:
+                    v = convert(parts[i])
+                except CONVERSION_ERRORS:
+                    pass
+            if v is None:
+                if not optional:
+                    raise plugins.base.BotSyntaxError(args)
+                v = default
+            result[key] = v
+        return result
+    return parse
@@ -0,0 +1,81 @@
+import asyncio
+from typing import Callable, Any, Dict, List, Tuple, Optional, FrozenSet
+
+import plugins.base
+from plugins.base import utils
+
+
+class Step:
+    __slots__ = "before", "before_async", "after", "after_async", "keys"
+
+    def __init__(self, stage: "plugins.base.Stage", inner: Callable):
+        self.before = stage.before
+        self.before_async = asyncio.iscoroutinefunction(stage.before)
+        self.after = stage.after
+        self.after_async = asyncio.iscoroutinefunction(stage.after)
+        # Kwargs accepted by the next function, worked out once.
+        # None if everything must be passed through.
+        self.keys: Optional[FrozenSet[str]] = utils.accepted_kwargs(inner) if stage.filter_kwargs else None
+
+
+def unwrap(f: Callable) -> Tuple[List[Step], Callable]:
+    """
+    Walks a chain of staged decorators (see plugins.base.staged)
+
+    :param f: the outermost function, as returned by the decorators
+    :return: (steps, outermost first, the innermost function).
+             The innermost function is the handler, or the first decorator
+             that doesn't support stages.
+    """
+    steps = []
+    while getattr(f, "stage", None) is not None:
+        steps.append(Step(f.stage, f.inner))
+        f = f.inner
+    return steps, f
+
+
+def compile_command(f: Callable) -> Callable:
+    """
+    Compiles a command handler and its decorators into a single coroutine function.
+    Instead of going through one coroutine per decorator and inspecting signatures
+    on every call, the stages run in a flat loop with their kwargs filters
+    precomputed. Errors are handled like plugins.base.errors does.
+
+    :param f: the decorated handler
+    :return: coroutine function that accepts command_name and the handler kwargs
+    """
+    steps, handler = unwrap(f)
+    handler_async = asyncio.iscoroutinefunction(handler)
+
+    async def run(kwargs: Dict[str, Any]) -> Any:
+        # (step, kwargs that step received) for each step whose `after` must run
+        afters = []
+        for step in steps:
+            if step.before is not None:
+                r = await step.before(kwargs) if step.before_async else step.before(kwargs)
+                if r is not plugins.base.Stage.CONTINUE:
+                    result = r
+                    break
+            if step.after is not None:
+                # Copy, inner stages may edit kwargs in place
+                afters.append((step, dict(kwargs)))
+            if step.keys is not None:
+                kwargs = {k: v for k, v in kwargs.items() if k in step.keys}
+        else:
+            result = await handler(**kwargs) if handler_async else handler(**kwargs)
+        for step, received in reversed(afters):
+            result = await step.after(result, received) if step.after_async else step.after(result, received)
+        return result
+
+    async def pipeline(*, command_name: str, **kwargs) -> Any:
+        try:
+            return await run(kwargs)
+        except plugins.base.BOT_ERRORS as e:
+            return plugins.base.error_response(e, command_name)
+    # Logs and metrics show the handler, not the pipeline
+    pipeline.__module__ = handler.__module__
+    pipeline.__name__ = handler.__name__
+    pipeline.__qualname__ = handler.__qualname__
+    pipeline.steps = steps
+    pipeline.handler = handler
+    return pipeline
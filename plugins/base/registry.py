@@ -0,0 +1,210 @@
+import re
+from typing import Optional, Dict, List, Tuple, Callable, Pattern, Any
+
+import plugins.base
+
+# Flags that can be set on a part of a pattern with (?flags:...)
+_INLINE_FLAGS = ((re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.VERBOSE, "x"))
+_BACKREFERENCE = re.compile(r"\\[1-9]")
+# Inline global flags, eg: (?i). Only allowed at the start of the whole expression.
+_GLOBAL_FLAGS = re.compile(r"\(\?[aiLmsux]+\)")
+
+
+class CommandNode:
+    __slots__ = "children", "command"
+
+    def __init__(self):
+        self.children: Dict[str, "CommandNode"] = {}
+        self.command: Optional["plugins.base.Command"] = None
+
+
+class CommandRegistry:
+    """
+    A trie of commands, one level per word (eg: 'mp' -> 'make').
+    Built by Bot.command when plugins are imported, looked up once per chat message.
+    """
+
+    def __init__(self):
+        self.root = CommandNode()
+
+    def add(self, name: str, command: "plugins.base.Command") -> None:
+        """
+        Registers a command. An existing command with the same name is replaced.
+
+        :param name: lowercase command name, words separated by a space (eg: 'mp make')
+        :param command: the command or alias
+        :return:
+        """
+        node = self.root
+        for part in name.split(" "):
+            child = node.children.get(part, None)
+            if child is None:
+                child = node.children[part] = CommandNode()
+            node = child
+        node.command = command
+
+    def lookup(self, tokens: List[str]) -> Tuple[Optional["plugins.base.Command"], int]:
+        """
+        Finds the command triggered by a tokenized message, in a single pass.
+        The first (shortest) matching command wins.
+
+        :param tokens: the message without the command prefix, split on spaces.
+                       Tokens are lowercased as they're walked, the list is not modified.
+        :return: (command, number of tokens that make up the command name),
+                 or (None, 0) if the message doesn't trigger any command.
+                 The arguments of the command are tokens[n:]
+        """
+        node = self.root
+        for i, token in enumerate(tokens):
+            node = node.children.get(token.lower(), None)
+            if node is None:
+                return None, 0
+            if node.command is not None:
+                return node.command, i + 1
+        return None, 0
+
+    def subcommands(self, name: str) -> Dict[str, "plugins.base.Command"]:
+        """
+        Returns the commands directly below `name`, in registration order
+
+        :param name: parent command name (eg: 'mp')
+        :return: dict, subcommand name (eg: 'make') -> command
+        """
+        node = self.root
+        for part in name.split(" "):
+            node = node.children.get(part, None)
+            if node is None:
+                return {}
+        return {k: v.command for k, v in node.children.items() if v.command is not None}
+
+
+class RegexGroup:
+    """
+    All regex handlers that share the same `pre`, combined into a single alternation.
+    Each handler's pattern is wrapped in a named group (h0, h1...), the handler's own
+    groups follow it.
+    """
+    __slots__ = "pre", "combined", "handlers", "first_index", "pattern", "slices"
+
+    def __init__(self, pre: Optional[Callable], combined: bool = True):
+        self.pre = pre
+        # If False, the group has only one handler and its pattern is used as it is
+        self.combined = combined
+        # (registration index, handler)
+        self.handlers: List[Tuple[int, "plugins.base.RegexCommandWrapper"]] = []
+        self.first_index: int = 0
+        self.pattern: Optional[Pattern] = None
+        # Wrapper group name (None if not combined) -> (registration index, handler,
+        # slice of match.groups() with the handler's own groups)
+        self.slices: Dict[Optional[str], Tuple[int, "plugins.base.RegexCommandWrapper", slice]] = {}
+
+    def compile(self) -> None:
+        self.first_index = self.handlers[0][0]
+        if not self.combined:
+            index, handler = self.handlers[0]
+            self.pattern = handler.pattern
+            self.slices[None] = (index, handler, slice(None))
+            return
+        alternatives = []
+        group = 1
+        for i, (index, handler) in enumerate(self.handlers):
+            name = f"h{i}"
+            alternatives.append(f"(?P<{name}>{_scoped(handler.pattern)})")
+            self.slices[name] = (index, handler, slice(group, group + handler.pattern.groups))
+            group += 1 + handler.pattern.groups
+        self.pattern = re.compile("|".join(alternatives))
+
+
+def _scoped(pattern: Pattern) -> str:
+    """
+    Returns the source of a compiled pattern, with its flags turned into a scoped
+    inline flags group, so it can be combined with patterns that have different flags.
+
+    :param pattern: compiled pattern
+    :return: pattern source
+    """
+    flags = "".join(v for k, v in _INLINE_FLAGS if pattern.flags & k)
+    if not flags:
+        return f"(?:{pattern.pattern})"
+    # With re.VERBOSE, a trailing comment would swallow the closing parenthesis
+    return f"(?{flags}:{pattern.pattern}\n)" if pattern.flags & re.VERBOSE else f"(?{flags}:{pattern.pattern})"
+
+
+def _combinable(pattern: Pattern) -> bool:
+    # Named groups could clash with other patterns, numbered backreferences
+    # would point to the wrong group once the patterns are combined,
+    # and global flags can't be used inside the combined pattern
+    return not pattern.groupindex \
+        and not _BACKREFERENCE.search(pattern.pattern) \
+        and not _GLOBAL_FLAGS.search(pattern.pattern) \
+        and not pattern.flags & (re.ASCII | re.LOCALE)
+
+
+class RegexRegistry:
+    """
+    Regex handlers, grouped by their `pre`.
+    For each message, every `pre` is called once and every group is tested with a
+    single combined regex, instead of calling `pre` and testing the regex once per handler.
+    Handlers keep their priority: if more than one handler matches, the one
+    registered first wins, like with a linear scan.
+    """
+
+    def __init__(self):
+        self.handlers: List["plugins.base.RegexCommandWrapper"] = []
+        self._groups: Optional[List[RegexGroup]] = None
+
+    def add(self, handler: "plugins.base.RegexCommandWrapper") -> None:
+        self.handlers.append(handler)
+        self._groups = None
+
+    def _compile(self) -> List[RegexGroup]:
+        groups: Dict[Any, RegexGroup] = {}
+        compiled = []
+        for index, handler in enumerate(self.handlers):
+            if _combinable(handler.pattern):
+                group = groups.get(handler.pre, None)
+                if group is None:
+                    group = groups[handler.pre] = RegexGroup(handler.pre)
+                    compiled.append(group)
+            else:
+                # Gets its own group, but still shares the result of pre with the others
+                group = RegexGroup(handler.pre, combined=False)
+                compiled.append(group)
+            group.handlers.append((index, handler))
+        for group in compiled:
+            group.compile()
+        # Ordered by priority of their first handler
+        compiled.sort(key=lambda x: x.first_index)
+        return compiled
+
+    def match(self, **kwargs) -> Optional[Tuple["plugins.base.RegexCommandWrapper", Tuple[Any, ...]]]:
+        """
+        Finds the regex handler triggered by a message
+
+        :param kwargs: sender, recipient, pm and message. Passed to each `pre`.
+        :return: (handler, groups of the handler's pattern), or None
+        """
+        if self._groups is None:
+            self._groups = self._compile()
+        message = kwargs["message"]
+        pre_results = {}
+        best: Optional[Tuple[int, "plugins.base.RegexCommandWrapper", Tuple[Any, ...]]] = None
+        for group in self._groups:
+            if best is not None and group.first_index > best[0]:
+                # Nothing in here can beat what we've already found
+                break
+            if group.pre is not None:
+                ok = pre_results.get(group.pre, None)
+                if ok is None:
+                    ok = pre_results[group.pre] = bool(group.pre(**kwargs))
+                if not ok:
+                    continue
+            match = group.pattern.fullmatch(message)
+            if match is None:
+                continue
+            index, handler, groups = group.slices[match.lastgroup if group.combined else None]
+            if best is None or index < best[0]:
+                best = index, handler, match.groups()[groups]
+        if best is None:
+            return None
+        return best[1], best[2]
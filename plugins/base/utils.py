@@ -1,5 +1,6 @@
+import functools
 import inspect
-from typing import Callable, Dict, Any, Optional
+from typing import Callable, Dict, Any, Optional, FrozenSet
 
 import plugins
 import plugins.base
@@ -8,10 +9,10 @@ from utils.general import safefify_username
 
 
 async def username_to_client(username: str, game: bool = False) -> str:
-    user_id = await singletons.bot.Bot().ripple_api_client.what_id(username)
+    user_id = await singletons.bot.Bot().username_cache.get(username)
     if user_id is None:
         raise plugins.base.GenericBotError("No such user.")
-    client = await singletons.bot.Bot().bancho_api_client.get_client(user_id, game_only=game)
+    client = await singletons.bot.Bot().presence.get_client(user_id, game_only=game)
     if client is None:
         raise plugins.base.GenericBotError("This user is not connected right now")
     return client["api_identifier"]
@@ -26,7 +27,7 @@ async def username_to_client_multiplayer(username: str, match_id: int) -> str:
             return False
         return safefify_username(user.get("username")) == safefify_username(wanted_username)
 
-    match_info = await singletons.bot.Bot().bancho_api_client.get_match_info(match_id)
+    match_info = await singletons.bot.Bot().matches.get(match_id)
     if match_info is None:
         raise plugins.base.GenericBotError("No such multiplayer match.")
     api_identifier = next(
@@ -42,12 +43,37 @@ async def username_to_client_multiplayer(username: str, match_id: int) -> str:
 
 
 async def username_to_user_id(username: str) -> int:
-    user_id = await singletons.bot.Bot().ripple_api_client.what_id(username)
+    user_id = await singletons.bot.Bot().username_cache.get(username)
     if user_id is None:
         raise plugins.base.GenericBotError(f"No such user ({username})")
     return user_id
 
 
+@functools.lru_cache(maxsize=None)
+def accepted_kwargs(f: Callable) -> Optional[FrozenSet[str]]:
+    """
+    Returns the names of the keyword arguments accepted by `f`.
+    The result is cached, so the signature of each function is inspected only once.
+
+    :param f: a function
+    :return: frozenset of argument names, or None if `f` accepts any keyword argument (**kwargs)
+    """
+    parameters = inspect.signature(f).parameters.values()
+    if any(x.kind is inspect.Parameter.VAR_KEYWORD for x in parameters):
+        return None
+    return frozenset(x.name for x in parameters)
+
+
+def filter_kwargs(keys: Optional[FrozenSet[str]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    :param keys: the result of accepted_kwargs
+    :param kwargs: all kwargs
+    :return: only the kwargs in `keys`, or all of them if `keys` is None
+    """
+    if keys is None:
+        return kwargs
+    return {k: v for k, v in kwargs.items() if k in keys}
+
+
 def required_kwargs_only(f: Callable, **all_kwargs) -> Dict[str, Any]:
-    f_kwargs_keys = {k for k in inspect.signature(f).parameters.keys()}
-    return {k: v for k, v in all_kwargs.items() if k in f_kwargs_keys & all_kwargs.keys()}
+    return filter_kwargs(accepted_kwargs(f), all_kwargs)
@@ -1,5 +1,7 @@
 from typing import Dict, Any
 
+import asyncio
+
 from constants.action import Action
 from constants.events import WsEvent
 from singletons.bot import Bot
@@ -14,17 +16,24 @@ spect_beatmaps = {}
 
 async def init():
     bot.logger.debug("Subscribing to all currently available multiplayer matches")
-    for match in await bot.bancho_api_client.get_all_matches():
-        bot.client.send(WsSubscribeMatch(match["id"]))
-    bot.client.send(WsSubscribe(WsEvent.LOBBY))
-    bot.client.send(WsSubscribe(WsEvent.STATUS_UPDATES))
+    # Send all subscriptions at once and wait for the replies together,
+    # instead of one round trip at a time
+    subscriptions = [WsSubscribeMatch(x["id"]) for x in await bot.bancho_api_client.get_all_matches()]
+    subscriptions += [WsSubscribe(WsEvent.LOBBY), WsSubscribe(WsEvent.STATUS_UPDATES)]
+    results = await asyncio.gather(*(bot.client.request(x) for x in subscriptions), return_exceptions=True)
+    failed = sum(1 for x in results if isinstance(x, Exception))
+    if failed:
+        bot.logger.warning(f"{failed}/{len(subscriptions)} subscriptions did not get a reply")
 
 
 @bot.client.on("msg:lobby_match_added")
 async def match_added(**data):
     bot.logger.info(f"Match #{data['id']} added.")
-    bot.client.send(WsSubscribeMatch(data['id']))
-    await bot.client.wait("msg:subscribed")
+    try:
+        await bot.client.request(WsSubscribeMatch(data['id']))
+    except (asyncio.TimeoutError, ConnectionError):
+        bot.logger.warning(f"Could not subscribe to match #{data['id']}")
+        return
     bot.logger.debug(f"Subscribed to match #{data['id']}")
 
 
@@ -1,6 +1,5 @@
 from aiotinydb import AIOTinyDB
 
-from schema import Schema
 from tinydb import where
 
 import plugins.base
@@ -12,7 +11,7 @@ bot = Bot()
 
 
 @bot.command("faq")
-@plugins.base.arguments(plugins.base.Arg("topic", Schema(str)))
+@plugins.base.arguments(plugins.base.Arg("topic"))
 async def faq(topic: str) -> str:
     """
     !faq <topic>
@@ -31,8 +30,8 @@ async def faq(topic: str) -> str:
 @bot.command("modfaq")
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
 @plugins.base.arguments(
-    plugins.base.Arg("topic", Schema(str)),
-    plugins.base.Arg("new_response", Schema(str), rest=True),
+    plugins.base.Arg("topic"),
+    plugins.base.Arg("new_response", rest=True),
 )
 async def mod_faq(topic: str, new_response: str) -> str:
     """
@@ -62,7 +61,7 @@ async def ls_faq() -> str:
 
 @bot.command("delfaq")
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
-@plugins.base.arguments(plugins.base.Arg("topic", Schema(str)))
+@plugins.base.arguments(plugins.base.Arg("topic"))
 async def del_faq(topic: str) -> str:
     """
     !delfaq <topic>
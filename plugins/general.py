@@ -3,10 +3,9 @@ from typing import Optional, Dict, Any
 
 import random
 
-from schema import Use, And
-
 import plugins.base
 import plugins.base.filters
+from plugins.base import converters
 from constants.action import Action
 from constants.tournament_state import TournamentState
 from singletons.bot import Bot
@@ -17,7 +16,7 @@ bot = Bot()
 
 
 @bot.command("roll")
-@plugins.base.arguments(plugins.base.Arg("number", And(Use(int), lambda x: x > 0), default=100, optional=True))
+@plugins.base.arguments(plugins.base.Arg("number", converters.integer(min_=1), default=100, optional=True))
 async def roll(sender: Dict[str, Any], number: int, *, recipient: Dict[str, Any]) -> Optional[str]:
     """
     !roll <number>
@@ -86,13 +85,13 @@ async def bloodcat(recipient: Dict[str, Any]) -> Optional[str]:
     assert is_multi or is_spect
     temp_id = int(recipient["name"].split("_")[1])
     if is_multi:
-        match_info = await bot.bancho_api_client.get_match_info(temp_id)
+        match_info = await bot.matches.get(temp_id)
         if match_info.get("beatmap", None) is None:
             return
         beatmap_id = match_info["beatmap"]["id"]
         beatmap_name = match_info["beatmap"]["name"]
     else:
-        clients = await bot.bancho_api_client.get_clients(temp_id)
+        clients = await bot.presence.get_clients(temp_id)
         client = next(
             (
                 x for x in clients
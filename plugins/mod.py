@@ -1,11 +1,10 @@
 import datetime
 from typing import Callable, Dict, Any
 
-from schema import And, Use, Schema
-
 import plugins
 import plugins.base
 import plugins.base.utils
+from plugins.base import converters
 from constants.privileges import Privileges
 from constants.silence_units import SilenceUnit
 from singletons.bot import Bot
@@ -17,7 +16,7 @@ bot = Bot()
 @bot.command("moderated")
 @plugins.base.public_only
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
-@plugins.base.arguments(plugins.base.Arg("on", And(str, Use(lambda x: x.lower() == "on")), default=True, optional=True))
+@plugins.base.arguments(plugins.base.Arg("on", converters.flag("on"), default=True, optional=True))
 async def moderated(recipient: Dict[str, Any], on: int) -> str:
     await bot.bancho_api_client.moderated(recipient["name"], on)
     return f"This channel is {'now' if on else 'no longer'} in moderated mode"
@@ -25,7 +24,7 @@ async def moderated(recipient: Dict[str, Any], on: int) -> str:
 
 @bot.command("kick")
 @plugins.base.protected(Privileges.ADMIN_KICK_USERS)
-@plugins.base.arguments(plugins.base.Arg("username", And(str)))
+@plugins.base.arguments(plugins.base.Arg("username"))
 async def kick(username: str) -> str:
     api_identifier = await plugins.base.utils.username_to_client(username)
     try:
@@ -33,13 +32,15 @@ async def kick(username: str) -> str:
         return f"{username} has been kicked from the server."
     except NotFoundError:
         return f"{username} is not connected to bancho right now."
+    finally:
+        bot.presence.remove(api_identifier)
 
 
 @bot.command("rtx")
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
 @plugins.base.arguments(
-    plugins.base.Arg("username", And(str)),
-    plugins.base.Arg("the_message", And(str), rest=True)
+    plugins.base.Arg("username"),
+    plugins.base.Arg("the_message", rest=True)
 )
 async def rtx(username: str, the_message: str) -> str:
     api_identifier = await plugins.base.utils.username_to_client(username)
@@ -47,20 +48,23 @@ async def rtx(username: str, the_message: str) -> str:
         await bot.bancho_api_client.rtx(api_identifier, the_message)
         return ":ok_hand:"
     except NotFoundError:
+        # Our presence index was stale
+        bot.presence.remove(api_identifier)
         return "No such user."
 
 
 def set_allowed(new_api_allowed: int) -> Callable:
+    async def set_(kwargs: Dict[str, Any]) -> Any:
+        kwargs["user_id"] = await plugins.base.utils.username_to_user_id(kwargs["username"])
+        await bot.ripple_api_client.set_allowed(kwargs["user_id"], new_api_allowed)
+        return plugins.base.Stage.CONTINUE
+
     def wrapper(f: Callable):
-        @plugins.base.protected(Privileges.ADMIN_BAN_USERS)
-        @plugins.base.arguments(plugins.base.Arg("username", And(str)))
-        async def decorator(*, username: str, **kwargs) -> str:
-            target_user_id = await plugins.base.utils.username_to_user_id(username)
-            await bot.ripple_api_client.set_allowed(target_user_id, new_api_allowed)
-            return await f(**plugins.base.utils.required_kwargs_only(
-                f, user_id=target_user_id, username=username, **kwargs
-            ))
-        return decorator
+        return plugins.base.protected(Privileges.ADMIN_BAN_USERS)(
+            plugins.base.arguments(plugins.base.Arg("username"))(
+                plugins.base.staged(f, before=set_, filter_kwargs=True)
+            )
+        )
     return wrapper
 
 
@@ -85,10 +89,10 @@ async def restrict(username: str, user_id: int) -> str:
 @bot.command("silence")
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
 @plugins.base.arguments(
-    plugins.base.Arg("username", Schema(str)),
-    plugins.base.Arg("how_many", Schema(Use(int))),
-    plugins.base.Arg("unit", And(str, Use(SilenceUnit), error="Unit must be s/m/h/d"), example="s/m/h/d"),
-    plugins.base.Arg("reason", Schema(str), rest=True),
+    plugins.base.Arg("username"),
+    plugins.base.Arg("how_many", converters.integer()),
+    plugins.base.Arg("unit", converters.enum_value(SilenceUnit, type_=str), example="s/m/h/d"),
+    plugins.base.Arg("reason", rest=True),
 )
 async def silence(username: str, how_many: int, unit: SilenceUnit, reason: str) -> str:
     user_id = await plugins.base.utils.username_to_user_id(username)
@@ -104,7 +108,7 @@ async def silence(username: str, how_many: int, unit: SilenceUnit, reason: str)
 @bot.command("removesilence")
 @plugins.base.protected(Privileges.ADMIN_CHAT_MOD)
 @plugins.base.arguments(
-    plugins.base.Arg("username", Schema(str))
+    plugins.base.Arg("username")
 )
 async def remove_silence(username: str) -> str:
     user_id = await plugins.base.utils.username_to_user_id(username)
@@ -3,7 +3,6 @@ from typing import Optional, Dict, Any, Callable, Tuple
 import asyncio
 
 import logging
-from schema import Schema, Use, And
 
 import plugins.base
 import utils
@@ -11,10 +10,10 @@ from constants.mods import Mod, ModSpecialMode
 from constants.scoring_types import ScoringType
 from constants.team_types import TeamType
 from constants.teams import Team
-from plugins.base import Arg
+from plugins.base import Arg, converters
 from constants.privileges import Privileges
 from singletons.bot import Bot
-from utils import general, schema
+from utils import general
 from utils.rippleapi import BanchoApiBeatmap
 from constants.slot_statuses import SlotStatus
 from constants.game_modes import GameMode
@@ -23,18 +22,19 @@ bot = Bot()
 
 
 def resolve_mp(f: Callable) -> Callable:
-    async def wrapper(*, recipient: Dict[str, Any], **kwargs):
+    def resolve(kwargs: Dict[str, Any]) -> Any:
+        recipient = kwargs["recipient"]
         assert recipient["display_name"] == "#multiplayer"
-        match_id = int(recipient["name"].split("_")[1])
-        return await f(match_id=match_id, recipient=recipient, **kwargs)
-    return wrapper
+        kwargs["match_id"] = int(recipient["name"].split("_")[1])
+        return plugins.base.Stage.CONTINUE
+    return plugins.base.staged(f, before=resolve)
 
 
 @bot.command("mp make")
 @plugins.base.protected(Privileges.USER_TOURNAMENT_STAFF)
 @plugins.base.arguments(
-    plugins.base.Arg("name", Schema(str)),
-    plugins.base.Arg("password", Schema(str), default=None, optional=True),
+    plugins.base.Arg("name"),
+    plugins.base.Arg("password", default=None, optional=True),
 )
 async def make(name: str, password: Optional[str]) -> str:
     match_id = await bot.bancho_api_client.create_match(
@@ -48,7 +48,7 @@ async def make(name: str, password: Optional[str]) -> str:
 @bot.command("mp join")
 @plugins.base.protected(Privileges.USER_TOURNAMENT_STAFF)
 @plugins.base.arguments(
-    plugins.base.Arg("match_id", Use(int))
+    plugins.base.Arg("match_id", converters.integer())
 )
 async def join(sender: Dict[str, Any], match_id: int) -> str:
     await bot.bancho_api_client.join_match(sender["api_identifier"], match_id)
@@ -70,7 +70,7 @@ async def close(match_id: int, sender: Dict[str, Any]) -> None:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("slots", And(Use(int), lambda x: 2 <= x <= 16, error="The slots number must be between 2 and 16 (inclusive)"))
+    Arg("slots", converters.integer(2, 16))
 )
 async def size_(match_id: int, slots: int) -> str:
     await bot.bancho_api_client.resize_match(match_id, slots)
@@ -82,8 +82,8 @@ async def size_(match_id: int, slots: int) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("username", Schema(str)),
-    Arg("slot", And(Use(int), lambda x: 0 <= x < 16, error="The slots index must be between 0 and 16 (inclusive)"))
+    Arg("username"),
+    Arg("slot", converters.integer(0, 15))
 )
 async def move(username: str, slot: int, match_id: int) -> str:
     api_identifier = await plugins.base.utils.username_to_client_multiplayer(username, match_id)
@@ -96,7 +96,7 @@ async def move(username: str, slot: int, match_id: int) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("username", Schema(str))
+    Arg("username")
 )
 async def move(username: str, match_id: int) -> str:
     api_identifier = await plugins.base.utils.username_to_client_multiplayer(username, match_id)
@@ -119,8 +119,8 @@ async def clear_host(match_id: int) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("seconds", And(Use(int), lambda x: x >= 0), default=0, optional=True),
-    Arg("force", And(str, Use(lambda x: x == "force")), default=False, optional=True)
+    Arg("seconds", converters.integer(min_=0), default=0, optional=True),
+    Arg("force", converters.flag("force", ignore_case=False), default=False, optional=True)
 )
 async def start(match_id: int, seconds: int, recipient: Dict[str, Any], force: bool) -> str:
     async def start_after(timer_seconds: int):
@@ -189,7 +189,7 @@ async def abort(match_id: int) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("username", Schema(str))
+    Arg("username")
 )
 async def invite(match_id: int, username: str) -> str:
     user_id = await plugins.base.utils.username_to_user_id(username)
@@ -202,7 +202,7 @@ async def invite(match_id: int, username: str) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("username", Schema(str))
+    Arg("username")
 )
 async def kick(match_id: int, username: str) -> str:
     api_identifier = await plugins.base.utils.username_to_client_multiplayer(username, match_id)
@@ -215,10 +215,10 @@ async def kick(match_id: int, username: str) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("beatmap_id", And(Use(int))),
+    Arg("beatmap_id", converters.integer()),
     Arg(
         "game_mode",
-        And(Use(int), Use(GameMode)),
+        converters.enum_value(GameMode),
         optional=True,
         default=None,
         example="0=std, 1=taiko, 2=ctb, 3=mania"
@@ -238,7 +238,7 @@ async def map_(match_id: int, beatmap_id: int, game_mode: Optional[GameMode] = N
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("password", Schema(str), rest=True)
+    Arg("password", rest=True)
 )
 async def password(match_id: int, password: str) -> str:
     await bot.bancho_api_client.edit_match(match_id, password=password)
@@ -274,7 +274,7 @@ async def random_password(match_id: int, sender: Dict[str, Any]) -> str:
 @plugins.base.arguments(
     Arg(
         "mods",
-        schema.ModStringMultipleAndSpecialMode,
+        converters.mods_and_special_mode,
         rest=True,
         example="'DT freemod', 'DT HD HR'"
     )
@@ -293,8 +293,8 @@ async def mods_(match_id: int, mods: Tuple[ModSpecialMode, Mod]) -> str:
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("username", Schema(str)),
-    Arg("colour", And(Use(lambda x: Team[x.strip().upper()]), lambda x: x != Team.NEUTRAL), example="red/blue")
+    Arg("username"),
+    Arg("colour", converters.enum_name(Team, exclude=(Team.NEUTRAL,)), example="red/blue")
 )
 async def team(match_id: int, username: str, colour: Team) -> str:
     assert colour != Team.NEUTRAL
@@ -310,16 +310,16 @@ async def team(match_id: int, username: str, colour: Team) -> str:
 @plugins.base.arguments(
     Arg(
         "team_type",
-        And(Use(int), Use(TeamType)), example=", ".join(f"{x.name}={x.value}" for x in TeamType)
+        converters.enum_value(TeamType), example=", ".join(f"{x.name}={x.value}" for x in TeamType)
     ),
     Arg(
         "scoring_type",
-        And(Use(int), Use(ScoringType)),
+        converters.enum_value(ScoringType),
         optional=True, default=None,
         example=", ".join(f"{x.name}={x.value}" for x in ScoringType)
     ),
     Arg(
-        "size", Use(int),
+        "size", converters.integer(),
         optional=True, default=None
     ),
 )
@@ -341,7 +341,7 @@ async def set_(
 @resolve_mp
 @plugins.base.tournament_staff_or_host
 @plugins.base.arguments(
-    Arg("v", And(Use(int), lambda x: x in (1, 2)), example="1/2")
+    Arg("v", converters.integer(1, 2), example="1/2")
 )
 async def score_v(match_id: int, v: int) -> str:
     await bot.bancho_api_client.edit_match(
@@ -355,8 +355,8 @@ async def score_v(match_id: int, v: int) -> str:
 @plugins.base.base
 async def help_() -> str:
     cmd_list = '|'.join(
-        k + (f" (alias of {v.root_name})" if issubclass(type(v), plugins.base.CommandAlias) else "")
-        for k, v in bot.command_handlers["mp"].items()
+        k + (f" (alias of {v.root_name})" if type(v) is plugins.base.CommandAlias else "")
+        for k, v in bot.command_handlers.subcommands("mp").items()
     )
     return f"Supported subcommands: !mp <{cmd_list}>"
 
@@ -367,7 +367,7 @@ async def help_() -> str:
 @plugins.base.tournament_staff_or_host
 @plugins.base.base
 async def info(match_id: int) -> None:
-    info_ = await bot.bancho_api_client.get_match_info(match_id)
+    info_ = await bot.matches.get(match_id)
     r = f"#multi_{match_id}"
     bot.send_message("✱ ＭＡＴＣＨ ＩＮＦＯ ✱", r)
     bot.send_message(f"id: {info_['id']}, name: {info_['name']}, has password: {info_['has_password']}", r)
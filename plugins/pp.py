@@ -5,13 +5,12 @@ except ImportError:
 from typing import Optional, Callable, Any, Union, Dict
 
 import re
-from schema import And, Use
 
 import plugins.base
+from plugins.base import converters
 from singletons.bot import Bot
 from constants.game_modes import GameMode
 from constants.mods import Mod
-from utils import schema
 from utils.letsapi import LetsApiError
 from utils.np_storage import NpInfo
 
@@ -53,8 +52,8 @@ def resolve_np_info(f: Callable) -> Callable:
     :param f:
     :return:
     """
-    async def wrapper(*, sender: Dict[str, Any], **kwargs) -> Any:
-        redis_key = f"fokabot:np:{sender['api_identifier']}"
+    async def load(kwargs: Dict[str, Any]) -> Any:
+        redis_key = f"fokabot:np:{kwargs['sender']['api_identifier']}"
         try:
             with await bot.redis as conn:
                 np_data = await conn.get(redis_key)
@@ -67,11 +66,13 @@ def resolve_np_info(f: Callable) -> Callable:
                 raise KeyError()
         except KeyError:
             return "Please send me a song with /np first."
-        np_info = NpInfo(**json_data)
-        r = await f(np_info=np_info, sender=sender, **kwargs)
-        await save_np_info(sender, np_info)
+        kwargs["np_info"] = NpInfo(**json_data)
+        return plugins.base.Stage.CONTINUE
+
+    async def save(r: Any, kwargs: Dict[str, Any]) -> Any:
+        await save_np_info(kwargs["sender"], kwargs["np_info"])
         return r
-    return wrapper
+    return plugins.base.staged(f, before=load, after=save)
 
 
 def np_info_response(f: Callable) -> Callable:
@@ -91,11 +92,14 @@ def np_info_response(f: Callable) -> Callable:
     :param f:
     :return:
     """
-    async def wrapper(*, np_info: Optional[NpInfo] = None, **kwargs) -> Any:
-        r = await f(np_info=np_info, **kwargs)
+    def default(kwargs: Dict[str, Any]) -> Any:
+        kwargs.setdefault("np_info", None)
+        return plugins.base.Stage.CONTINUE
+
+    async def response(r: Any, kwargs: Dict[str, Any]) -> Any:
         if r is not None and type(r) is not NpInfo:
             return r
-        np_info = next((x for x in (r, np_info) if type(x) is NpInfo), None)
+        np_info = next((x for x in (r, kwargs["np_info"]) if type(x) is NpInfo), None)
         if np_info is not None:
             try:
                 return str(
@@ -108,7 +112,7 @@ def np_info_response(f: Callable) -> Callable:
                 )
             except LetsApiError as e:
                 return f"Error: {str(e)}"
-    return wrapper
+    return plugins.base.staged(f, before=default, after=response)
 
 
 async def last_inner(username: str, pm: bool) -> str:
@@ -175,7 +179,7 @@ async def np(sender: Dict[str, Any], message: str, **_) -> Union[NpInfo, str, No
 @bot.command("with")
 @plugins.base.private_only
 @plugins.base.arguments(
-    plugins.base.Arg("mods", schema.ModStringSingle),
+    plugins.base.Arg("mods", converters.mods),
     intersect_kwargs=False
 )
 @resolve_np_info
@@ -194,7 +198,7 @@ async def with_(mods: Mod, np_info: NpInfo, **_) -> None:
 @bot.command("acc")
 @plugins.base.private_only
 @plugins.base.arguments(
-    plugins.base.Arg("accuracy", And(str, Use(float), Use(lambda x: round(x, 2)), lambda x: 0 < x <= 100)),
+    plugins.base.Arg("accuracy", converters.real(0, 100, min_exclusive=True, digits=2)),
     intersect_kwargs=False
 )
 @resolve_np_info
@@ -217,7 +221,7 @@ async def acc(accuracy: float, np_info: NpInfo, **_) -> None:
 @bot.command("mode")
 @plugins.base.private_only
 @plugins.base.arguments(
-    plugins.base.Arg("game_mode", schema.GameModeString),
+    plugins.base.Arg("game_mode", converters.game_mode),
     intersect_kwargs=False
 )
 @resolve_np_info
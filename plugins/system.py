@@ -1,11 +1,12 @@
-from typing import Tuple
+import asyncio
+from typing import Tuple, Dict, Any
 import datetime
 
-from schema import And, Use
-
 import plugins.base
+from plugins.base import converters
 from constants.privileges import Privileges
 from singletons.bot import Bot
+from utils import profiler
 
 bot = Bot()
 
@@ -32,7 +33,7 @@ async def info() -> Tuple[str, ...]:
 @bot.command("system shutdown")
 @plugins.base.protected(Privileges.ADMIN_MANAGE_SERVERS)
 @plugins.base.arguments(
-    plugins.base.Arg("cancel", And(str, Use(lambda x: x.lower() == "cancel")), default=False, optional=True)
+    plugins.base.Arg("cancel", converters.flag("cancel"), default=False, optional=True)
 )
 async def shutdown(cancel: bool) -> str:
     """
@@ -57,3 +58,45 @@ async def recycle() -> str:
     if await bot.bancho_api_client.recycle():
         return "The server will be recycled very soon"
     return "The server is already recycling"
+
+
+@bot.command("system profile")
+@plugins.base.protected(Privileges.ADMIN_MANAGE_SERVERS)
+@plugins.base.arguments(
+    plugins.base.Arg("seconds", converters.integer(1, bot.profiler_max_seconds), example="10")
+)
+async def profile(seconds: int, sender: Dict[str, Any], recipient: Dict[str, Any], pm: bool) -> str:
+    """
+    !system profile <seconds>
+    Profiles in the background, so the other commands in this channel don't wait for it.
+    The handlers that took the most time are sent once done.
+
+    :return:
+    """
+    target = sender["username"] if pm else recipient["name"]
+
+    async def report(future: asyncio.Future) -> None:
+        try:
+            result = await future
+        except Exception as e:
+            bot.logger.error(f"Profiling failed ({e})")
+            bot.send_message("Profiling failed.", target)
+            return
+        if not result.samples:
+            bot.send_message("No samples collected.", target)
+            return
+        bot.send_message(
+            f"{result.samples} samples in {result.duration:.1f}s, "
+            f"{result.idle / result.samples:.1%} idle."
+            f"{f' Stacks saved to {result.path}' if result.path is not None else ''}",
+            target
+        )
+        for k, _, r in result.top(5):
+            bot.send_message(f"{r:.1%} {k}", target)
+
+    try:
+        future = profiler.start_profile(seconds, bot.profiles_path, bot.profiler_interval)
+    except profiler.ProfilerBusyError:
+        return "Already profiling, try again later."
+    asyncio.ensure_future(report(future))
+    return f"Profiling for {seconds} seconds."
\ No newline at end of file
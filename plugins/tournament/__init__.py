@@ -2,8 +2,8 @@ import logging
 from typing import Callable, Dict, Any
 
 from constants.tournament_state import TournamentState
+from plugins.base import Stage, staged
 from singletons.bot import Bot
-from utils import misirlou
 
 bot = Bot()
 logger = logging.getLogger("tournament")
@@ -18,35 +18,42 @@ def init():
 
 
 def resolve_match_update(f: Callable) -> Callable:
-    async def wrapper(match: Dict[str, Any], **kwargs):
-        if match["id"] not in bot.tournament_matches.keys():
+    def resolve_(kwargs: Dict[str, Any]) -> Any:
+        match_id = kwargs["match"]["id"]
+        if match_id not in bot.tournament_matches.keys():
             return
-        return await f(match=match, tournament_match=bot.tournament_matches[match["id"]], **kwargs)
-    return wrapper
+        kwargs["tournament_match"] = bot.tournament_matches[match_id]
+        return Stage.CONTINUE
+    return staged(f, before=resolve_)
 
 
 def resolve_event(f: Callable) -> Callable:
-    async def wrapper(match_id: int, **kwargs):
+    def resolve_(kwargs: Dict[str, Any]) -> Any:
+        match_id = kwargs.pop("match_id")
         if match_id not in bot.tournament_matches.keys():
             return
-        return await f(match=bot.tournament_matches[match_id], **kwargs)
-    return wrapper
+        kwargs["match"] = bot.tournament_matches[match_id]
+        return Stage.CONTINUE
+    return staged(f, before=resolve_)
 
 
 def resolve(f: Callable) -> Callable:
-    async def wrapper(*, recipient: Dict[str, Any], **kwargs):
+    def resolve_(kwargs: Dict[str, Any]) -> Any:
+        recipient = kwargs["recipient"]
         assert recipient["display_name"] == "#multiplayer"
         match_id = int(recipient["name"].split("_")[1])
         if match_id not in bot.tournament_matches.keys():
             return
-        return await f(match=bot.tournament_matches[match_id], recipient=recipient, **kwargs)
-    return wrapper
+        kwargs["match"] = bot.tournament_matches[match_id]
+        return Stage.CONTINUE
+    return staged(f, before=resolve_)
 
 
 def cap_or_team_members_only(f: Callable) -> Callable:
-    async def wrapper(*, sender: Dict[str, Any], match: misirlou.Match, **kwargs):
+    def check(kwargs: Dict[str, Any]) -> Any:
+        sender = kwargs["sender"]
         uid = sender["user_id"]
-        team = match.get_user_team(uid)
+        team = kwargs["match"].get_user_team(uid)
         if team is None:
             # Non-player (ref?) tried to trigger a player-only command, fail silently
             return
@@ -54,8 +61,8 @@ def cap_or_team_members_only(f: Callable) -> Callable:
             # Captain is in match, abort!
             return f"{sender['username']}, only the captain of your team can use this command."
         # Captain not in match, allow it
-        return await f(match=match, sender=sender, **kwargs)
-    return wrapper
+        return Stage.CONTINUE
+    return staged(f, before=check)
 
 
 def tournament_regex_pre(*, recipient: Dict[str, Any], pm: bool, **_) -> bool:
@@ -71,11 +78,12 @@ def tournament_regex_pre(*, recipient: Dict[str, Any], pm: bool, **_) -> bool:
 
 
 def state(s: TournamentState) -> Callable:
+    def check(kwargs: Dict[str, Any]) -> Any:
+        if kwargs["match"].state != s:
+            # Wrong state!
+            return
+        return Stage.CONTINUE
+
     def decorator(f: Callable) -> Callable:
-        async def wrapper(match: misirlou.Match, **kwargs) -> Any:
-            if match.state != s:
-                # Wrong state!
-                return
-            return await f(match=match, **kwargs)
-        return wrapper
+        return staged(f, before=check)
     return decorator
@@ -50,7 +50,7 @@ async def create_misirlou_match(misirlou_match: Dict[str, Any]) -> Optional[misi
 
     # Send invites
     for member in match.team_a.members + match.team_b.members:
-        if await bot.bancho_api_client.is_online(member, game_only=True):
+        if await bot.presence.is_online(member, game_only=True):
             bot.send_message(
                 f"Your match on tournament {match.tournament.name} is ready! "
                 f"\"[osump://{match.bancho_match_id}/{match.password} Click here to join it]\"",
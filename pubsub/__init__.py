@@ -4,6 +4,7 @@ except ImportError:
     import json
 
 import logging
+import time
 from typing import Any, Union, Callable
 
 from aioredis import Channel
@@ -11,6 +12,18 @@ from schema import Schema, And, Use, SchemaError
 
 # from utils import raven
 import singletons.bot
+from utils import metrics, tracing
+
+HANDLER_TIME = metrics.registry.histogram(
+    "fokabot_pubsub_handler_seconds",
+    "Time spent running redis pubsub handlers",
+    ("channel",)
+)
+HANDLER_ERRORS = metrics.registry.counter(
+    "fokabot_pubsub_handler_errors_total",
+    "Redis pubsub handlers that raised an unhandled exception",
+    ("channel",)
+)
 
 
 async def reader(channel: Channel):
@@ -36,7 +49,16 @@ async def reader(channel: Channel):
         # Check if we are able to handle this channel
         if channel_name in singletons.bot.Bot().pubsub_binding_manager:
             # Await/run the handler function/coroutine
-            await singletons.bot.Bot().pubsub_binding_manager[channel_name](message)
+            start = time.monotonic()
+            try:
+                with tracing.tracer.trace("pubsub_message", channel=channel_name), \
+                        tracing.tracer.span("dispatch", channel=channel_name):
+                    await singletons.bot.Bot().pubsub_binding_manager[channel_name](message)
+            except Exception:
+                HANDLER_ERRORS.inc(channel=channel_name)
+                logging.getLogger("pubsub").exception(f"Unhandled exception in pubsub handler ({channel_name})")
+            finally:
+                HANDLER_TIME.observe(time.monotonic() - start, channel=channel_name)
         else:   # pragma: no cover
             # Unregistered channel, do nothing
             logging.getLogger("pubsub").warning(
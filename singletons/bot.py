@@ -7,11 +7,23 @@ import sys
 import typing
 
 import plugins.base
+from plugins.base.pipeline import compile_command
+from plugins.base.registry import CommandRegistry, RegexRegistry
+from utils.backoff import Backoff
+from utils.batch_loader import BatchLoader
+from utils.http import HttpSessionPool
 from utils.init_hook import InitHook
+from utils.periodic_tasks import periodic_task
+from utils.loop_monitor import LoopMonitor
+from utils.match_registry import MatchRegistry
 from utils.misirlouapi import MisirlouApiClient
 from utils.osuapi import OsuAPIClient
+from utils.presence import PresenceIndex
+from utils.redis import TracedRedis
+from utils.username_cache import UsernameCache
 from ws.client import WsClient
-from ws.messages import WsChatMessage
+from ws.messages import WsChatMessage, WsSuspend
+from ws.scheduler import OutboundScheduler
 
 try:
     import ujson as json
@@ -27,12 +39,15 @@ import aioredis
 
 from pubsub import reader
 from pubsub.manager import PubSubBindingManager
-from utils import singleton, misirlou
+from utils import singleton, misirlou, tracing
 from utils.letsapi import LetsApiClient
 from utils.rippleapi import BanchoApiClient, RippleApiClient, CheesegullApiClient
 from constants.api_privileges import APIPrivileges
 
 
+RESUME_STATE_KEY = "fokabot:resume_state"
+
+
 @singleton.singleton
 class Bot:
     VERSION: str = "2.5.0"
@@ -50,6 +65,24 @@ class Bot:
         redis_host: str = "127.0.0.1", redis_port: int = 6379,
         redis_database: int = 0, redis_password: Optional[str] = None,
         redis_pool_size: int = 8, tinydb_path: str = None,
+        http_pool_limit_per_host: int = 32, http_dns_cache_ttl: int = 300,
+        http_keepalive_timeout: float = 30.0,
+        outbound_global_rate: float = 100, outbound_global_burst: float = 200,
+        outbound_recipient_rate: float = 5, outbound_recipient_burst: float = 10,
+        ws_handler_workers: int = 32,
+        reconnect_backoff_base: float = 0.5, reconnect_backoff_cap: float = 30.0,
+        reconnect_attempt_timeout: float = 10.0, outbound_max_buffered: int = 1000,
+        outbound_stats_max_recipients: int = 1000,
+        suspend_on_sigterm: bool = True, resume_state_ttl: int = 60,
+        ws_capture_path: Optional[str] = None,
+        loop_monitor_interval: float = 0.25, loop_block_threshold: float = 0.5,
+        profiler_interval: float = 0.005, profiler_max_seconds: int = 300, profiles_path: Optional[str] = None,
+        trace_sample_rate: float = 0, trace_export_path: str = "-",
+        username_cache_size: int = 10000, username_cache_ttl: float = 600,
+        username_cache_negative_ttl: float = 30, username_cache_redis: bool = False,
+        match_registry_max_age: float = 300, match_registry_reconcile_interval: int = 60,
+        presence_ttl: float = 120, presence_api_ttl: float = 5,
+        user_batch_window: float = 0.01, user_batch_size: int = 50,
     ):
         self.ready = False
         self.nickname = nickname
@@ -63,19 +96,61 @@ class Bot:
         self.osu_api_client = osu_api_client
         self.lets_api_client = lets_api_client
         self.misirlou_api_client = misirlou_api_client
+        # Username -> user id, shared through redis (once connected) if username_cache_redis is True
+        self.username_cache: UsernameCache = UsernameCache(
+            self.ripple_api_client,
+            max_size=username_cache_size, ttl=username_cache_ttl, negative_ttl=username_cache_negative_ttl
+        )
+        self.username_cache_redis = username_cache_redis
+        # Multiplayer matches, kept current by the ws events (see events.py)
+        self.matches: MatchRegistry = MatchRegistry(self.bancho_api_client, max_age=match_registry_max_age)
+        self.match_registry_reconcile_interval = match_registry_reconcile_interval
+        # Online clients, kept current by the status_update ws events (see events.py)
+        self.presence: PresenceIndex = PresenceIndex(
+            self.bancho_api_client, ttl=presence_ttl, api_ttl=presence_api_ttl
+        )
+        # User id -> user, lookups close to each other are sent as a single api request
+        self.users: BatchLoader = BatchLoader(
+            "users", lambda user_ids: self.ripple_api_client.get_users(user_ids),
+            window=user_batch_window, max_batch=user_batch_size
+        )
+
+        # One connection pool per upstream host, shared by all api clients
+        self.http_pool: HttpSessionPool = HttpSessionPool(
+            limit_per_host=http_pool_limit_per_host,
+            dns_cache_ttl=http_dns_cache_ttl,
+            keepalive_timeout=http_keepalive_timeout,
+        )
+        for client in (
+            self.bancho_api_client, self.ripple_api_client, self.cheesegull_api_client,
+            self.osu_api_client, self.lets_api_client, self.misirlou_api_client
+        ):
+            if client is not None:
+                client.http_pool = self.http_pool
 
         self.web_app: web.Application = web.Application()
         # self.privileges_cache: PrivilegesCache = PrivilegesCache(self.ripple_api_client)
         self.periodic_tasks: List[asyncio.Task] = []
+        # Disabled if the interval is 0
+        self.loop_monitor: Optional[LoopMonitor] = LoopMonitor(
+            interval=loop_monitor_interval, block_threshold=loop_block_threshold
+        ) if loop_monitor_interval > 0 else None
+        # On-demand profiler (!system profile, /api/v0/profile)
+        self.profiler_interval = profiler_interval
+        self.profiler_max_seconds = profiler_max_seconds
+        self.profiles_path = profiles_path
+        # Traces of chat messages and pubsub messages, disabled if the sample rate is 0
+        if trace_sample_rate > 0:
+            tracing.tracer.configure(trace_sample_rate, tracing.FileExporter(trace_export_path))
         if self.bancho_api_client is None or type(self.bancho_api_client) is not BanchoApiClient:
             raise RuntimeError("You must provide a valid BanchoApiClient")
         self.logger = logging.getLogger("fokabot")
         self.wss = wss
         if not wss:
             self.logger.warning("WSS is disabled")
-        self.command_handlers = {}
-        self.action_handlers = {}
-        self.regex_handlers: List[plugins.base.RegexCommandWrapper] = []
+        self.command_handlers: CommandRegistry = CommandRegistry()
+        self.action_handlers: CommandRegistry = CommandRegistry()
+        self.regex_handlers: RegexRegistry = RegexRegistry()
         self.command_prefix = commands_prefix
         self.reconnecting = False
         self.disposing = False
@@ -84,8 +159,26 @@ class Bot:
             if endpoint_base.startswith(x):
                 endpoint_base = endpoint_base[len(x):]
         self.client = WsClient(
-            f"{'wss' if self.wss else 'ws'}://{endpoint_base}/api/v2/ws"
+            f"{'wss' if self.wss else 'ws'}://{endpoint_base}/api/v2/ws",
+            handler_workers=ws_handler_workers,
+            capture_path=ws_capture_path,
         )
+        # All chat messages go through the scheduler, fairly and rate limited per recipient
+        self.outbound = OutboundScheduler(
+            self.client,
+            global_rate=outbound_global_rate,
+            global_burst=outbound_global_burst,
+            recipient_rate=outbound_recipient_rate,
+            recipient_burst=outbound_recipient_burst,
+            max_buffered=outbound_max_buffered,
+            stats_max_recipients=outbound_stats_max_recipients,
+        )
+        self.reconnect_backoff: Backoff = Backoff(base=reconnect_backoff_base, cap=reconnect_backoff_cap)
+        self.reconnect_attempt_timeout = reconnect_attempt_timeout
+        # Auth/resume/subscribe replies must time out before the reconnect attempt
+        # they're part of does, so their own error handling gets to run.
+        # Logging in takes two sequential requests (auth and subscribe), after connecting.
+        self.login_request_timeout = reconnect_attempt_timeout / 3
 
         self.redis_host = redis_host
         self.redis_port = redis_port
@@ -98,12 +191,20 @@ class Bot:
         self.tinydb_path = tinydb_path
 
         self._resume_token: Optional[str] = None
+        # If True, the bot will ask the server to suspend its session on shutdown,
+        # so the next instance can resume it instead of logging in from scratch
+        self.suspend_on_sigterm = suspend_on_sigterm
+        self.resume_state_ttl = resume_state_ttl
+        self._suspend_on_exit = False
 
         self.login_channels_left: Set[str] = set()
         self.joined_channels: Set[str] = set()
         self.match_delayed_start_tasks: Dict[int, asyncio.Task] = {}
         self.tournament_matches: Dict[int, misirlou.Match] = {}
         self.init_hooks: List[InitHook] = []
+        # Set once the init hooks have run in this process. A resumed session
+        # doesn't go through the login, which is where they usually run.
+        self.init_hooks_ran = False
 
     @property
     def suspended(self) -> bool:
@@ -120,13 +221,17 @@ class Bot:
 
     def send_message(self, message: str, recipient: Union[str, int]) -> None:
         """
-        Shorthand to send a message
+        Shorthand to send a message.
+        The message goes through the outbound scheduler.
 
         :param message:
         :param recipient:
         :return:
         """
-        self.client.send(WsChatMessage(message, recipient))
+        message = WsChatMessage(message, recipient)
+        # Finished by the ws writer, once the message is written to the socket
+        message.span = tracing.tracer.start_span("send_message", recipient=recipient)
+        self.outbound.enqueue(message)
 
     @property
     def loop(self) -> asyncio.AbstractEventLoop:
@@ -142,6 +247,7 @@ class Bot:
         for hook in self.init_hooks:
             self.logger.info(f"Running init hook for plugin {hook.plugin}")
             await hook.func() if inspect.iscoroutinefunction(hook.func) else hook.func()
+        self.init_hooks_ran = True
 
     def run(self) -> None:
         """
@@ -161,6 +267,9 @@ class Bot:
         self.web_app.add_routes([
             web.post("/api/v0/send_message", internal_api.handlers.send_message),
             web.post("/api/v0/last", internal_api.handlers.last),
+            web.post("/api/v0/profile", internal_api.handlers.profile),
+            web.get("/api/v0/outbound", internal_api.handlers.outbound),
+            web.get("/metrics", internal_api.handlers.metrics_),
         ])
         api_runner = web.AppRunner(self.web_app)
         self.loop.run_until_complete(api_runner.setup())
@@ -174,14 +283,29 @@ class Bot:
         #        self.loop.create_task(periodic_task(seconds=60)(self.np_storage.purge)),
         #    )
         # )
-
+        if self.loop_monitor is not None:
+            self.periodic_tasks.append(self.loop.create_task(self.loop_monitor.run()))
+        if self.match_registry_reconcile_interval > 0:
+            self.periodic_tasks.append(self.loop.create_task(
+                periodic_task(seconds=self.match_registry_reconcile_interval)(self.matches.reconcile)
+            ))
+        presence_purge_interval = max(self.presence.ttl, self.presence.api_ttl)
+        if presence_purge_interval > 0:
+            self.periodic_tasks.append(self.loop.create_task(
+                periodic_task(seconds=presence_purge_interval)(self.presence.purge)
+            ))
+
+        asyncio.get_event_loop().run_until_complete(self._load_resume_state())
+        self.outbound.start()
         asyncio.get_event_loop().run_until_complete(self._initialize_ws())
 
-        def term():
+        def term(suspend: bool = False):
+            self._suspend_on_exit = suspend
             self.loop.stop()
 
         self.loop.add_signal_handler(signal.SIGINT, term)
-        self.loop.add_signal_handler(signal.SIGTERM, term)
+        # SIGTERM means we're being restarted (eg: deploy), hand our session over to the next instance
+        self.loop.add_signal_handler(signal.SIGTERM, term, self.suspend_on_sigterm)
 
         try:
             self.loop.run_forever()
@@ -203,6 +327,10 @@ class Bot:
         self.logger.info("Disposing periodic tasks")
         for task in self.periodic_tasks:
             task.cancel()
+        self.outbound.stop()
+
+        if self._suspend_on_exit:
+            await self._suspend()
 
         self.logger.info("Disposing redis")
         self.redis.close()
@@ -219,6 +347,70 @@ class Bot:
         except Exception as e:
             self.logger.error(f"Error while closing ws connection ({e})")
 
+        self.logger.info("Disposing ws event handlers")
+        await self.client.dispose()
+
+        self.logger.info("Disposing http sessions")
+        await self.http_pool.close()
+        tracing.tracer.close()
+
+    async def _suspend(self) -> None:
+        """
+        Asks the server to suspend our session and saves the resume token,
+        the unsent chat messages and the joined channels to redis.
+        The outbound scheduler must be stopped already.
+
+        :return:
+        """
+        if not self.client.running or not self.ready or self.suspended:
+            self.logger.warning("Not logged in, cannot suspend. Shutting down normally.")
+            return
+        self.logger.info("Suspending session")
+        # Hold back all chat messages, the writer must send just the suspend request from now on
+        self.client.recycle_queue()
+        try:
+            reply = await self.client.request(WsSuspend())
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.logger.error(f"Could not suspend session ({e or type(e).__name__}). Shutting down normally.")
+            return
+        messages = self.outbound.drain()
+        messages = self.client.pending_messages() + messages
+        state = {
+            "token": reply.data["token"],
+            "messages": [x.data for x in messages if type(x) is WsChatMessage],
+            "channels": list(self.joined_channels),
+        }
+        await self.redis.set(RESUME_STATE_KEY, json.dumps(state), expire=self.resume_state_ttl)
+        self.logger.info(f"Session suspended, saved resume state ({len(state['messages'])} pending messages)")
+
+    async def _load_resume_state(self) -> None:
+        """
+        Loads the state saved by the previous instance when suspending, if any,
+        so the ws client resumes the old session instead of logging in
+
+        :return:
+        """
+        raw = await self.redis.get(RESUME_STATE_KEY, encoding="utf-8")
+        if raw is None:
+            return
+        # A session can be resumed only once
+        await self.redis.delete(RESUME_STATE_KEY)
+        try:
+            state = json.loads(raw)
+            token = state["token"]
+            messages = [WsChatMessage(x["message"], x["target"]) for x in state["messages"]]
+            channels = state["channels"]
+        except (ValueError, KeyError, TypeError) as e:
+            self.logger.error(f"Invalid resume state ({e}). Logging in normally.")
+            return
+        self.logger.info(f"Found resume state ({len(messages)} pending messages), resuming previous session")
+        self.resume_token = token
+        self.ready = True
+        self.joined_channels |= {x.lower() for x in channels}
+        # These will be held back and sent only if the session gets resumed
+        for message in messages:
+            self.client.send(message)
+
     def command(
         self, command_name: Union[str, List[str], Tuple[str]],
         action: bool = False, pre: Optional[Callable] = None, func: Optional[Callable] = None,
@@ -244,9 +436,8 @@ class Bot:
         """
         if func is None:
             return functools.partial(self.command, command_name, action, pre)  # type: ignore
-        wrapped = plugins.base.errors(func)
-        if not asyncio.iscoroutinefunction(wrapped):
-            wrapped = asyncio.coroutine(wrapped)
+        # Flattens the decorators of the handler, see plugins.base.pipeline
+        wrapped = compile_command(func)
         regex = isinstance(command_name, typing.Pattern)
         if type(command_name) not in (list, tuple):
             command_name = (command_name,)
@@ -257,30 +448,16 @@ class Bot:
         if regex:
             # Regex
             for pattern in command_name:
-                self.regex_handlers.append(
+                self.regex_handlers.add(
                     plugins.base.RegexCommandWrapper(pattern=pattern, handler=wrapped, pre=pre)
                 )
         else:
             # Classic command/action
             command_name = tuple(x.lower() for x in command_name)
             dest = self.action_handlers if action else self.command_handlers
-
-            def put_in_nested_dict(root, parts_, el):
-                d = root
-                for part in parts_[:-1]:
-                    if part not in d:
-                        d[part] = {}
-                    d = d[part]
-                d[parts_[-1]] = el
-
-            parts = command_name[0].split(" ")
-            put_in_nested_dict(dest, parts, plugins.base.CommandWrapper(command_name[0], wrapped, aliases=command_name[1:]))
+            dest.add(command_name[0], plugins.base.CommandWrapper(command_name[0], wrapped, aliases=command_name[1:]))
             for alias in command_name[1:]:
-                put_in_nested_dict(
-                    dest,
-                    alias.split(" "),
-                    plugins.base.CommandAlias(alias, wrapped, root_name=command_name[0])
-                )
+                dest.add(alias, plugins.base.CommandAlias(alias, wrapped, root_name=command_name[0]))
 
         # Always return original
         return functools.partial(func, command_name=command_name)
@@ -295,6 +472,9 @@ class Bot:
         self.ready = False
         self.login_channels_left.clear()
         self.joined_channels.clear()
+        # We may miss match and status events while we're logging in again
+        self.matches.clear()
+        self.presence.clear()
 
     async def _initialize_pubsub(self) -> None:
         import pubsub.handlers.message
@@ -319,8 +499,11 @@ class Bot:
             address=(self.redis_host, self.redis_port),
             db=self.redis_database,
             password=self.redis_password,
-            maxsize=self.redis_pool_size
+            maxsize=self.redis_pool_size,
+            commands_factory=TracedRedis
         )
+        if self.username_cache_redis:
+            self.username_cache.redis = self.redis
         self._pubsub_task = asyncio.ensure_future(self._initialize_pubsub())
         self.logger.info("Connected to Redis")
 
@@ -333,12 +516,14 @@ class Bot:
             self.loop.stop()
 
     async def _check_api_keys(self) -> None:
+        delta_client = RippleApiClient(
+            self.bancho_api_client.token,
+            self.ripple_api_client.base
+        )
+        delta_client.http_pool = self.http_pool
         for name, client, expected in (
             ("Ripple", self.ripple_api_client, APIPrivileges.all_privileges() & ~APIPrivileges.BANCHO),
-            ("Delta", RippleApiClient(
-                self.bancho_api_client.token,
-                self.ripple_api_client.base
-            ), APIPrivileges.all_privileges())
+            ("Delta", delta_client, APIPrivileges.all_privileges())
         ):
             self.logger.info(f"Checking {name} API key")
             r = await client.ping()
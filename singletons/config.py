@@ -47,6 +47,47 @@ class Config:
             "REDIS_POOL_SIZE": config("REDIS_POOL_SIZE", default="8", cast=int),
 
             "TINYDB_PATH": config("TINYDB_PATH", default=".db.json"),
+
+            "HTTP_POOL_LIMIT_PER_HOST": config("HTTP_POOL_LIMIT_PER_HOST", default="32", cast=int),
+            "HTTP_DNS_CACHE_TTL": config("HTTP_DNS_CACHE_TTL", default="300", cast=int),
+            "HTTP_KEEPALIVE_TIMEOUT": config("HTTP_KEEPALIVE_TIMEOUT", default="30", cast=float),
+
+            "OUTBOUND_GLOBAL_RATE": config("OUTBOUND_GLOBAL_RATE", default="100", cast=float),
+            "OUTBOUND_GLOBAL_BURST": config("OUTBOUND_GLOBAL_BURST", default="200", cast=float),
+            "OUTBOUND_RECIPIENT_RATE": config("OUTBOUND_RECIPIENT_RATE", default="5", cast=float),
+            "OUTBOUND_RECIPIENT_BURST": config("OUTBOUND_RECIPIENT_BURST", default="10", cast=float),
+
+            "WS_HANDLER_WORKERS": config("WS_HANDLER_WORKERS", default="32", cast=int),
+            "WS_CAPTURE_PATH": config("WS_CAPTURE_PATH", default=None),
+
+            "RECONNECT_BACKOFF_BASE": config("RECONNECT_BACKOFF_BASE", default="0.5", cast=float),
+            "RECONNECT_BACKOFF_CAP": config("RECONNECT_BACKOFF_CAP", default="30", cast=float),
+            "RECONNECT_ATTEMPT_TIMEOUT": config("RECONNECT_ATTEMPT_TIMEOUT", default="10", cast=float),
+            "OUTBOUND_MAX_BUFFERED": config("OUTBOUND_MAX_BUFFERED", default="1000", cast=int),
+            "OUTBOUND_STATS_MAX_RECIPIENTS": config("OUTBOUND_STATS_MAX_RECIPIENTS", default="1000", cast=int),
+
+            "SUSPEND_ON_SIGTERM": config("SUSPEND_ON_SIGTERM", default="1", cast=bool),
+            "RESUME_STATE_TTL": config("RESUME_STATE_TTL", default="60", cast=int),
+
+            "LOOP_MONITOR_INTERVAL": config("LOOP_MONITOR_INTERVAL", default="0.25", cast=float),
+            "LOOP_BLOCK_THRESHOLD": config("LOOP_BLOCK_THRESHOLD", default="0.5", cast=float),
+            "PROFILER_INTERVAL": config("PROFILER_INTERVAL", default="0.005", cast=float),
+            "PROFILER_MAX_SECONDS": config("PROFILER_MAX_SECONDS", default="300", cast=int),
+            "PROFILES_PATH": config("PROFILES_PATH", default="profiles"),
+            "TRACE_SAMPLE_RATE": config("TRACE_SAMPLE_RATE", default="0", cast=float),
+            "TRACE_EXPORT_PATH": config("TRACE_EXPORT_PATH", default="-"),
+
+            "USERNAME_CACHE_SIZE": config("USERNAME_CACHE_SIZE", default="10000", cast=int),
+            "USERNAME_CACHE_TTL": config("USERNAME_CACHE_TTL", default="600", cast=float),
+            "USERNAME_CACHE_NEGATIVE_TTL": config("USERNAME_CACHE_NEGATIVE_TTL", default="30", cast=float),
+            "USERNAME_CACHE_REDIS": config("USERNAME_CACHE_REDIS", default="0", cast=bool),
+
+            "MATCH_REGISTRY_MAX_AGE": config("MATCH_REGISTRY_MAX_AGE", default="300", cast=float),
+            "MATCH_REGISTRY_RECONCILE_INTERVAL": config("MATCH_REGISTRY_RECONCILE_INTERVAL", default="60", cast=int),
+            "PRESENCE_TTL": config("PRESENCE_TTL", default="120", cast=float),
+            "PRESENCE_API_TTL": config("PRESENCE_API_TTL", default="5", cast=float),
+            "USER_BATCH_WINDOW": config("USER_BATCH_WINDOW", default="0.01", cast=float),
+            "USER_BATCH_SIZE": config("USER_BATCH_SIZE", default="50", cast=int),
             
             "MISIRLOU_API_BASE": config("MISIRLOU_API_BASE", default="http://m7ure_nginx"),
             "MISIRLOU_API_TOKEN": config("MISIRLOU_API_TOKEN", default="foka")
@@ -0,0 +1,81 @@
+import unittest
+
+from schema import Schema, Use
+
+from plugins.base import Arg, BotSyntaxError, converters
+from plugins.base.converters import compile_arguments
+
+
+class CompileArgumentsTestCase(unittest.TestCase):
+    def test_no_arguments_ignores_tokens(self):
+        parse = compile_arguments(())
+        self.assertEqual(parse([]), {})
+        self.assertEqual(parse(["whatever", "else"]), {})
+
+    def test_required_arguments(self):
+        args = (Arg("user"), Arg("seconds", converters.integer(1, 10)))
+        parse = compile_arguments(args)
+        self.assertEqual(parse(["Some_User", "5"]), {"user": "Some_User", "seconds": 5})
+        for parts in ([], ["Some_User"], ["Some_User", "x"], ["Some_User", "11"]):
+            with self.assertRaises(BotSyntaxError) as cm:
+                parse(parts)
+            # Used to build the usage message
+            self.assertIs(cm.exception.args, args)
+
+    def test_optional_argument_missing_gets_default(self):
+        parse = compile_arguments((Arg("seconds", converters.integer(), default=10, optional=True),))
+        self.assertEqual(parse([]), {"seconds": 10})
+
+    def test_optional_argument_invalid_gets_default(self):
+        parse = compile_arguments((
+            Arg("seconds", converters.integer(1, 10)),
+            Arg("mode", converters.integer(0, 3), default=0, optional=True),
+        ))
+        self.assertEqual(parse(["3", "2"]), {"seconds": 3, "mode": 2})
+        self.assertEqual(parse(["3", "nope"]), {"seconds": 3, "mode": 0})
+        self.assertEqual(parse(["3", "4"]), {"seconds": 3, "mode": 0})
+
+    def test_converter_returning_none_is_not_valid(self):
+        parse = compile_arguments((Arg("user", lambda x: None, default="nobody", optional=True),))
+        self.assertEqual(parse(["Some_User"]), {"user": "nobody"})
+
+    def test_optional_argument_before_required_one(self):
+        parse = compile_arguments((
+            Arg("mode", converters.integer(0, 3), default=0, optional=True),
+            Arg("user"),
+        ))
+        self.assertEqual(parse(["2", "Some_User"]), {"mode": 2, "user": "Some_User"})
+        # Matched by position, an invalid optional argument doesn't shift the others
+        self.assertEqual(parse(["x", "Some_User"]), {"mode": 0, "user": "Some_User"})
+        with self.assertRaises(BotSyntaxError):
+            parse(["2"])
+
+    def test_rest_joins_remaining_tokens(self):
+        parse = compile_arguments((Arg("target"), Arg("text", rest=True)))
+        self.assertEqual(parse(["#osu", "hello", "there", "!"]), {"target": "#osu", "text": "hello there !"})
+        self.assertEqual(parse(["#osu", "hi"]), {"target": "#osu", "text": "hi"})
+        with self.assertRaises(BotSyntaxError):
+            parse(["#osu"])
+
+    def test_optional_rest(self):
+        parse = compile_arguments((Arg("reason", rest=True, default="No reason", optional=True),))
+        self.assertEqual(parse([]), {"reason": "No reason"})
+        self.assertEqual(parse(["being", "rude"]), {"reason": "being rude"})
+
+    def test_extra_tokens_raise(self):
+        args = (Arg("user"), Arg("seconds", converters.integer(), default=10, optional=True))
+        parse = compile_arguments(args)
+        with self.assertRaises(BotSyntaxError) as cm:
+            parse(["Some_User", "5", "extra"])
+        self.assertIs(cm.exception.args, args)
+
+    def test_schema_converters(self):
+        parse = compile_arguments((Arg("seconds", Use(int)), Arg("name", Schema(str), default=None, optional=True)))
+        self.assertEqual(parse(["5"]), {"seconds": 5, "name": None})
+        self.assertEqual(parse(["5", "x"]), {"seconds": 5, "name": "x"})
+        with self.assertRaises(BotSyntaxError):
+            parse(["five"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import asyncio
+import unittest
+from typing import Dict, Any, List
+from unittest import mock
+
+import utils.presence
+from utils.presence import PresenceIndex
+from utils.rippleapi import BanchoClientType, RippleApiResponseError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def client(user_id: int, type_: BanchoClientType = BanchoClientType.OSU, api_identifier: str = None) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "api_identifier": api_identifier if api_identifier is not None else f"{int(type_)}_{user_id}",
+        "type": type_,
+    }
+
+
+class FakeBanchoApi:
+    def __init__(self):
+        self.clients: Dict[int, List[Dict[str, Any]]] = {}
+        self.calls = 0
+        # Set to make get_clients wait, to test concurrent lookups
+        self.gate: asyncio.Event = None
+
+    async def get_clients(self, user_id: int) -> List[Dict[str, Any]]:
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if user_id < 0:
+            raise RippleApiResponseError({"code": 400, "message": "Invalid user id"})
+        return self.clients.get(user_id, [])
+
+
+class PresenceIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.clock = Clock()
+        patcher = mock.patch.object(utils.presence, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.api = FakeBanchoApi()
+        self.presence = PresenceIndex(self.api, ttl=120, api_ttl=5)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_(self, coro):
+        return self.loop.run_until_complete(coro)
+
+    def test_status_update_answers_from_memory(self):
+        self.presence.update(client(1))
+        self.assertTrue(self.run_(self.presence.is_online(1, game_only=True)))
+        self.assertEqual(self.api.calls, 0)
+
+    def test_unknown_user_falls_back_to_api(self):
+        self.api.clients[2] = [client(2, BanchoClientType.IRC)]
+        self.assertEqual(self.run_(self.presence.get_client(2))["user_id"], 2)
+        self.assertFalse(self.run_(self.presence.is_online(3)))
+        self.assertEqual(self.api.calls, 2)
+
+    def test_game_only_ignores_irc_clients(self):
+        self.api.clients[2] = [client(2, BanchoClientType.IRC)]
+        self.assertFalse(self.run_(self.presence.is_online(2, game_only=True)))
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+
+    def test_api_entries_expire_after_api_ttl(self):
+        self.api.clients[2] = [client(2)]
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+        self.clock.now += 4
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+        self.assertEqual(self.api.calls, 1)
+
+        # Logged out. There's no event for that, the api must be asked again.
+        self.api.clients[2] = []
+        self.clock.now += 1
+        self.assertFalse(self.run_(self.presence.is_online(2)))
+        self.assertEqual(self.api.calls, 2)
+        self.assertIsNone(self.presence.client(client(2)["api_identifier"]))
+
+    def test_status_update_entries_expire_after_ttl(self):
+        self.presence.update(client(1))
+        self.clock.now += 119
+        self.assertTrue(self.run_(self.presence.is_online(1)))
+        self.clock.now += 1
+        self.assertFalse(self.run_(self.presence.is_online(1)))
+        self.assertEqual(self.api.calls, 1)
+
+    def test_api_ttl_zero_does_not_store(self):
+        self.presence.api_ttl = 0
+        self.api.clients[2] = [client(2)]
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+        self.assertEqual(self.api.calls, 2)
+        self.assertEqual(self.presence._clients, {})
+
+    def test_concurrent_lookups_share_api_request(self):
+        self.api.clients[2] = [client(2)]
+        self.api.gate = asyncio.Event()
+
+        async def lookups():
+            tasks = [asyncio.ensure_future(self.presence.is_online(2)) for _ in range(5)]
+            await asyncio.sleep(0)
+            self.api.gate.set()
+            return await asyncio.gather(*tasks)
+        self.assertEqual(self.run_(lookups()), [True] * 5)
+        self.assertEqual(self.api.calls, 1)
+
+    def test_api_response_replaces_stale_clients(self):
+        old = client(2, api_identifier="old")
+        self.presence.update(old)
+        self.clock.now += 120
+        self.api.clients[2] = [client(2)]
+        clients = self.run_(self.presence.get_clients(2))
+        self.assertEqual([x["api_identifier"] for x in clients], [client(2)["api_identifier"]])
+        self.assertNotIn("old", self.presence._clients)
+
+    def test_status_update_during_api_request_is_kept(self):
+        self.api.clients[2] = []
+        self.api.gate = asyncio.Event()
+
+        async def lookup():
+            task = asyncio.ensure_future(self.presence.get_clients(2))
+            await asyncio.sleep(0)
+            self.clock.now += 1
+            self.presence.update(client(2))
+            self.api.gate.set()
+            return await task
+        self.assertEqual(self.run_(lookup()), [])
+        # The event is newer than the api response
+        self.assertTrue(self.run_(self.presence.is_online(2)))
+        self.assertEqual(self.api.calls, 1)
+
+    def test_invalid_user_is_offline(self):
+        self.assertFalse(self.run_(self.presence.is_online(-1)))
+
+    def test_remove_and_purge(self):
+        self.presence.update(client(1))
+        self.presence.update(client(2))
+        self.presence.remove(client(1)["api_identifier"])
+        self.assertNotIn(1, self.presence._users)
+        self.clock.now += 120
+        self.presence.purge()
+        self.assertEqual(self.presence._clients, {})
+        self.assertEqual(self.presence._users, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import re
+import unittest
+from typing import Optional, Tuple, Any
+
+from plugins.base import RegexCommandWrapper
+from plugins.base.registry import RegexRegistry
+
+
+async def handler(**_):
+    pass
+
+
+def linear_scan(handlers, **kwargs) -> Optional[Tuple[RegexCommandWrapper, Tuple[Any, ...]]]:
+    # What RegexRegistry replaces: call pre and test the regex of each handler, in order
+    for x in handlers:
+        if x.pre is not None and not x.pre(**kwargs):
+            continue
+        match = x.pattern.fullmatch(kwargs["message"])
+        if match is not None:
+            return x, match.groups()
+    return None
+
+
+class RegexRegistryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.pre_calls = 0
+
+        def is_pm(pm: bool, **_) -> bool:
+            self.pre_calls += 1
+            return pm
+        self.is_pm = is_pm
+        self.registry = RegexRegistry()
+
+    def add(self, pattern: str, pre=None, flags: int = 0) -> RegexCommandWrapper:
+        wrapper = RegexCommandWrapper(re.compile(pattern, flags), handler, pre=pre)
+        self.registry.add(wrapper)
+        return wrapper
+
+    def match(self, message: str, pm: bool = False):
+        return self.registry.match(sender={}, recipient={}, pm=pm, message=message)
+
+    def test_no_match(self):
+        self.add(r"hello")
+        self.assertIsNone(self.match("bye"))
+        self.assertIsNone(self.match("hello there"))
+
+    def test_groups_of_each_handler(self):
+        np = self.add(r"\x01ACTION is listening to \[https://osu\.ppy\.sh/b/(\d+) (.+)\](.*)\x01")
+        mp = self.add(r"!mp (\w+)(?: (\d+))?")
+        plain = self.add(r"ping")
+        self.assertEqual(
+            self.match("\x01ACTION is listening to [https://osu.ppy.sh/b/123 Song name] +Hidden\x01"),
+            (np, ("123", "Song name", " +Hidden"))
+        )
+        self.assertEqual(self.match("!mp start 10"), (mp, ("start", "10")))
+        self.assertEqual(self.match("!mp abort"), (mp, ("abort", None)))
+        self.assertEqual(self.match("ping"), (plain, ()))
+
+    def test_priority_order(self):
+        first = self.add(r"!(\w+)")
+        self.add(r"!help")
+        self.assertEqual(self.match("!help"), (first, ("help",)))
+
+        registry = self.registry = RegexRegistry()
+        specific = self.add(r"!help")
+        generic = self.add(r"!(\w+)")
+        self.assertIs(registry.match(sender={}, recipient={}, pm=False, message="!help")[0], specific)
+        self.assertEqual(self.match("!other"), (generic, ("other",)))
+
+    def test_priority_across_pre_groups(self):
+        # The pm-only handler is registered first, so it wins in pms, even if it's in another group
+        pm_only = self.add(r"hi (\w+)", pre=self.is_pm)
+        everywhere = self.add(r"hi (\w+)")
+        self.assertEqual(self.match("hi foka", pm=True), (pm_only, ("foka",)))
+        self.assertEqual(self.match("hi foka", pm=False), (everywhere, ("foka",)))
+
+    def test_pre_called_once_per_message(self):
+        self.add(r"a", pre=self.is_pm)
+        self.add(r"b", pre=self.is_pm)
+        self.add(r"c", pre=self.is_pm)
+        self.match("c", pm=True)
+        self.assertEqual(self.pre_calls, 1)
+
+    def test_uncombinable_patterns_keep_priority(self):
+        named = self.add(r"!np (?P<beatmap>\d+)")
+        backreference = self.add(r"(\w)\1!")
+        generic = self.add(r"!np (\d+)|(\w)(\w)!")
+        self.assertEqual(self.match("!np 5"), (named, ("5",)))
+        self.assertEqual(self.match("aa!"), (backreference, ("a",)))
+        self.assertEqual(self.match("ab!"), (generic, (None, "a", "b")))
+
+    def test_flags_are_scoped(self):
+        insensitive = self.add(r"hello (\w+)", flags=re.IGNORECASE)
+        sensitive = self.add(r"BYE (\w+)")
+        self.assertEqual(self.match("HELLO foka"), (insensitive, ("foka",)))
+        self.assertEqual(self.match("BYE foka"), (sensitive, ("foka",)))
+        self.assertIsNone(self.match("bye foka"))
+
+    def test_same_as_linear_scan(self):
+        patterns = (
+            (r"!(\w+)(?: (.*))?", None),
+            (r"!roll(?: (\d+))?", None),
+            (r"(\d+)\+(\d+)", self.is_pm),
+            (r"(?P<word>\w+)\?", None),
+            (r"(\w+)\?", self.is_pm),
+            (r"(?i)ping", None),
+            (r"pi(n)g|p(o)ng", self.is_pm),
+        )
+        handlers = [self.add(pattern, pre=pre) for pattern, pre in patterns]
+        messages = ("!roll 10", "!roll", "!mp start", "1+2", "why?", "ping", "PING", "pong", "nothing", "")
+        for message in messages:
+            for pm in (True, False):
+                with self.subTest(message=message, pm=pm):
+                    expected = linear_scan(handlers, sender={}, recipient={}, pm=pm, message=message)
+                    self.assertEqual(self.match(message, pm=pm), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
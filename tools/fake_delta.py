@@ -0,0 +1,372 @@
+"""
+A local stand-in for delta, to load test FokaBot without a real bancho server.
+
+It speaks the /api/v2/ws protocol used by WsClient and events.py (auth, subscribe,
+join_chat_channel, chat_message, ping/pong, suspend/resume), pushes match_update and
+status_update events to subscribers, and serves the REST endpoints called by
+BanchoApiClient (/api/v2/...) and RippleApiClient.ping (/api/v1/ping).
+
+Generated chat messages are commands (`!roll` by default) sent to channels and PMs.
+Every message sent by the bot to a recipient is matched to the oldest unanswered
+command sent to that recipient, so the command must reply with exactly one message.
+Throughput and end-to-end latency percentiles are printed periodically,
+the percentiles are computed on the samples of the last report interval only.
+
+Point the bot to it with:
+    WSS=0 BANCHO_API_BASE=http://127.0.0.1:5002 RIPPLE_API_BASE=http://127.0.0.1:5002
+
+Run with `python -m tools.fake_delta --help`
+"""
+import argparse
+import asyncio
+import logging
+import random
+import time
+import uuid
+from collections import deque
+from typing import Dict, Any, Deque, List, Optional, Set, Tuple
+
+import ujson as json
+from aiohttp import web, WSMsgType
+
+from constants.api_privileges import APIPrivileges
+from utils.rippleapi import BanchoClientType
+
+logger = logging.getLogger("fake_delta")
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+class Stats:
+    def __init__(self, max_samples: int = 10000):
+        self.generated = 0
+        self.replies = 0
+        self.unmatched_replies = 0
+        self.rest_requests = 0
+        self.rest_errors = 0
+        # Samples of the current report window, only the most recent ones are kept
+        self.latencies: Deque[float] = deque(maxlen=max_samples)
+        self.ping_rtts: Deque[float] = deque(maxlen=max_samples)
+        self.started_at = time.monotonic()
+
+    def report(self, pending: int) -> str:
+        elapsed = time.monotonic() - self.started_at
+        latencies = sorted(self.latencies)
+        rtts = sorted(self.ping_rtts)
+        self.latencies.clear()
+        self.ping_rtts.clear()
+        return (
+            f"{elapsed:.0f}s | generated {self.generated} ({self.generated / elapsed:.1f}/s), "
+            f"replies {self.replies} ({self.replies / elapsed:.1f}/s), unanswered {pending}, "
+            f"unmatched {self.unmatched_replies} | "
+            f"e2e ms p50 {percentile(latencies, .5) * 1000:.1f} p95 {percentile(latencies, .95) * 1000:.1f} "
+            f"p99 {percentile(latencies, .99) * 1000:.1f} max {percentile(latencies, 1) * 1000:.1f} | "
+            f"ping rtt ms p50 {percentile(rtts, .5) * 1000:.1f} p99 {percentile(rtts, .99) * 1000:.1f} | "
+            f"rest {self.rest_requests} ({self.rest_errors} injected errors)"
+        )
+
+
+class Connection:
+    def __init__(self, ws: web.WebSocketResponse):
+        self.ws = ws
+        self.authenticated = False
+        # (event, match id or None)
+        self.subscriptions: Set[Tuple[str, Optional[int]]] = set()
+        self.channels: Set[str] = set()
+        self.ping_sent_at: Deque[float] = deque()
+
+
+class FakeDelta:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.stats = Stats(args.max_samples)
+        self.connections: Set[Connection] = set()
+        self.channels = ["#osu", "#announce", "#admin"] + [f"#load_{i}" for i in range(args.channels)]
+        self.matches = list(range(1, args.matches + 1))
+        # Suspended sessions, token -> joined channels
+        self.suspended: Dict[str, Set[str]] = {}
+        # Unanswered commands, recipient -> send times
+        self.pending: Dict[str, Deque[float]] = {}
+
+    # Helpers
+
+    async def delay(self) -> None:
+        if self.args.latency > 0 or self.args.jitter > 0:
+            await asyncio.sleep(max(0.0, self.args.latency + random.uniform(-self.args.jitter, self.args.jitter)) / 1000)
+
+    async def send(self, connection: Connection, type_: str, data: Optional[Dict[str, Any]] = None) -> None:
+        if connection.ws.closed:
+            return
+        await connection.ws.send_str(json.dumps({"type": type_, "data": data if data is not None else {}}))
+
+    async def reply(self, connection: Connection, type_: str, data: Optional[Dict[str, Any]] = None) -> None:
+        await self.delay()
+        await self.send(connection, type_, data)
+
+    def subscribers(self, event: str, match_id: Optional[int] = None) -> List[Connection]:
+        return [
+            x for x in self.connections
+            if x.authenticated and ((event, match_id) in x.subscriptions or (event, None) in x.subscriptions)
+        ]
+
+    @staticmethod
+    def user(user_id: int) -> Dict[str, Any]:
+        return {
+            "user_id": user_id,
+            "username": f"LoadUser{user_id}",
+            "api_identifier": f"osu_{user_id}",
+            "type": BanchoClientType.OSU,
+            "privileges": 3,
+        }
+
+    # ws protocol
+
+    async def ws_handler(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        connection = Connection(ws)
+        self.connections.add(connection)
+        logger.info("Bot connected")
+        pinger = asyncio.ensure_future(self.pinger(connection))
+        try:
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                try:
+                    message = json.loads(message.data)
+                    await self.on_message(connection, message["type"], message.get("data", {}) or {})
+                except (ValueError, KeyError) as e:
+                    logger.warning(f"Invalid message from bot ({e}): {message}")
+        finally:
+            pinger.cancel()
+            self.connections.discard(connection)
+            logger.info("Bot disconnected")
+        return ws
+
+    async def on_message(self, connection: Connection, type_: str, data: Dict[str, Any]) -> None:
+        if type_ == "pong":
+            if connection.ping_sent_at:
+                self.stats.ping_rtts.append(time.monotonic() - connection.ping_sent_at.popleft())
+        elif type_ == "auth":
+            if self.args.token is not None and data.get("token", None) != self.args.token:
+                await self.reply(connection, "auth_failure")
+                return
+            connection.authenticated = True
+            await self.reply(connection, "auth_success")
+        elif type_ == "resume":
+            channels = self.suspended.pop(data.get("token", None), None)
+            if channels is None:
+                await self.reply(connection, "resume_failure")
+                return
+            connection.authenticated = True
+            connection.channels = channels
+            await self.reply(connection, "resume_success")
+        elif not connection.authenticated:
+            logger.warning(f"Got {type_} before auth")
+        elif type_ == "subscribe":
+            sub_data = data.get("data", None)
+            connection.subscriptions.add((data["event"], sub_data.get("match_id", None) if sub_data else None))
+            await self.reply(connection, "subscribed", data)
+        elif type_ == "join_chat_channel":
+            connection.channels.add(data["name"].lower())
+            await self.reply(connection, "chat_channel_joined", {"name": data["name"]})
+        elif type_ == "chat_message":
+            self.on_bot_chat_message(data["target"])
+        elif type_ == "suspend":
+            token = str(uuid.uuid4())
+            self.suspended[token] = connection.channels
+            await self.reply(connection, "suspend", {"token": token})
+            await connection.ws.close()
+        else:
+            logger.debug(f"Unhandled message type {type_}")
+
+    def on_bot_chat_message(self, target: str) -> None:
+        self.stats.replies += 1
+        pending = self.pending.get(str(target).lower(), None)
+        if not pending:
+            self.stats.unmatched_replies += 1
+            return
+        self.stats.latencies.append(time.monotonic() - pending.popleft())
+
+    async def pinger(self, connection: Connection) -> None:
+        while True:
+            await asyncio.sleep(self.args.ping_interval)
+            connection.ping_sent_at.append(time.monotonic())
+            await self.send(connection, "ping")
+
+    # Generators
+
+    async def every(self, rate: float, f) -> None:
+        """
+        Calls `f` `rate` times per second, catching up if the loop falls behind.
+        """
+        if rate <= 0:
+            return
+        interval = 1 / rate
+        next_at = time.monotonic()
+        while True:
+            next_at += interval
+            d = next_at - time.monotonic()
+            if d > 0:
+                await asyncio.sleep(d)
+            for connection in [x for x in self.connections if x.authenticated]:
+                await f(connection)
+
+    async def generate_chat_message(self, connection: Connection) -> None:
+        user_id = random.randint(1000, 1000 + self.args.users - 1)
+        sender = self.user(user_id)
+        channels = [x for x in self.channels if x.lower() in connection.channels]
+        if random.random() < self.args.pm_ratio or not channels:
+            pm, recipient, key = True, {"username": self.args.bot_nickname}, sender["username"]
+        else:
+            channel = random.choice(channels)
+            pm, recipient, key = False, {"name": channel}, channel
+        self.pending.setdefault(key.lower(), deque()).append(time.monotonic())
+        self.stats.generated += 1
+        await self.send(connection, "chat_message", {
+            "sender": sender,
+            "recipient": recipient,
+            "pm": pm,
+            "message": self.args.command,
+        })
+
+    async def generate_match_update(self, connection: Connection) -> None:
+        match_id = random.choice(self.matches)
+        if connection not in self.subscribers("multiplayer", match_id):
+            return
+        await self.send(connection, "match_update", {
+            "id": match_id,
+            "name": f"Load test match {match_id}",
+            # Beatmap ids <= 0 don't make the bot call external apis
+            "beatmap": {"id": 0, "name": "", "md5": ""},
+        })
+
+    async def generate_status_update(self, connection: Connection) -> None:
+        if connection not in self.subscribers("status_updates"):
+            return
+        user_id = random.randint(1000, 1000 + self.args.users - 1)
+        client = self.user(user_id)
+        client["action"] = {"id": 0, "text": "", "beatmap": {"id": 0}}
+        await self.send(connection, "status_update", {"client": client})
+
+    async def reporter(self) -> None:
+        while True:
+            await asyncio.sleep(self.args.report_interval)
+            logger.info(self.stats.report(sum(len(x) for x in self.pending.values())))
+
+    # REST
+
+    @web.middleware
+    async def rest_middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        if request.path.endswith("/ws"):
+            return await handler(request)
+        self.stats.rest_requests += 1
+        await self.delay()
+        if random.random() < self.args.error_rate:
+            self.stats.rest_errors += 1
+            return web.json_response({"code": 500, "message": "Injected error"}, status=500)
+        return await handler(request)
+
+    async def rest_ping(self, _: web.Request) -> web.Response:
+        return web.json_response({"code": 200, "privileges": int(APIPrivileges.all_privileges())})
+
+    async def rest_channels(self, _: web.Request) -> web.Response:
+        return web.json_response({
+            "code": 200,
+            "channels": [{"name": x, "description": "", "public_read": True, "public_write": True} for x in self.channels]
+        })
+
+    async def rest_matches(self, _: web.Request) -> web.Response:
+        return web.json_response({"code": 200, "matches": [{"id": x} for x in self.matches]})
+
+    async def rest_clients(self, request: web.Request) -> web.Response:
+        try:
+            user_id = int(request.match_info["user"])
+        except ValueError:
+            return web.json_response({"code": 400, "message": "Invalid user id"}, status=400)
+        clients = [self.user(user_id)] if 1000 <= user_id < 1000 + self.args.users else []
+        return web.json_response({"code": 200, "clients": clients})
+
+    async def rest_system(self, _: web.Request) -> web.Response:
+        return web.json_response({
+            "code": 200,
+            "online_users": self.args.users,
+            "running_matches": len(self.matches),
+            "uptime": int(time.monotonic() - self.stats.started_at),
+        })
+
+    async def rest_ok(self, _: web.Request) -> web.Response:
+        # Every other write endpoint (alerts, kicks, mp commands...) just succeeds
+        return web.json_response({"code": 200, "match_id": 1})
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self.rest_middleware])
+        app.add_routes([
+            web.get("/api/v2/ws", self.ws_handler),
+            web.get("/api/v1/ping", self.rest_ping),
+            web.get("/api/v2/chat_channels", self.rest_channels),
+            web.get("/api/v2/multiplayer", self.rest_matches),
+            web.get("/api/v2/clients/{user}", self.rest_clients),
+            web.get("/api/v2/system", self.rest_system),
+            web.route("*", "/api/v2/{tail:.*}", self.rest_ok),
+        ])
+        return app
+
+    async def start(self) -> None:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, self.args.host, self.args.port).start()
+        logger.info(f"Fake delta listening on {self.args.host}:{self.args.port}")
+        for rate, f in (
+            (self.args.chat_rate, self.generate_chat_message),
+            (self.args.match_rate, self.generate_match_update),
+            (self.args.status_rate, self.generate_status_update),
+        ):
+            asyncio.ensure_future(self.every(rate, f))
+        asyncio.ensure_future(self.reporter())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in for delta, for load and latency testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5002)
+    parser.add_argument("--token", default=None, help="Accepted auth token. Any token if not set.")
+    parser.add_argument("--bot-nickname", default="FokaBot")
+    parser.add_argument("--latency", type=float, default=0, help="Latency added to ws replies and REST calls (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="Random +/- jitter added to the latency (ms)")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of REST calls that fail with a 500")
+    parser.add_argument("--chat-rate", type=float, default=10, help="Generated chat messages per second")
+    parser.add_argument("--match-rate", type=float, default=0, help="Generated match updates per second")
+    parser.add_argument("--status-rate", type=float, default=0, help="Generated status updates per second")
+    parser.add_argument("--pm-ratio", type=float, default=0.5, help="Fraction of chat messages sent as PMs")
+    parser.add_argument("--command", default="!roll", help="Message sent to the bot. Must produce one reply.")
+    parser.add_argument("--channels", type=int, default=20, help="Extra channels besides #osu, #announce and #admin")
+    parser.add_argument("--users", type=int, default=1000, help="Number of distinct fake users")
+    parser.add_argument("--matches", type=int, default=50, help="Number of multiplayer matches")
+    parser.add_argument("--ping-interval", type=float, default=5)
+    parser.add_argument("--report-interval", type=float, default=5)
+    parser.add_argument(
+        "--max-samples", type=int, default=10000,
+        help="Max latency samples kept for each report interval. The most recent ones are kept."
+    )
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    loop = asyncio.get_event_loop()
+    server = FakeDelta(args)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info(server.stats.report(sum(len(x) for x in server.pending.values())))
+
+
+if __name__ == '__main__':
+    main()
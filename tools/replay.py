@@ -0,0 +1,230 @@
+"""
+Replays a ws capture (see WS_CAPTURE_PATH) against the bot's event handlers.
+
+Every captured frame goes through WsClient.feed, exactly like a live frame, so it
+reaches events.on_message and all handlers registered by the plugins, on the
+bot's own dispatcher. No connection is made: the bot is built with stubbed api
+clients that answer every http request with an empty successful response, and
+outgoing ws messages are counted and thrown away (requests, such as the
+subscriptions sent by the plugins' init hooks, are considered acknowledged).
+Redis is not available, handlers that need it will fail and be counted as errors.
+
+Reports frames per second, messages sent by the bot and per-handler latency.
+
+Run with `python -m tools.replay capture.tsv [--speed 1] [--plugins general,faq]`
+"""
+import argparse
+import asyncio
+import functools
+import importlib
+import logging
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple, Callable, Iterator, Any, Optional
+
+from tools.fake_delta import percentile
+from utils.init_hook import InitHook
+
+DEFAULT_PLUGINS = "general,faq,alert,mod,system,pp,multiplayer,beatmaps,tournament"
+
+
+class StubResponse:
+    def __init__(self, url: str, latency: float):
+        self.url = url
+        self.latency = latency
+        self.status = 200
+
+    async def __aenter__(self) -> "StubResponse":
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        pass
+
+    async def json(self, *_, **__) -> Any:
+        if "osu.ppy.sh" in self.url:
+            # osu!api returns lists
+            return []
+        return {"code": 200, "clients": [], "channels": [], "matches": [], "users": []}
+
+    async def text(self) -> str:
+        return ""
+
+
+class StubSession:
+    def __init__(self, pool: "StubHttpPool"):
+        self.pool = pool
+
+    def _request(self, method: str, url: str, **_) -> StubResponse:
+        self.pool.requests[method] += 1
+        return StubResponse(str(url), self.pool.latency)
+
+    get = functools.partialmethod(_request, "GET")
+    post = functools.partialmethod(_request, "POST")
+    delete = functools.partialmethod(_request, "DELETE")
+
+
+class StubHttpPool:
+    """
+    Drop-in replacement for utils.http.HttpSessionPool that never touches the network
+    """
+    def __init__(self, latency: float = 0):
+        self.latency = latency
+        self.requests: Dict[str, int] = defaultdict(int)
+        self._session = StubSession(self)
+
+    def session(self, _: str) -> StubSession:
+        return self._session
+
+    async def close(self) -> None:
+        pass
+
+
+class HandlerStats:
+    def __init__(self):
+        self.times: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+        self.errors: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    def timed(self, event: str, handler: Callable) -> Callable:
+        k = (event, f"{handler.__module__}.{handler.__qualname__}")
+
+        @functools.wraps(handler)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                self.errors[k] += 1
+                raise
+            finally:
+                self.times[k].append(time.perf_counter() - start)
+        return wrapper
+
+    def report(self) -> str:
+        lines = [f"{'event':<28} {'handler':<48} {'calls':>8} {'err':>6} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'maxms':>8}"]
+        for (event, handler), times in sorted(self.times.items(), key=lambda x: -sum(x[1])):
+            times = sorted(times)
+            lines.append(
+                f"{event:<28} {handler[-48:]:<48} {len(times):>8} {self.errors[(event, handler)]:>6} "
+                + " ".join(f"{percentile(times, p) * 1000:>8.2f}" for p in (.5, .95, .99, 1))
+            )
+        return "\n".join(lines)
+
+
+def read_capture(path: str) -> Iterator[Tuple[float, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            ts, sep, frame = line.rstrip("\n").partition("\t")
+            if not sep:
+                continue
+            yield float(ts), frame
+
+
+def build_bot(api_latency: float, workers: int):
+    """
+    Builds the bot singleton with stubbed api clients.
+    Must be called before importing events and plugins.
+    """
+    from singletons.bot import Bot
+    from utils.letsapi import LetsApiClient
+    from utils.misirlouapi import MisirlouApiClient
+    from utils.osuapi import OsuAPIClient
+    from utils.rippleapi import BanchoApiClient, RippleApiClient, CheesegullApiClient
+
+    bot = Bot(
+        wss=False,
+        bancho_api_client=BanchoApiClient("replay", "http://delta.invalid"),
+        ripple_api_client=RippleApiClient("replay", "http://ripple.invalid"),
+        lets_api_client=LetsApiClient("http://lets.invalid"),
+        cheesegull_api_client=CheesegullApiClient("http://cheesegull.invalid"),
+        osu_api_client=OsuAPIClient("replay"),
+        misirlou_api_client=MisirlouApiClient("replay", "http://misirlou.invalid"),
+        ws_handler_workers=workers,
+    )
+    bot.http_pool = StubHttpPool(api_latency)
+    for client in (
+        bot.bancho_api_client, bot.ripple_api_client, bot.cheesegull_api_client,
+        bot.osu_api_client, bot.lets_api_client, bot.misirlou_api_client
+    ):
+        client.http_pool = bot.http_pool
+    # We're "logged in" and in every channel
+    bot.ready = True
+    bot.client.running = True
+    return bot
+
+
+async def replay(bot, path: str, speed: Optional[float]) -> Tuple[int, float]:
+    frames = 0
+    start = time.perf_counter()
+    first_ts = None
+    for ts, frame in read_capture(path):
+        if speed is not None:
+            if first_ts is None:
+                first_ts = ts
+            d = (ts - first_ts) / speed - (time.perf_counter() - start)
+            if d > 0:
+                await asyncio.sleep(d)
+        bot.client.feed(frame)
+        frames += 1
+        if frames % 256 == 0:
+            # Let handlers run, as the reader would while waiting for the next frame
+            await asyncio.sleep(0)
+    # Wait for all handlers to complete
+    while bot.client.dispatcher.backlog or bot.client.dispatcher.in_flight:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    await bot.client.dispose()
+    return frames, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replays a ws capture against the bot's handlers")
+    parser.add_argument("capture", help="Capture file, written by the bot when WS_CAPTURE_PATH is set")
+    parser.add_argument(
+        "--speed", type=float, default=None,
+        help="Replay at recorded speed times this factor (eg: 1, 2). As fast as possible if not set."
+    )
+    parser.add_argument("--plugins", default=DEFAULT_PLUGINS, help="Comma separated list of plugins to load")
+    parser.add_argument("--api-latency", type=float, default=0, help="Latency of stubbed api calls (ms)")
+    parser.add_argument("--workers", type=int, default=32, help="Handler workers")
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    bot = build_bot(args.api_latency / 1000, args.workers)
+    sent = defaultdict(int)
+
+    def count(message) -> None:
+        sent[message.type_] += 1
+
+    async def request(message, *_, **__) -> None:
+        # There's no server to reply, consider every request acknowledged
+        count(message)
+    bot.client.send = count
+    bot.client.request = request
+    bot.outbound.enqueue = count
+
+    # Same as fokabot.py. Init hooks (which may register more handlers) run right away, since we're "logged in".
+    import events   # noqa: F401
+    for plugin in args.plugins.split(","):
+        plugin = plugin.strip()
+        imported_plugin = importlib.import_module(f"plugins.{plugin}")
+        if hasattr(imported_plugin, "init"):
+            bot.init_hooks.append(InitHook(plugin, getattr(imported_plugin, "init")))
+    asyncio.get_event_loop().run_until_complete(bot.run_init_hooks())
+
+    stats = HandlerStats()
+    for event, handlers in bot.client._event_handlers.items():
+        if event.startswith("msg:"):
+            handlers[:] = [stats.timed(event, x) for x in handlers]
+
+    frames, elapsed = asyncio.get_event_loop().run_until_complete(replay(bot, args.capture, args.speed))
+    print(f"Replayed {frames} frames in {elapsed:.2f}s ({frames / elapsed:,.0f} frames/s)")
+    print(f"Sent: {dict(sent)}")
+    print(f"Api calls: {dict(bot.http_pool.requests)}")
+    print(stats.report())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Prints the traces exported by the bot (see TRACE_SAMPLE_RATE and TRACE_EXPORT_PATH)
+as trees, slowest first, with the duration of each span and where it started,
+relative to the start of the trace.
+
+       +0.00ms    41.98ms chat_message sender=Some_User recipient=#osu
+       +0.02ms      41.90ms dispatch kind=command command=with alias=with
+       +0.05ms         1.10ms redis command=GET
+       +1.20ms        40.35ms lets method=GET route=v1/pp status=200
+      +41.96ms       0.31ms send_message recipient=#osu queue_wait=0.0002
+
+Run with `python -m tools.traces traces.jsonl [--top 10] [--name chat_message] [--min-ms 0]`
+"""
+import argparse
+import json
+from collections import defaultdict
+from typing import Dict, List, Any
+
+
+def read_spans(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    traces = defaultdict(list)
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                span = json.loads(line)
+            except ValueError:
+                continue
+            traces[span["trace_id"]].append(span)
+    return traces
+
+
+def format_span(span: Dict[str, Any]) -> str:
+    parts = [f"{span['duration'] * 1000:8.2f}ms", span["name"]]
+    parts.extend(f"{k}={v}" for k, v in span["attributes"].items() if v is not None)
+    if span["error"] is not None:
+        parts.append(f"ERROR: {span['error']}")
+    return " ".join(parts)
+
+
+def print_trace(spans: List[Dict[str, Any]], root: Dict[str, Any]) -> None:
+    children = defaultdict(list)
+    for span in spans:
+        children[span["parent_id"]].append(span)
+
+    def visit(span: Dict[str, Any], depth: int) -> None:
+        offset = (span["start"] - root["start"]) * 1000
+        print(f"{f'+{offset:.2f}ms':>10} {'  ' * depth}{format_span(span)}")
+        for child in sorted(children[span["span_id"]], key=lambda x: x["start"]):
+            visit(child, depth + 1)
+    visit(root, 0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Prints the slowest traces exported by the bot")
+    parser.add_argument("traces", help="Traces file, written by the bot when TRACE_SAMPLE_RATE is set")
+    parser.add_argument("--top", type=int, default=10, help="Number of traces to print")
+    parser.add_argument("--name", default=None, help="Only traces whose root span has this name")
+    parser.add_argument("--min-ms", type=float, default=0, help="Only traces that took at least this long")
+    args = parser.parse_args()
+
+    roots = []
+    traces = read_spans(args.traces)
+    for trace_id, spans in traces.items():
+        root = next((x for x in spans if x["parent_id"] is None), None)
+        if root is None:
+            # The root span is still running, or it wasn't exported
+            continue
+        if args.name is not None and root["name"] != args.name:
+            continue
+        if root["duration"] * 1000 < args.min_ms:
+            continue
+        roots.append(root)
+    roots.sort(key=lambda x: -x["duration"])
+    print(f"{len(roots)} traces, {sum(len(x) for x in traces.values())} spans")
+    for root in roots[:args.top]:
+        print()
+        print_trace(traces[root["trace_id"]], root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import random
+
+
+class Backoff:
+    """
+    Exponential backoff with full jitter.
+    The first attempt is immediate, the n-th retry waits a random amount of
+    time between 0 and min(cap, base * factor ** (n - 1)) seconds, so a fleet
+    of clients doesn't retry in lockstep.
+    """
+
+    def __init__(self, base: float = 0.5, cap: float = 30.0, factor: float = 2.0):
+        """
+        Initializes a new Backoff
+
+        :param base: upper bound of the first retry delay, in seconds
+        :param cap: maximum delay, in seconds
+        :param factor: growth factor of the upper bound
+        """
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempts = 0
+
+    def next(self) -> float:
+        """
+        Returns how long to wait before the next attempt, and counts it
+
+        :return: delay in seconds
+        """
+        attempts = self.attempts
+        self.attempts += 1
+        if attempts == 0:
+            return 0
+        # Don't compute factor ** attempts forever, it'd overflow after a long outage
+        upper = self.cap if attempts > 64 else min(self.cap, self.base * self.factor ** (attempts - 1))
+        return random.uniform(0, upper)
+
+    def reset(self) -> None:
+        """
+        Starts over, the next attempt will be immediate again
+
+        :return:
+        """
+        self.attempts = 0
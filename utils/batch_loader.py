@@ -0,0 +1,90 @@
+import asyncio
+from typing import Dict, Any, Callable, Awaitable, Hashable, List, Optional
+
+from utils import metrics
+
+LOADS = metrics.registry.counter(
+    "fokabot_batch_loader_loads_total",
+    "Keys requested through a batch loader",
+    ("loader",)
+)
+BATCHES = metrics.registry.counter(
+    "fokabot_batch_loader_batches_total",
+    "Batches sent by a batch loader. loads / batches is the average batch size.",
+    ("loader",)
+)
+
+
+class BatchLoader:
+    """
+    Merges the lookups issued within `window` seconds of each other (or in the same
+    event loop iteration, if `window` is 0) into a single call to `load_many`,
+    and fans the results back out to each caller.
+    The same key requested more than once in the same batch is loaded only once.
+    Nothing is cached: once a batch is sent, the next lookups go in a new batch.
+    ```
+    >>> users = BatchLoader("users", ripple_api_client.get_users)
+    >>> user = await users.load(1000)
+    ```
+    """
+    def __init__(
+        self, name: str, load_many: Callable[[List[Hashable]], Awaitable[Dict[Hashable, Any]]],
+        window: float = 0, max_batch: int = 50
+    ):
+        """
+        :param name: name of this loader, used as metrics label
+        :param load_many: function that loads a list of keys and returns a dict key -> value.
+                          Keys missing from the dict are resolved as None.
+        :param window: seconds to wait for more lookups before sending a batch
+        :param max_batch: maximum number of keys in a batch. A full batch is sent right away.
+        """
+        self.name = name
+        self.load_many = load_many
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: Dict[Hashable, asyncio.Future] = {}
+        self._flush_handle: Optional[asyncio.Handle] = None
+
+    async def load(self, key: Hashable) -> Any:
+        """
+        :param key: key to load
+        :return: the value of `key` returned by `load_many`, or None if it wasn't returned
+        """
+        LOADS.inc(loader=self.name)
+        future = self._pending.get(key, None)
+        if future is None:
+            future = asyncio.get_event_loop().create_future()
+            self._pending[key] = future
+            if len(self._pending) >= self.max_batch:
+                self._flush()
+            elif self._flush_handle is None:
+                loop = asyncio.get_event_loop()
+                self._flush_handle = loop.call_soon(self._flush) if self.window <= 0 \
+                    else loop.call_later(self.window, self._flush)
+        # A caller that gets cancelled must not cancel the lookup for everyone else in the batch
+        return await asyncio.shield(future)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            BATCHES.inc(loader=self.name)
+            asyncio.ensure_future(self._dispatch(batch))
+
+    async def _dispatch(self, batch: Dict[Hashable, asyncio.Future]) -> None:
+        try:
+            results = await self.load_many(list(batch.keys()))
+        except asyncio.CancelledError:
+            for future in batch.values():
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for key, future in batch.items():
+            if not future.done():
+                future.set_result(results.get(key, None))
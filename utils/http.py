@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import re
+import ssl
+import time
+from types import SimpleNamespace
+from typing import Dict, Optional, Any, Callable, Awaitable, Hashable
+
+import aiohttp
+from yarl import URL
+
+from utils import metrics, tracing
+from utils.singleflight import SingleFlight
+
+POOL_QUEUED = metrics.registry.counter(
+    "fokabot_http_pool_queued_total",
+    "Requests that had to wait for a free pooled connection",
+    ("host",)
+)
+POOL_WAITING = metrics.registry.gauge(
+    "fokabot_http_pool_waiting",
+    "Requests currently waiting for a free pooled connection",
+    ("host",)
+)
+POOL_QUEUE_WAIT = metrics.registry.histogram(
+    "fokabot_http_pool_queue_wait_seconds",
+    "Time spent waiting for a free pooled connection",
+    ("host",)
+)
+POOL_CONNECTIONS = metrics.registry.counter(
+    "fokabot_http_pool_connections_total",
+    "Connections handed out by the pool, by kind (new or reused)",
+    ("host", "kind")
+)
+UPSTREAM_TIME = metrics.registry.histogram(
+    "fokabot_upstream_request_seconds",
+    "Time spent on upstream api requests, including the time spent waiting for a pooled connection",
+    ("client", "method", "route")
+)
+UPSTREAM_RESPONSES = metrics.registry.counter(
+    "fokabot_upstream_responses_total",
+    "Upstream api requests, by status code ('error' if there was no response, eg: connection refused)",
+    ("client", "method", "route", "status")
+)
+UPSTREAM_TIMEOUTS = metrics.registry.counter(
+    "fokabot_upstream_timeouts_total",
+    "Upstream api requests that timed out",
+    ("client", "method", "route")
+)
+UPSTREAM_IN_FLIGHT = metrics.registry.gauge(
+    "fokabot_upstream_in_flight",
+    "Upstream api requests currently in flight",
+    ("client",)
+)
+
+# Methods whose concurrent identical requests can share the same response
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD"))
+
+# Numeric path segments, replaced when no route template is provided
+_NUMERIC_SEGMENT = re.compile(r"(?<![^/])\d+(?![^/])")
+
+
+class HttpSessionPool:
+    """
+    Long-lived aiohttp sessions shared by all api clients, one per upstream host.
+    Each session has its own keep-alive connection pool with a per-host
+    connection cap and a DNS cache. All TLS connections share the same SSL context.
+    """
+    logger = logging.getLogger("http_pool")
+
+    def __init__(
+        self, limit_per_host: int = 32, dns_cache_ttl: int = 300,
+        keepalive_timeout: float = 30.0, saturation_warning_interval: float = 30.0
+    ):
+        """
+        Initializes a new HttpSessionPool. No session is created until it's needed.
+
+        :param limit_per_host: maximum number of simultaneous connections to the same host
+        :param dns_cache_ttl: seconds to keep resolved DNS records for
+        :param keepalive_timeout: seconds to keep idle connections open for
+        :param saturation_warning_interval: minimum number of seconds between two
+                                            "pool saturated" warnings for the same host
+        """
+        self.limit_per_host = limit_per_host
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.saturation_warning_interval = saturation_warning_interval
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self._ssl_context: Optional[ssl.SSLContext] = None
+        self._last_saturation_warning: Dict[str, float] = {}
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        # Loading the CA store is expensive, do it only once
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    def _trace_config(self, host: str) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_queued_start(_, ctx: SimpleNamespace, __) -> None:
+            ctx.queued_at = time.monotonic()
+            POOL_QUEUED.inc(host=host)
+            POOL_WAITING.inc(host=host)
+            now = time.monotonic()
+            if now - self._last_saturation_warning.get(host, 0) >= self.saturation_warning_interval:
+                self._last_saturation_warning[host] = now
+                self.logger.warning(
+                    f"Connection pool for {host} is saturated ({self.limit_per_host} connections). "
+                    "Requests are being queued."
+                )
+
+        async def on_queued_end(_, ctx: SimpleNamespace, __) -> None:
+            POOL_WAITING.dec(host=host)
+            POOL_QUEUE_WAIT.observe(time.monotonic() - ctx.queued_at, host=host)
+
+        async def on_create_end(*_) -> None:
+            POOL_CONNECTIONS.inc(host=host, kind="new")
+
+        async def on_reuse(*_) -> None:
+            POOL_CONNECTIONS.inc(host=host, kind="reused")
+
+        trace_config.on_connection_queued_start.append(on_queued_start)
+        trace_config.on_connection_queued_end.append(on_queued_end)
+        trace_config.on_connection_create_end.append(on_create_end)
+        trace_config.on_connection_reuseconn.append(on_reuse)
+        return trace_config
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """
+        Returns the shared session for the host of `url`, creating it if needed.
+        Must be called from within a coroutine.
+
+        :param url: any url on the upstream host (eg: the api base)
+        :return: the aiohttp session bound to that host
+        """
+        host = str(URL(url).origin())
+        session = self._sessions.get(host, None)
+        if session is None or session.closed:
+            self.logger.debug(f"Creating new pooled session for {host}")
+            session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit_per_host,
+                    limit_per_host=self.limit_per_host,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ssl=self.ssl_context,
+                    enable_cleanup_closed=True,
+                ),
+                cookie_jar=aiohttp.DummyCookieJar(),
+                trace_configs=[self._trace_config(host)],
+            )
+            self._sessions[host] = session
+        return session
+
+    async def close(self) -> None:
+        """
+        Closes all sessions and their connections
+
+        :return:
+        """
+        for host, session in self._sessions.items():
+            if not session.closed:
+                self.logger.debug(f"Closing pooled session for {host}")
+                await session.close()
+        self._sessions.clear()
+
+
+def route_template(path: str) -> str:
+    """
+    Returns a route template for an api path, replacing the numeric
+    segments with '{id}' (eg: 'multiplayer/1234/move' -> 'multiplayer/{id}/move').
+    Used to keep the cardinality of the metrics low when no template is provided.
+
+    :param path: the api path
+    :return: the route template
+    """
+    return _NUMERIC_SEGMENT.sub("{id}", path)
+
+
+class UpstreamRequest:
+    """
+    Records the metrics of an upstream api request.
+    Set `status` as soon as the response status is known.
+    ```
+    >>> with self.track("multiplayer/{id}", "GET") as t:
+    >>>     async with session.get(...) as response:
+    >>>         t.status = response.status
+    ```
+    """
+    __slots__ = "client", "method", "route", "status", "start", "span"
+
+    def __init__(self, client: str, method: str, route: str):
+        self.client = client
+        self.method = method
+        self.route = route
+        self.status: Optional[int] = None
+        self.start: float = 0
+        self.span: Optional[tracing.Span] = None
+
+    def __enter__(self) -> "UpstreamRequest":
+        UPSTREAM_IN_FLIGHT.inc(client=self.client)
+        self.span = tracing.tracer.start_span(self.client, method=self.method, route=self.route)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self.span is not None:
+            self.span.set("status", self.status)
+            self.span.finish(exc)
+        labels = {"client": self.client, "method": self.method, "route": self.route}
+        UPSTREAM_TIME.observe(time.monotonic() - self.start, **labels)
+        UPSTREAM_IN_FLIGHT.dec(client=self.client)
+        if self.status is not None:
+            UPSTREAM_RESPONSES.inc(status=str(self.status), **labels)
+        if exc_type is not None and issubclass(exc_type, asyncio.TimeoutError):
+            # The body may time out after the status is known, count it anyway
+            UPSTREAM_TIMEOUTS.inc(**labels)
+        elif self.status is None and exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            UPSTREAM_RESPONSES.inc(status="error", **labels)
+
+
+class PooledHttpClient:
+    """
+    Mixin for api clients that send their requests through a HttpSessionPool.
+    The bot binds its own shared pool to all its clients, clients used
+    outside of the bot lazily get their own private pool.
+    Concurrent identical idempotent requests can be sent only once, see `coalesce`.
+    """
+    _http_pool: Optional[HttpSessionPool] = None
+    _flights: Optional[SingleFlight] = None
+    # Value of the 'client' label of the upstream metrics
+    client_name: str = "http"
+
+    @property
+    def http_pool(self) -> HttpSessionPool:
+        if self._http_pool is None:
+            self._http_pool = HttpSessionPool()
+        return self._http_pool
+
+    @http_pool.setter
+    def http_pool(self, v: HttpSessionPool) -> None:
+        self._http_pool = v
+
+    def track(self, route: str, method: str = "GET") -> UpstreamRequest:
+        """
+        Returns a context manager that records the metrics of a request to this client's upstream
+
+        :param route: route template (eg: 'multiplayer/{id}/move'), not the actual path
+        :param method: http method
+        :return:
+        """
+        return UpstreamRequest(self.client_name, method, route)
+
+    @staticmethod
+    def request_key(method: str, url: str, params: Any = None) -> Hashable:
+        """
+        :param method: http method
+        :param url: full url
+        :param params: querystring parameters (dict or multidict), if any
+        :return: a key that identifies the request. The order of the parameters matters
+                 (ids=1&ids=2 may not return the same thing as ids=2&ids=1).
+        """
+        return method, url, tuple((str(k), str(v)) for k, v in params.items()) if params else ()
+
+    async def coalesce(self, method: str, url: str, params: Any, f: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs `f`, which sends the request. If an identical request is already in flight,
+        waits for its result (or its exception) instead.
+        Non-idempotent requests are always sent.
+        Responses are shared by all the callers, don't modify them.
+        Calls and saved calls are counted in the single-flight metrics, with the client name as group.
+
+        :param method: http method
+        :param url: full url
+        :param params: querystring parameters (dict or multidict), if any
+        :param f: function that returns the awaitable that sends the request
+        :return: the result of `f`
+        """
+        if method not in IDEMPOTENT_METHODS:
+            return await f()
+        if self._flights is None:
+            self._flights = SingleFlight(self.client_name)
+        return await self._flights.do(self.request_key(method, url, params), f)
@@ -6,11 +6,11 @@ import json as stdjson
 import logging
 from typing import Dict, Any, List, Union, Optional
 
-import aiohttp
 import async_timeout
 
 from constants.game_modes import GameMode
 from constants.mods import Mod
+from utils.http import PooledHttpClient
 
 
 class LetsApiError(Exception):
@@ -89,8 +89,9 @@ class LetsPPResponse:
         return message
 
 
-class LetsApiClient:
+class LetsApiClient(PooledHttpClient):
     logger = logging.getLogger("lets_api")
+    client_name = "lets"
 
     def __init__(self, base: str, timeout: int = 5):
         self.base = base.rstrip("/")
@@ -98,14 +99,18 @@ class LetsApiClient:
 
     async def _request(self, url: str, params: Dict[str, Any]) -> Dict[Any, Any]:
         url = url.lstrip("/")
-        async with aiohttp.ClientSession() as session:
-            with async_timeout.timeout(self.timeout):
-                async with session.get(f"{self.base}/{url}", params=params) as response:
-                    try:
-                        self.logger.debug(f"LETS request: GET {self.base}/{url} [{params}]")
-                        return await response.json(loads=json.loads)
-                    except (ValueError, stdjson.JSONDecodeError):
-                        raise FatalLetsApiError(response)
+        return await self.coalesce("GET", f"{self.base}/{url}", params, lambda: self._send(url, params))
+
+    async def _send(self, url: str, params: Dict[str, Any]) -> Dict[Any, Any]:
+        session = self.http_pool.session(self.base)
+        with self.track(url) as t, async_timeout.timeout(self.timeout):
+            async with session.get(f"{self.base}/{url}", params=params) as response:
+                t.status = response.status
+                try:
+                    self.logger.debug(f"LETS request: GET {self.base}/{url} [{params}]")
+                    return await response.json(loads=json.loads)
+                except (ValueError, stdjson.JSONDecodeError):
+                    raise FatalLetsApiError(response)
 
     async def get_pp(
         self, beatmap_id: int,
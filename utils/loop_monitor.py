@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Optional, Deque, Tuple, List
+
+from utils import metrics
+
+LAG = metrics.registry.histogram(
+    "fokabot_loop_lag_seconds",
+    "How late the event loop woke up the loop monitor"
+)
+LAST_LAG = metrics.registry.gauge(
+    "fokabot_loop_lag_last_seconds",
+    "Last measured event loop lag"
+)
+BLOCKED = metrics.registry.counter(
+    "fokabot_loop_blocked_total",
+    "Times the event loop has been blocked for longer than the threshold, by innermost fokabot frame",
+    ("location",)
+)
+
+# Frames in these files are FokaBot's own code
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def is_own_file(filename: str) -> bool:
+    """
+    :param filename: absolute path of a source file
+    :return: whether the file is part of FokaBot (and not a library installed in the tree)
+    """
+    return filename.startswith(ROOT) and os.sep + "site-packages" + os.sep not in filename
+
+
+class LoopMonitor:
+    """
+    Measures the event loop lag by sleeping for a fixed interval and
+    checking how late it wakes up.
+
+    A watchdog thread checks that the monitor keeps ticking. If it doesn't for
+    longer than `block_threshold`, something is blocking the loop: the watchdog
+    grabs the stack of the loop thread (while it's still blocked) and logs it.
+    """
+    logger = logging.getLogger("loop_monitor")
+
+    def __init__(self, interval: float = 0.25, block_threshold: float = 0.5, keep_stacks: int = 10):
+        """
+        :param interval: seconds between two lag measurements
+        :param block_threshold: the loop is considered blocked when the monitor doesn't
+                                tick for `interval` + `block_threshold` seconds
+        :param keep_stacks: number of recent blocking stacks kept in `stacks`
+        """
+        self.interval = interval
+        self.block_threshold = block_threshold
+        # (unix timestamp, blocked for at least n seconds, formatted stack)
+        self.stacks: Deque[Tuple[float, float, str]] = deque(maxlen=keep_stacks)
+        self._heartbeat: float = 0
+        self._loop_thread_id: Optional[int] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def run(self) -> None:
+        """
+        Measures the lag forever and runs the watchdog thread. Cancel it to stop both.
+
+        :return:
+        """
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+        self.logger.debug(f"Started loop monitor (interval {self.interval}s, threshold {self.block_threshold}s)")
+        try:
+            while True:
+                start = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                lag = max(0.0, now - start - self.interval)
+                LAG.observe(lag)
+                LAST_LAG.set(lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self) -> None:
+        reported = None
+        # Check often enough to catch the loop while it's still blocked
+        check_interval = min(self.interval, self.block_threshold) / 2
+        while not self._stop.wait(check_interval):
+            heartbeat = self._heartbeat
+            blocked_for = time.monotonic() - heartbeat - self.interval
+            if blocked_for < self.block_threshold or reported == heartbeat:
+                continue
+            # Report each stall once
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id, None)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame)
+            del frame
+            location = self._location(stack)
+            formatted = "".join(traceback.format_list(stack))
+            BLOCKED.inc(location=location)
+            self.stacks.append((time.time(), blocked_for, formatted))
+            self.logger.warning(
+                f"Event loop blocked for more than {blocked_for:.3f}s, at {location}. Stack:\n{formatted}"
+            )
+
+    @staticmethod
+    def _location(stack: List[traceback.FrameSummary]) -> str:
+        # Innermost frame in our own code, the stdlib/library frames below it are less useful
+        for frame in reversed(stack):
+            if is_own_file(frame.filename):
+                return f"{os.path.relpath(frame.filename, ROOT)}:{frame.lineno} {frame.name}"
+        frame = stack[-1]
+        return f"{frame.filename}:{frame.lineno} {frame.name}"
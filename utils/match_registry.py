@@ -0,0 +1,122 @@
+import logging
+import time
+from typing import Dict, Any, Optional, Tuple
+
+from utils import metrics
+from utils.rippleapi import BanchoApiClient
+from utils.singleflight import SingleFlight
+
+LOOKUPS = metrics.registry.counter(
+    "fokabot_match_registry_lookups_total",
+    "Multiplayer match lookups, by where the answer came from (memory or api)",
+    ("source",)
+)
+SIZE = metrics.registry.gauge(
+    "fokabot_match_registry_size",
+    "Multiplayer matches mirrored in memory"
+)
+
+# A match from the ws is complete (and can be stored on its own) if it has all these
+REQUIRED_KEYS = frozenset(("id", "slots", "beatmap", "host_api_identifier", "api_owner_user_id"))
+
+
+class MatchRegistry:
+    """
+    In-memory mirror of the multiplayer matches, kept current by the ws events
+    (see events.py), so commands don't have to ask the bancho api for the state
+    of a match every time.
+    The api is used only when a match is not known, or when it hasn't been
+    updated for `max_age` seconds (we may have missed some events).
+    `reconcile` forgets about matches that don't exist anymore.
+
+    The returned dicts are shared, don't modify them.
+    """
+    logger = logging.getLogger("match_registry")
+
+    def __init__(self, bancho_api_client: BanchoApiClient, max_age: float = 300):
+        """
+        :param bancho_api_client: client used on cache misses
+        :param max_age: seconds after which a match that got no updates is fetched again
+        """
+        self.bancho_api_client = bancho_api_client
+        self.max_age = max_age
+        # match id -> (updated at (monotonic), match)
+        self._matches: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._flights = SingleFlight("match_info")
+
+    async def get(self, match_id: int) -> Optional[Dict[str, Any]]:
+        """
+        :param match_id:
+        :return: the match, as returned by BanchoApiClient.get_match_info
+        """
+        entry = self._matches.get(match_id, None)
+        if entry is not None and time.monotonic() - entry[0] < self.max_age:
+            LOOKUPS.inc(source="memory")
+            return entry[1]
+        return await self._flights.do(match_id, lambda: self._fetch(match_id))
+
+    async def _fetch(self, match_id: int) -> Optional[Dict[str, Any]]:
+        started_at = time.monotonic()
+        match = await self.bancho_api_client.get_match_info(match_id)
+        LOOKUPS.inc(source="api")
+        entry = self._matches.get(match_id, None)
+        if entry is not None and entry[0] > started_at:
+            # A ws event came in while we were waiting, it's newer than the api response
+            return entry[1]
+        if type(match) is dict and REQUIRED_KEYS.issubset(match):
+            self._store(match_id, match)
+        return match
+
+    def _store(self, match_id: int, match: Dict[str, Any], updated_at: Optional[float] = None) -> None:
+        self._matches[match_id] = (updated_at if updated_at is not None else time.monotonic(), match)
+        SIZE.set(len(self._matches))
+
+    def update(self, match: Dict[str, Any]) -> None:
+        """
+        Updates a match from a ws event.
+        If the match is not known and the event doesn't carry the whole
+        match, it's ignored and the match will be fetched when needed.
+
+        :param match: match data from the event
+        :return:
+        """
+        match_id = match.get("id", None)
+        if match_id is None:
+            return
+        complete = REQUIRED_KEYS.issubset(match)
+        entry = self._matches.get(match_id, None)
+        if entry is None:
+            if complete:
+                self._store(match_id, match)
+            return
+        # Don't edit the old dict in place, someone may be reading it.
+        # A partial update doesn't make the rest of the match any fresher.
+        self._store(match_id, {**entry[1], **match}, updated_at=None if complete else entry[0])
+
+    def remove(self, match_id: int) -> None:
+        self._matches.pop(match_id, None)
+        SIZE.set(len(self._matches))
+
+    def clear(self) -> None:
+        self._matches.clear()
+        SIZE.set(0)
+
+    async def reconcile(self) -> None:
+        """
+        Forgets about the matches that are not running anymore,
+        in case we missed their lobby_match_removed event
+
+        :return:
+        """
+        running = {x["id"] for x in await self.bancho_api_client.get_all_matches()}
+        gone = [x for x in self._matches.keys() if x not in running]
+        for match_id in gone:
+            self.remove(match_id)
+        if gone:
+            self.logger.debug(f"Forgot about {len(gone)} matches that are not running anymore")
+
+    def __contains__(self, match_id: int) -> bool:
+        return match_id in self._matches
+
+    def __len__(self) -> int:
+        return len(self._matches)
@@ -0,0 +1,214 @@
+import bisect
+import functools
+import math
+import threading
+from typing import Dict, Tuple, Iterable, Optional, List, Callable
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    """
+    Base class for all metrics. A metric has a name, a help string and
+    a fixed set of label names. Each combination of label values is tracked
+    separately.
+    """
+    type_: str = "untyped"
+
+    def __init__(self, name: str, help_: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help_
+        self.label_names: Tuple[str, ...] = tuple(labels)
+        # Some metrics (eg: loop lag) are written from other threads
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"Metric {self.name} requires labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[x]) for x in self.label_names)
+
+    def _labels(self, values: LabelValues, extra: str = "") -> str:
+        pairs = [f'{k}="{_escape_label(v)}"' for k, v in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return f"{{{','.join(pairs)}}}" if pairs else ""
+
+    def render(self) -> List[str]:
+        """
+        Returns the samples of this metric in Prometheus text format
+
+        :return: list of lines
+        """
+        with self._lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self._labels(k)} {_format_value(v)}" for k, v in values]
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super(Counter, self).__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self.values[k] = self.values.get(k, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    type_ = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super(Gauge, self).__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self.values[k] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self.values[k] = self.values.get(k, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def get(self, **labels) -> float:
+        return self.values.get(self._key(labels), 0)
+
+
+class HistogramValue:
+    __slots__ = "bucket_counts", "count", "sum"
+
+    def __init__(self, buckets: int):
+        # One extra bucket for +Inf
+        self.bucket_counts: List[int] = [0] * (buckets + 1)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, *args, buckets: Iterable[float] = DEFAULT_BUCKETS, **kwargs):
+        super(Histogram, self).__init__(*args, **kwargs)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        self.values: Dict[LabelValues, HistogramValue] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            v = self.values.get(k, None)
+            if v is None:
+                v = self.values[k] = HistogramValue(len(self.buckets))
+            v.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+            v.count += 1
+            v.sum += value
+
+    def get(self, **labels) -> Optional[HistogramValue]:
+        return self.values.get(self._key(labels), None)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(k, list(v.bucket_counts), v.count, v.sum) for k, v in self.values.items()]
+        lines = []
+        for k, bucket_counts, count, sum_ in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += n
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._labels(k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(k)} {_format_value(sum_)}")
+            lines.append(f"{self.name}_count{self._labels(k)} {count}")
+        return lines
+
+
+class Registry:
+    """
+    A collection of metrics, indexed by name.
+    Registering the same metric twice returns the already existing one,
+    so modules can declare their metrics at import time without worrying
+    about import order.
+    """
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, cls, name: str, help_: str, labels: Iterable[str] = (), **kwargs) -> Metric:
+        if name in self.metrics:
+            m = self.metrics[name]
+            if type(m) is not cls or m.label_names != tuple(labels):
+                raise ValueError(f"Metric {name} already registered with a different type or labels")
+            return m
+        m = cls(name, help_, labels, **kwargs)
+        self.metrics[name] = m
+        return m
+
+    def counter(self, name: str, help_: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter, name, help_, labels)
+
+    def gauge(self, name: str, help_: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_, labels)
+
+    def histogram(
+        self, name: str, help_: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram, name, help_, labels, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Returns all metrics in Prometheus text exposition format (version 0.0.4)
+
+        :return: the metrics, ready to be served on /metrics
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f"# HELP {metric.name} {_escape_help(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_}")
+            lines.extend(metric.render())
+        lines.append("")
+        return "\n".join(lines)
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _escape_label(value: str) -> str:
+    return _escape_help(value).replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+@functools.lru_cache(maxsize=None)
+def handler_name(f: Callable) -> str:
+    """
+    Returns the label used for a handler function in metrics (eg: 'plugins.general.roll')
+
+    :param f: the handler
+    :return: module and qualified name of the handler
+    """
+    return f"{getattr(f, '__module__', None)}.{getattr(f, '__qualname__', repr(f))}"
+
+
+registry = Registry()
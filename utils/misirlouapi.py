@@ -6,6 +6,7 @@ from utils.rippleapi import RippleApiBaseClient
 
 class MisirlouApiClient(RippleApiBaseClient):
     logger = logging.getLogger("misirlou_api")
+    client_name = "misirlou"
 
     def __init__(self, token: str, base: str = "https://tourn.ripple.moe", user_agent: str = "fokabot", timeout: int = 5):
         super(MisirlouApiClient, self).__init__(
@@ -3,6 +3,8 @@ from typing import Optional, Dict, Any
 
 import aiohttp
 
+from utils.http import PooledHttpClient
+
 
 class OsuAPIError(Exception):
     pass
@@ -12,11 +14,14 @@ class OsuAPIFatalError(OsuAPIError):
     pass
 
 
-class OsuAPIClient:
+class OsuAPIClient(PooledHttpClient):
     """
     A very basic osu! API v1 client with very few handlers supported
     """
     logger = logging.getLogger("osu_api_v1")
+    client_name = "osu"
+
+    BASE = "https://osu.ppy.sh"
 
     def __init__(self, api_token: str):
         self.api_token = api_token
@@ -27,14 +32,16 @@ class OsuAPIClient:
         if "k" in params:
             del params["k"]
         params = {**params, **{"k": self.api_token}}
-        async with aiohttp.ClientSession() as session:
-            try:
-                url = f"https://osu.ppy.sh/api/{handler}"
-                self.logger.debug(f"[GET] {url} <{params}>")
+        session = self.http_pool.session(self.BASE)
+        try:
+            url = f"{self.BASE}/api/{handler}"
+            self.logger.debug(f"[GET] {url} <{params}>")
+            with self.track(handler) as t:
                 async with session.get(url, params=params) as response:
+                    t.status = response.status
                     if response.status != 200:
                         text = await response.text()
                         raise OsuAPIError(f"Bad response ({response.status}): {text}")
                     return await response.json()
-            except (aiohttp.ServerConnectionError, aiohttp.ClientError, ValueError) as e:
-                raise OsuAPIFatalError(e)
+        except (aiohttp.ServerConnectionError, aiohttp.ClientError, ValueError) as e:
+            raise OsuAPIFatalError(e)
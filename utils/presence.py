@@ -0,0 +1,169 @@
+import time
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+from utils import metrics
+from utils.rippleapi import BanchoApiClient, BanchoClientType, RippleApiBaseClient
+from utils.singleflight import SingleFlight
+
+LOOKUPS = metrics.registry.counter(
+    "fokabot_presence_lookups_total",
+    "Online clients lookups, by where the answer came from (memory or api)",
+    ("source",)
+)
+SIZE = metrics.registry.gauge(
+    "fokabot_presence_clients",
+    "Clients in the presence index"
+)
+
+
+class PresenceIndex:
+    """
+    Online clients, by user id and by api identifier, kept current by the
+    status_update ws events and by the api responses.
+    Each client is stored as the api/event returns it (type, action, beatmap...).
+
+    The events tell us when someone is online, but not when they log out.
+    A client is considered online for `ttl` seconds after a status update,
+    after that (or if we know nothing about a user) the bancho api is asked.
+    Clients returned by the api don't carry any activity of their own, so
+    they are trusted only for `api_ttl` seconds, to keep the answers close
+    to what the api would say about users who have logged out in the meantime.
+    """
+    def __init__(self, bancho_api_client: BanchoApiClient, ttl: float = 120, api_ttl: float = 5):
+        """
+        :param bancho_api_client: client used when the index can't answer
+        :param ttl: seconds a client is considered online after a status update
+        :param api_ttl: seconds a client returned by the api is considered online.
+                        If <= 0, api responses are not stored.
+        """
+        self.bancho_api_client = bancho_api_client
+        self.ttl = ttl
+        self.api_ttl = api_ttl
+        # api identifier -> (last seen (monotonic), expires at (monotonic), client)
+        self._clients: Dict[str, Tuple[float, float, Dict[str, Any]]] = {}
+        # user id -> api identifiers
+        self._users: Dict[int, Set[str]] = {}
+        self._flights = SingleFlight("clients")
+
+    def update(self, client: Dict[str, Any], seen_at: Optional[float] = None, ttl: Optional[float] = None) -> None:
+        """
+        Adds or replaces a client
+
+        :param client: client, as returned by the api or sent in a status_update event
+        :param seen_at: when it was seen online (monotonic), now if None
+        :param ttl: seconds it's considered online for, starting from `seen_at`. `self.ttl` if None.
+        :return:
+        """
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0:
+            return
+        if seen_at is None:
+            seen_at = time.monotonic()
+        api_identifier = client["api_identifier"]
+        self._clients[api_identifier] = (seen_at, seen_at + ttl, client)
+        self._users.setdefault(client["user_id"], set()).add(api_identifier)
+        SIZE.set(len(self._clients))
+
+    def remove(self, api_identifier: str) -> None:
+        """
+        Forgets about a client (eg: because it has been kicked)
+
+        :param api_identifier:
+        :return:
+        """
+        entry = self._clients.pop(api_identifier, None)
+        if entry is None:
+            return
+        user_id = entry[2]["user_id"]
+        identifiers = self._users.get(user_id, None)
+        if identifiers is not None:
+            identifiers.discard(api_identifier)
+            if not identifiers:
+                del self._users[user_id]
+        SIZE.set(len(self._clients))
+
+    def client(self, api_identifier: str) -> Optional[Dict[str, Any]]:
+        """
+        :param api_identifier:
+        :return: the client with that api identifier, if it's known and it's been seen recently. O(1).
+        """
+        entry = self._clients.get(api_identifier, None)
+        if entry is None or time.monotonic() >= entry[1]:
+            return None
+        return entry[2]
+
+    def _local_clients(self, user_id: int) -> List[Dict[str, Any]]:
+        clients = (self.client(x) for x in self._users.get(user_id, ()))
+        return [x for x in clients if x is not None]
+
+    @RippleApiBaseClient.bind_error_code(400, [])
+    async def _fetch(self, user_id: int) -> List[Dict[str, Any]]:
+        started_at = time.monotonic()
+        clients = await self.bancho_api_client.get_clients(user_id)
+        LOOKUPS.inc(source="api")
+        # The api returns all the clients of that user, forget about the others
+        # (unless we got an event about them while waiting for the api)
+        for api_identifier in list(self._users.get(user_id, ())):
+            if self._clients[api_identifier][0] < started_at:
+                self.remove(api_identifier)
+        for client in clients:
+            entry = self._clients.get(client["api_identifier"], None)
+            if entry is None or entry[0] < started_at:
+                self.update(client, seen_at=started_at, ttl=self.api_ttl)
+        return clients
+
+    async def get_clients(self, user_id: int) -> List[Dict[str, Any]]:
+        """
+        Same as BanchoApiClient.get_clients
+
+        :param user_id: id of the user
+        :return: list of clients of that user. Empty list if they are not online.
+        """
+        clients = self._local_clients(user_id)
+        if clients:
+            LOOKUPS.inc(source="memory")
+            return clients
+        return await self._flights.do(user_id, lambda: self._fetch(user_id))
+
+    async def get_client(self, user_id: int, game_only: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Same as BanchoApiClient.get_client
+
+        :param user_id: id of the user
+        :param game_only: if True, get only the first game client and ignore all irc clients
+        :return: the first client of that user, or None if they are not online
+        """
+        def first(clients: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+            return next((x for x in clients if not game_only or x["type"] == BanchoClientType.OSU), None)
+
+        client = first(self._local_clients(user_id))
+        if client is not None:
+            LOOKUPS.inc(source="memory")
+            return client
+        return first(await self._flights.do(user_id, lambda: self._fetch(user_id)))
+
+    async def is_online(self, user_id: int, game_only: bool = False) -> bool:
+        """
+        Same as BanchoApiClient.is_online
+
+        :param user_id: id of the user
+        :param game_only: if True, consider someone online only if they are connected through the game
+        :return: True if online, False if offline
+        """
+        return await self.get_client(user_id, game_only=game_only) is not None
+
+    def purge(self) -> None:
+        """
+        Forgets about the clients we haven't heard of for a while
+
+        :return:
+        """
+        now = time.monotonic()
+        for api_identifier in [k for k, (_, expires_at, _) in self._clients.items() if now >= expires_at]:
+            self.remove(api_identifier)
+
+    def clear(self) -> None:
+        self._clients.clear()
+        self._users.clear()
+        SIZE.set(0)
@@ -0,0 +1,220 @@
+import asyncio
+import inspect
+import logging
+import os
+import selectors
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Optional, Tuple, List, Dict, FrozenSet
+
+from utils.loop_monitor import ROOT, is_own_file
+
+# The loop is waiting for I/O when its innermost frame is in here
+_SELECTORS_FILE = os.path.abspath(selectors.__file__)
+_COROUTINE_FLAGS = inspect.CO_COROUTINE | inspect.CO_ITERABLE_COROUTINE
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class Profile:
+    """
+    Result of a profiling session
+    """
+    def __init__(self, stacks: Counter, idle_codes: FrozenSet[CodeType], duration: float, interval: float):
+        """
+        :param stacks: number of samples for each stack (tuple of code objects, outermost first)
+        :param idle_codes: when one of these is the innermost frame, the loop is idle
+        :param duration: seconds the profiler ran for
+        :param interval: seconds between two samples
+        """
+        self.stacks = stacks
+        self.duration = duration
+        self.interval = interval
+        self.samples = sum(stacks.values())
+        self.idle = 0
+        # Samples by innermost fokabot function (the handler running, or the one
+        # that called the library that was running). Idle samples are not included.
+        self.self_samples: Counter = Counter()
+        for stack, n in stacks.items():
+            if not stack or stack[-1] in idle_codes or stack[-1].co_filename == _SELECTORS_FILE:
+                self.idle += n
+                continue
+            self.self_samples[self._handler(stack)] += n
+        self.path: Optional[str] = None
+
+    @staticmethod
+    def _handler(stack: Tuple[CodeType, ...]) -> str:
+        for code in reversed(stack):
+            if is_own_file(code.co_filename):
+                return f"{os.path.relpath(code.co_filename, ROOT)}:{code.co_firstlineno} {code.co_name}"
+        code = stack[-1]
+        return f"{code.co_filename}:{code.co_firstlineno} {code.co_name}"
+
+    @staticmethod
+    def _label(code: CodeType) -> str:
+        filename = os.path.relpath(code.co_filename, ROOT) if is_own_file(code.co_filename) else code.co_filename
+        return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+    def top(self, n: int = 10) -> List[Tuple[str, int, float]]:
+        """
+        :param n: number of handlers
+        :return: [(handler, samples, share of all samples), ...], by self samples, descending
+        """
+        return [(k, v, v / self.samples) for k, v in self.self_samples.most_common(n)]
+
+    def collapsed(self) -> str:
+        """
+        :return: the stacks in collapsed format ('outer;inner count' per line),
+                 the input of flamegraph.pl, speedscope and similar tools
+        """
+        labels: Dict[CodeType, str] = {}
+        lines = []
+        for stack, n in self.stacks.most_common():
+            for code in stack:
+                if code not in labels:
+                    labels[code] = self._label(code)
+            lines.append(f"{';'.join(labels[x] for x in stack)} {n}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str) -> None:
+        """
+        Saves the stacks in collapsed format. Blocking.
+
+        :param path: output file, its directory is created if it doesn't exist
+        :return:
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        self.path = path
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the event loop thread.
+    A separate thread grabs the loop thread's stack every `interval` seconds
+    and counts how many times each stack was seen. The loop itself is not slowed
+    down by tracing hooks, the only cost is the sampler holding the GIL
+    while it walks the frames.
+    """
+    logger = logging.getLogger("profiler")
+    running = False
+
+    def __init__(self, interval: float = 0.005):
+        """
+        :param interval: seconds between two samples
+        """
+        self.interval = interval
+        self._stacks: Counter = Counter()
+        self._idle_codes: FrozenSet[CodeType] = frozenset()
+        self._thread_id: Optional[int] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started_at: float = 0
+
+    @staticmethod
+    def _loop_codes(frame: Optional[FrameType]) -> FrozenSet[CodeType]:
+        # The frames below the task that is running, that's the event loop
+        # (or the function that called run_forever with uvloop)
+        while frame is not None and not frame.f_code.co_flags & _COROUTINE_FLAGS:
+            frame = frame.f_back
+        while frame is not None and frame.f_code.co_flags & _COROUTINE_FLAGS:
+            frame = frame.f_back
+        codes = set()
+        while frame is not None:
+            codes.add(frame.f_code)
+            frame = frame.f_back
+        return frozenset(codes)
+
+    def start(self) -> None:
+        """
+        Starts sampling the current thread. Must be called from the event loop thread.
+
+        :return:
+        """
+        if SamplingProfiler.running:
+            raise ProfilerBusyError()
+        SamplingProfiler.running = True
+        self._thread_id = threading.get_ident()
+        self._idle_codes = self._loop_codes(sys._getframe(1))
+        self._stacks.clear()
+        self._stop.clear()
+        self._started_at = time.monotonic()
+        self._sampler = threading.Thread(target=self._sample, name="profiler", daemon=True)
+        self._sampler.start()
+        self.logger.debug(f"Started profiler (interval {self.interval}s)")
+
+    def stop(self) -> Profile:
+        """
+        Stops sampling
+
+        :return: the profile
+        """
+        self._stop.set()
+        self._sampler.join()
+        SamplingProfiler.running = False
+        duration = time.monotonic() - self._started_at
+        self.logger.debug(f"Stopped profiler, {sum(self._stacks.values())} samples in {duration:.2f}s")
+        return Profile(Counter(self._stacks), self._idle_codes, duration, self.interval)
+
+    def _sample(self) -> None:
+        last = time.monotonic()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id, None)
+            # While the loop thread is busy, the sampler has to wait for the GIL
+            # before it can run again, so samples are further apart. Each sample
+            # counts for the intervals that elapsed, or busy code would be underrepresented.
+            now = time.monotonic()
+            weight = max(1, round((now - last) / self.interval))
+            last = now
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack.reverse()
+            self._stacks[tuple(stack)] += weight
+
+
+def start_profile(seconds: float, directory: Optional[str] = None, interval: float = 0.005) -> asyncio.Future:
+    """
+    Starts profiling the event loop right away, and keeps profiling in the background
+
+    :param seconds: how long to profile for
+    :param directory: if not None, the stacks are saved in a new file in this directory
+    :param interval: seconds between two samples
+    :raises ProfilerBusyError: if another profile is running
+    :return: a future, resolved with the profile once done. Cancelling it stops the profiler.
+    """
+    profiler = SamplingProfiler(interval)
+    profiler.start()
+
+    async def run() -> Profile:
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            result = profiler.stop()
+        if directory is not None:
+            path = os.path.join(directory, f"fokabot-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+            await asyncio.get_event_loop().run_in_executor(None, result.write, path)
+        return result
+    return asyncio.ensure_future(run())
+
+
+async def profile(seconds: float, directory: Optional[str] = None, interval: float = 0.005) -> Profile:
+    """
+    Profiles the event loop for a while
+
+    :param seconds: how long to profile for
+    :param directory: if not None, the stacks are saved in a new file in this directory
+    :param interval: seconds between two samples
+    :raises ProfilerBusyError: if another profile is running
+    :return: the profile
+    """
+    return await start_profile(seconds, directory, interval)
@@ -0,0 +1,26 @@
+import asyncio
+from typing import Any
+
+import aioredis
+
+from utils import tracing
+
+
+class TracedRedis(aioredis.Redis):
+    """
+    aioredis' high level interface, with a tracing span for each command
+    sent while a trace is running. Pass it as `commands_factory` to create_redis_pool.
+    """
+    def execute(self, command, *args, **kwargs) -> Any:
+        span = tracing.tracer.start_span(
+            "redis", command=command.decode() if type(command) is bytes else str(command)
+        )
+        result = super(TracedRedis, self).execute(command, *args, **kwargs)
+        if span is None:
+            return result
+        # The pool returns a coroutine if it has to wait for a free connection
+        result = asyncio.ensure_future(result)
+        result.add_done_callback(
+            lambda f: span.finish(f.exception() if not f.cancelled() else asyncio.CancelledError())
+        )
+        return result
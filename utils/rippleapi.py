@@ -5,12 +5,14 @@ from typing import Optional, Dict, Any, Callable, List, Union
 
 import aiohttp
 import async_timeout
+from multidict import MultiDict
 from abc import ABC, abstractmethod
 from enum import IntEnum, auto
 
 from constants.game_modes import GameMode
 from constants.relax_modes import RelaxMode
 from constants.teams import Team
+from utils.http import PooledHttpClient, route_template
 
 
 class BanchoApiBeatmap:
@@ -76,7 +78,7 @@ class RippleApiFatalError(RippleApiError):
     pass
 
 
-class RippleApiBaseClient(ABC):
+class RippleApiBaseClient(PooledHttpClient, ABC):
     logger = logging.getLogger("abstract_api")
 
     def __init__(
@@ -101,7 +103,6 @@ class RippleApiBaseClient(ABC):
         self.user_privileges = 0
         self._check_status = check_status
         self.auth_header = auth_header
-        # self._session: aiohttp.ClientSession = None
 
     @property
     def headers(self) -> Dict[str, Any]:
@@ -129,7 +130,7 @@ class RippleApiBaseClient(ABC):
         return decorator
 
     async def _request(
-        self, handler: str, method: str = "GET", data: Optional[Dict[Any, Any]] = None
+        self, handler: str, method: str = "GET", data: Optional[Dict[Any, Any]] = None, route: Optional[str] = None
     ) -> Union[List[Any], Dict[Any, Any]]:
         """
         Sends a request to the ripple api
@@ -142,6 +143,8 @@ class RippleApiBaseClient(ABC):
                      to repeat multiple times the same parameter (eg: /users&ids=999&ids=1000,
                      to get user info about multiple users with 1 request), you must
                      use a `multidict.MultiDict` instead.
+        :param route: route template of `handler`, used in metrics (eg: 'clients/{api_identifier}/kick').
+                      If not provided, numeric segments of `handler` are replaced with '{id}'.
         :return: full decoded json body
         :raises RippleApiError subclass: if there was a legal response from the server,
                                          but the status code code was an error
@@ -154,62 +157,70 @@ class RippleApiBaseClient(ABC):
         if data is None:
             data = {}
 
-        # Reuse the same session within the same client
-        # if self._session is None:
-        #     self._session = aiohttp.ClientSession(headers=self.headers)
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            with async_timeout.timeout(self.timeout):
-                # Start with no json data and no GET parameters
-                json_data = None
-                params = None
-
-                # TODO: factory method.
-                #  (can we call it "factory" even if we're returning
-                #  funcions and not classes? Gang of Fur cit)
-                if method == "POST":
-                    # Use POST and json body
-                    f = session.post
-                    json_data = data
-                elif method == "GET":
-                    # Use GET and querystring
-                    f = session.get
-                    params = data
-                elif method == "DELETE":
-                    f = session.delete
-                    json_data = data
-                else:
-                    raise ValueError("Unsupported method")
-
-                # Different authorization header based on our authentication method
-                # (oauth or normal token)
-                if self.token is not None:
-                    headers = {self.auth_header: self.token}
-                else:
-                    headers = {}
-
-                # Send the API request
-                try:
-                    url = f"{self.api_link}/{handler}"
-                    self.logger.debug(f"[{method}] {url} <{params}> <{json_data}>")
-                    async with f(
-                        url,
-                        headers=headers,
-                        json=json_data,
-                        params=params
-                    ) as response:
-                        # Decode the response and return it
-                        # self.logger.debug(await response.text())
-                        # self.logger.debug(response.headers)
-                        result = await response.json(loads=ujson.loads)
-                        self.logger.debug(f"[{method}] {url} -> {result}")
-                except (aiohttp.ServerConnectionError, aiohttp.ClientError, ValueError) as e:
-                    raise RippleApiFatalError(e)
-
-                # Make sure the response was valid
-                if self._check_status and response.status != 200:
-                    raise RippleApiResponseError.factory(result)
-
-                return result
+        # Concurrent identical GET requests share the same response
+        return await self.coalesce(
+            method, f"{self.api_link}/{handler}", data if method == "GET" else None,
+            lambda: self._send(handler, method, data, route)
+        )
+
+    async def _send(
+        self, handler: str, method: str, data: Dict[Any, Any], route: Optional[str]
+    ) -> Union[List[Any], Dict[Any, Any]]:
+        # All clients share the same pooled session for the same host
+        session = self.http_pool.session(self.api_link)
+        with self.track(route if route is not None else route_template(handler), method) as t, \
+                async_timeout.timeout(self.timeout):
+            # Start with no json data and no GET parameters
+            json_data = None
+            params = None
+
+            # TODO: factory method.
+            #  (can we call it "factory" even if we're returning
+            #  funcions and not classes? Gang of Fur cit)
+            if method == "POST":
+                # Use POST and json body
+                f = session.post
+                json_data = data
+            elif method == "GET":
+                # Use GET and querystring
+                f = session.get
+                params = data
+            elif method == "DELETE":
+                f = session.delete
+                json_data = data
+            else:
+                raise ValueError("Unsupported method")
+
+            # Different authorization header based on our authentication method
+            # (oauth or normal token)
+            headers = self.headers
+            if self.token is not None:
+                headers[self.auth_header] = self.token
+
+            # Send the API request
+            try:
+                url = f"{self.api_link}/{handler}"
+                self.logger.debug(f"[{method}] {url} <{params}> <{json_data}>")
+                async with f(
+                    url,
+                    headers=headers,
+                    json=json_data,
+                    params=params
+                ) as response:
+                    t.status = response.status
+                    # Decode the response and return it
+                    # self.logger.debug(await response.text())
+                    # self.logger.debug(response.headers)
+                    result = await response.json(loads=ujson.loads)
+                    self.logger.debug(f"[{method}] {url} -> {result}")
+            except (aiohttp.ServerConnectionError, aiohttp.ClientError, ValueError) as e:
+                raise RippleApiFatalError(e)
+
+            # Make sure the response was valid
+            if self._check_status and response.status != 200:
+                raise RippleApiResponseError.factory(result)
+
+            return result
 
     @property
     @abstractmethod
@@ -241,6 +252,7 @@ class BanchoClientType(IntEnum):
 
 class BanchoApiClient(RippleApiBaseClient):
     logger = logging.getLogger("bancho_api")
+    client_name = "bancho"
 
     @property
     def api_link(self) -> str:
@@ -267,7 +279,7 @@ class BanchoApiClient(RippleApiBaseClient):
         """
         await self._request(f"clients/{api_identifier}/alert", "POST", {
             "message": message
-        })
+        }, route="clients/{api_identifier}/alert")
 
     async def get_clients(self, user_id: int) -> Dict[Any, Any]:
         """
@@ -318,7 +330,9 @@ class BanchoApiClient(RippleApiBaseClient):
         """
         if channel.startswith("#"):
             channel = channel.lstrip("#")
-        await self._request(f"chat_channels/{channel}", "POST", {"moderated": moderated})
+        await self._request(
+            f"chat_channels/{channel}", "POST", {"moderated": moderated}, route="chat_channels/{channel}"
+        )
 
     async def kick(self, api_identifier: str) -> None:
         """
@@ -327,7 +341,7 @@ class BanchoApiClient(RippleApiBaseClient):
         :param api_identifier: the api identifier of the user. Must belong to a game client.
         :return:
         """
-        await self._request(f"clients/{api_identifier}/kick", "POST")
+        await self._request(f"clients/{api_identifier}/kick", "POST", route="clients/{api_identifier}/kick")
 
     async def rtx(self, api_identifier: str, message: str) -> None:
         """
@@ -337,7 +351,9 @@ class BanchoApiClient(RippleApiBaseClient):
         :param message: message to display
         :return:
         """
-        await self._request(f"clients/{api_identifier}/rtx", "POST", {"message": message})
+        await self._request(
+            f"clients/{api_identifier}/rtx", "POST", {"message": message}, route="clients/{api_identifier}/rtx"
+        )
 
     async def system_info(self) -> Dict[Any, Any]:
         """
@@ -403,7 +419,7 @@ class BanchoApiClient(RippleApiBaseClient):
         await self._request(f"clients/{api_identifier}/join_match", "POST", self.remove_none({
             "match_id": match_id,
             "password": password
-        }))
+        }), route="clients/{api_identifier}/join_match")
 
     async def get_all_matches(self) -> Dict[Any, Any]:
         return (await self._request("multiplayer")).get("matches")
@@ -481,6 +497,7 @@ class BanchoApiClient(RippleApiBaseClient):
 
 class RippleApiClient(RippleApiBaseClient):
     logger = logging.getLogger("ripple_api")
+    client_name = "ripple"
 
     @property
     def api_link(self) -> str:
@@ -520,6 +537,16 @@ class RippleApiClient(RippleApiBaseClient):
             return None
         return users
 
+    async def get_users(self, user_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        Returns info about multiple users, with a single request
+
+        :param user_ids: ids of the users
+        :return: dict user id -> user. Users that don't exist are not in the dict.
+        """
+        response = await self._request("users", "GET", MultiDict(("ids", x) for x in user_ids))
+        return {x["id"]: x for x in response.get("users", None) or ()}
+
     async def set_allowed(self, user_id: int, new_allowed: int):
         return await self._request("users/manage/set_allowed", "POST", {
             "user_id": user_id,
@@ -591,6 +618,8 @@ class RippleApiClient(RippleApiBaseClient):
 
 
 class CheesegullApiClient(RippleApiBaseClient):
+    client_name = "cheesegull"
+
     def __init__(self, base: str = "https://storage.ripple.moe", user_agent: str = "fokabot", timeout: int = 5):
         super(CheesegullApiClient, self).__init__(
             token=None, base=base, user_agent=user_agent, timeout=timeout, check_status=False
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, Any, Callable, Awaitable, Hashable
+
+from utils import metrics
+
+CALLS = metrics.registry.counter(
+    "fokabot_singleflight_calls_total",
+    "Calls that went through a single-flight group",
+    ("group",)
+)
+SHARED = metrics.registry.counter(
+    "fokabot_singleflight_shared_total",
+    "Calls that waited for the result of an identical call already in flight, instead of making their own",
+    ("group",)
+)
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one.
+    The first caller runs the coroutine, the others wait for its result
+    (or its exception). Once it completes, the next call with the
+    same key runs the coroutine again: nothing is cached.
+    ```
+    >>> flights = SingleFlight("what_id")
+    >>> user_id = await flights.do(username, lambda: api.what_id(username))
+    ```
+    """
+    def __init__(self, name: str):
+        """
+        :param name: name of this group, used as metrics label
+        """
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, f: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        :param key: calls with the same key are collapsed
+        :param f: function that returns the awaitable to run. Called only if there's no call in flight for `key`.
+        :return: the result of the call
+        """
+        CALLS.inc(group=self.name)
+        future = self._in_flight.get(key, None)
+        if future is None:
+            future = asyncio.ensure_future(f())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._forget(key, future))
+        else:
+            SHARED.inc(group=self.name)
+        # A caller that gets cancelled must not cancel the call for everyone else
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future) -> None:
+        if self._in_flight.get(key, None) is future:
+            del self._in_flight[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
@@ -0,0 +1,210 @@
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+try:
+    import contextvars
+except ImportError:
+    # Python 3.6, tracing is not available
+    contextvars = None
+
+import logging
+import random
+import sys
+import time
+from typing import Optional, Dict, Any, TextIO
+
+# Span that is currently running, in this task
+_current = contextvars.ContextVar("fokabot_span", default=None) if contextvars is not None else None
+
+
+class Span:
+    """
+    A timed operation, part of a trace.
+    Use it as a context manager to make it the parent of the spans started inside it.
+    """
+    __slots__ = "tracer", "trace_id", "span_id", "parent_id", "name", "attributes", "start", "_started_at", "_token"
+
+    def __init__(self, tracer: "Tracer", name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self._started_at = time.monotonic()
+        self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Sets an attribute of this span
+
+        :param key:
+        :param value:
+        :return:
+        """
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+        Ends this span and exports it
+
+        :param error: exception that ended the span, if any
+        :return:
+        """
+        duration = time.monotonic() - self._started_at
+        self.tracer.export({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": duration,
+            "attributes": self.attributes,
+            "error": f"{type(error).__name__}: {error}" if error is not None else None,
+        })
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        _current.reset(self._token)
+        self._token = None
+        self.finish(exc)
+
+
+class _NoopSpan:
+    """
+    Returned instead of a span when the trace is not sampled
+    """
+    __slots__ = ()
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class FileExporter:
+    """
+    Writes finished spans as json lines, to a file or to stdout.
+    Spans are written as soon as they finish, group them by trace_id
+    to rebuild the traces (see tools/traces.py).
+    """
+    def __init__(self, path: str = "-"):
+        """
+        :param path: output file, '-' for stdout
+        """
+        self.path = path
+        self._file: TextIO = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+
+    def export(self, span: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(span) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class Tracer:
+    """
+    Starts and exports spans. The current span is carried in a contextvar,
+    so spans started by the same task (and by the tasks it creates) nest automatically.
+    Traces are sampled when they start: spans of a trace that is not sampled
+    (or started outside a trace) cost a contextvar lookup and nothing else.
+    """
+    logger = logging.getLogger("tracing")
+
+    def __init__(self):
+        self.sample_rate: float = 0
+        self.exporter: Optional[FileExporter] = None
+
+    def configure(self, sample_rate: float, exporter: Optional[FileExporter]) -> None:
+        """
+        :param sample_rate: ratio of traces that are recorded, between 0 and 1
+        :param exporter: where finished spans go
+        :return:
+        """
+        if sample_rate > 0 and _current is None:
+            self.logger.warning("Tracing requires Python 3.7 or newer (contextvars). Tracing disabled.")
+            sample_rate = 0
+        self.sample_rate = sample_rate if exporter is not None else 0
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0
+
+    def trace(self, name: str, **attributes) -> Any:
+        """
+        Starts a new trace, if sampled
+
+        :param name: name of the root span
+        :param attributes: attributes of the root span
+        :return: the root span (use it as a context manager), or a no-op span
+        """
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return NOOP_SPAN
+        return Span(self, name, f"{random.getrandbits(128):032x}", None, attributes)
+
+    def span(self, name: str, **attributes) -> Any:
+        """
+        Starts a span, child of the current one
+
+        :param name: span name
+        :param attributes: span attributes
+        :return: the span (use it as a context manager), or a no-op span if there's no trace running
+        """
+        span = self.start_span(name, **attributes)
+        return span if span is not None else NOOP_SPAN
+
+    def start_span(self, name: str, **attributes) -> Optional[Span]:
+        """
+        Starts a span, child of the current one, without making it the current span.
+        Useful for operations that complete somewhere else: call `finish` on it when it's done.
+
+        :param name: span name
+        :param attributes: span attributes
+        :return: the span, or None if there's no trace running
+        """
+        parent = current()
+        if parent is None:
+            return None
+        return Span(self, name, parent.trace_id, parent.span_id, attributes)
+
+    def export(self, span: Dict[str, Any]) -> None:
+        if self.exporter is None:
+            return
+        try:
+            self.exporter.export(span)
+        except Exception:
+            self.logger.exception("Could not export span")
+
+    def close(self) -> None:
+        if self.exporter is not None:
+            self.exporter.close()
+        self.configure(0, None)
+
+
+def current() -> Optional[Span]:
+    """
+    :return: the span that is currently running, if any
+    """
+    return _current.get() if _current is not None else None
+
+
+tracer = Tracer()
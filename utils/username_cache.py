@@ -0,0 +1,110 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import aioredis
+
+from utils import metrics
+from utils.general import safefify_username
+from utils.rippleapi import RippleApiClient
+from utils.singleflight import SingleFlight
+
+LOOKUPS = metrics.registry.counter(
+    "fokabot_username_cache_lookups_total",
+    "Username to user id lookups, by where the answer came from (memory, redis or api)",
+    ("source",)
+)
+SIZE = metrics.registry.gauge(
+    "fokabot_username_cache_size",
+    "Usernames in the in-process username to user id cache"
+)
+
+REDIS_KEY = "fokabot:user_id:{}"
+
+
+class UsernameCache:
+    """
+    Username -> user id resolution, in front of RippleApiClient.what_id.
+    Results are kept in an in-process LRU cache, keyed by safe username, for `ttl`
+    seconds. "No such user" is cached as well, for `negative_ttl` seconds, so it
+    doesn't linger for long after someone registers.
+    Concurrent lookups of the same username share a single api request.
+    If `redis` is set, the results are shared with the other instances through it.
+    """
+    logger = logging.getLogger("username_cache")
+
+    def __init__(
+        self, ripple_api_client: RippleApiClient,
+        max_size: int = 10000, ttl: float = 600, negative_ttl: float = 30,
+        redis: Optional[aioredis.Redis] = None
+    ):
+        """
+        :param ripple_api_client: client used on cache misses
+        :param max_size: maximum number of usernames kept in memory
+        :param ttl: seconds a user id is cached for
+        :param negative_ttl: seconds a missing user is cached for
+        :param redis: if not None, the results are shared through redis as well
+        """
+        self.ripple_api_client = ripple_api_client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.redis = redis
+        # safe username -> (expires at (monotonic), user id or None if there's no such user)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[int]]]" = OrderedDict()
+        self._flights = SingleFlight("what_id")
+
+    async def get(self, username: str) -> Optional[int]:
+        """
+        :param username: username, either normal or safe
+        :return: the user id, or None if there's no such user
+        """
+        key = safefify_username(username)
+        entry = self._entries.get(key, None)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                LOOKUPS.inc(source="memory")
+                return entry[1]
+            del self._entries[key]
+        return await self._flights.do(key, lambda: self._fetch(key, username))
+
+    async def _fetch(self, key: str, username: str) -> Optional[int]:
+        if self.redis is not None:
+            try:
+                cached = await self.redis.get(REDIS_KEY.format(key), encoding="utf-8")
+            except Exception as e:
+                self.logger.warning(f"Could not read {key} from redis ({e})")
+                cached = None
+            if cached is not None:
+                user_id = int(cached) if cached else None
+                LOOKUPS.inc(source="redis")
+                self._put(key, user_id)
+                return user_id
+
+        user_id = await self.ripple_api_client.what_id(username)
+        LOOKUPS.inc(source="api")
+        self._put(key, user_id)
+        ttl = self._ttl(user_id)
+        if self.redis is not None and ttl > 0:
+            try:
+                await self.redis.set(
+                    REDIS_KEY.format(key), str(user_id) if user_id is not None else "", expire=max(1, int(ttl))
+                )
+            except Exception as e:
+                self.logger.warning(f"Could not write {key} to redis ({e})")
+        return user_id
+
+    def _ttl(self, user_id: Optional[int]) -> float:
+        return self.ttl if user_id is not None else self.negative_ttl
+
+    def _put(self, key: str, user_id: Optional[int]) -> None:
+        ttl = self._ttl(user_id)
+        if ttl <= 0:
+            return
+        self._entries[key] = (time.monotonic() + ttl, user_id)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        SIZE.set(len(self._entries))
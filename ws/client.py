@@ -1,9 +1,11 @@
 import functools
 import logging
+import re
+import time
 
 import asyncio
-from collections import defaultdict
-from typing import Optional, List, Callable, DefaultDict
+from collections import defaultdict, deque
+from typing import Optional, List, Callable, DefaultDict, Deque, Set, Tuple, TextIO
 
 import traceback
 
@@ -15,7 +17,17 @@ import json as stdjson
 
 import aiohttp
 
-from ws.messages import WsMessage
+from utils import metrics
+from ws.dispatcher import HandlerDispatcher, ordering_key
+from ws.messages import WsMessage, WsPong
+
+# Matches the type of an incoming frame, if "type" is the first key of the top level object
+TYPE_PEEK_REGEX = re.compile(r'\s*{\s*"type"\s*:\s*"([^"\\]*)"')
+
+PONG_LATENCY = metrics.registry.histogram(
+    "fokabot_ws_pong_latency_seconds",
+    "Time between receiving a ping from the server and writing the pong to the socket",
+)
 
 
 class LoginFailedError(Exception):
@@ -25,59 +37,243 @@ class LoginFailedError(Exception):
 class WsClient:
     logger = logging.getLogger("ws_client")
 
-    def __init__(self, ws_url: str):
+    def __init__(
+        self, ws_url: str, max_batch_size: int = 64, handler_workers: int = 32, capture_path: Optional[str] = None
+    ):
         self.ws_url = ws_url
-        self._writer_queue = asyncio.Queue()
+        # Maximum number of frames sent by the writer before yielding back to the loop
+        self.max_batch_size = max_batch_size
+        # Handlers of incoming messages run on a bounded pool, ordered per channel/match
+        self.dispatcher = HandlerDispatcher(workers=handler_workers)
+        # Handlers of internal events (connected, ready, ...) run as plain tasks
+        self._internal_tasks: Set[asyncio.Task] = set()
+        # Chat traffic
+        self._writer_queue: Deque[WsMessage] = deque()
+        # Protocol and control messages (auth, subscribe, pong...) always jump ahead of chat traffic
+        self._control_queue: Deque[WsMessage] = deque()
+        self._writer_wakeup = asyncio.Event()
+        # Arrival times of pings that haven't been answered yet
+        self._ping_times: Deque[float] = deque()
         # Messages sent while the client is reconnecting end up in here
-        self._old_writer_queue: Optional[asyncio.Queue] = None
-        self._events: DefaultDict[str, asyncio.Event] = defaultdict(lambda: asyncio.Event())
+        self._old_writer_queue: Optional[Deque[WsMessage]] = None
+        # Futures waiting for an event, resolved (and removed) the next time the event is triggered
+        self._waiters: DefaultDict[str, List[asyncio.Future]] = defaultdict(list)
+        # Requests waiting for a reply, by reply type. A request with multiple
+        # possible replies (eg: auth_success/auth_failure) is in more than one deque.
+        self._pending_requests: DefaultDict[str, Deque[Tuple[WsMessage, asyncio.Future]]] = defaultdict(deque)
         self._event_handlers: DefaultDict[str, List[Callable]] = defaultdict(list)
         self.ws: Optional[aiohttp.ClientWebSocketResponse] = None
         self.writer_task: Optional[asyncio.Task] = None
         self.reader_task: Optional[asyncio.Task] = None
         self.running: bool = False
         self.suspended: bool = False
+        # Every inbound frame is appended in here, if set. See tools/replay.py.
+        self._capture: Optional[TextIO] = None
+        if capture_path is not None:
+            self._capture = open(capture_path, "a", encoding="utf-8", buffering=1 << 16)
+            self.logger.info(f"Capturing inbound ws traffic to {capture_path}")
+
+    def capture(self, data: str) -> None:
+        """
+        Appends an inbound frame to the capture file, one "<unix time>\t<frame>" line per frame.
+
+        :param data: raw frame
+        :return:
+        """
+        if "\n" in data:
+            # Newlines can only be whitespace between json tokens, they're escaped in strings
+            data = data.replace("\n", " ")
+        self._capture.write(f"{time.time():.6f}\t{data}\n")
 
     def recycle_queue(self):
         self._old_writer_queue = self._writer_queue
-        self._writer_queue = asyncio.Queue()
+        self._writer_queue = deque()
 
     def flush_old_queue(self):
         if self._old_writer_queue is None:
             return
-        while not self._old_writer_queue.empty():
-            self.send(self._old_writer_queue.get_nowait())
+        while self._old_writer_queue:
+            self.send(self._old_writer_queue.popleft())
         self._old_writer_queue = None
 
+    def pending_messages(self) -> List[WsMessage]:
+        """
+        Returns the chat messages that haven't been sent yet,
+        including the ones held back while suspended
+
+        :return: list of messages, oldest first
+        """
+        return list(self._old_writer_queue or ()) + list(self._writer_queue)
+
     def send(self, message: WsMessage) -> None:
-        self._writer_queue.put_nowait(message)
+        if getattr(message, "control", False):
+            self._control_queue.append(message)
+        else:
+            self._writer_queue.append(message)
+        self._writer_wakeup.set()
 
     @staticmethod
-    def decode_message(message: aiohttp.WSMessage) -> WsMessage:
+    def decode_frame(data: str) -> WsMessage:
         try:
-            json_message = json.loads(message.data)
+            json_message = json.loads(data)
         except (stdjson.JSONDecodeError, ValueError) as e:
             # ujson uses ValueError and doesn't have JSONDecodeError
             # so we must import both ujson and json (or json twice)
             raise ValueError()
         return WsMessage.dict_factory(json_message)
 
+    @staticmethod
+    def decode_message(message: aiohttp.WSMessage) -> WsMessage:
+        return WsClient.decode_frame(message.data)
+
+    @staticmethod
+    def peek_type(data: str) -> Optional[str]:
+        """
+        Returns the type of a raw incoming frame without decoding it.
+
+        :param data: raw json frame
+        :return: the message type, or None if it can't be determined
+                 without decoding the whole frame
+        """
+        match = TYPE_PEEK_REGEX.match(data)
+        return match.group(1) if match is not None else None
+
+    def wants(self, event: str) -> bool:
+        """
+        :param event: event name (eg: 'msg:chat_message')
+        :return: True if there's at least one handler or waiter for this event
+        """
+        event = event.lower()
+        return bool(self._event_handlers.get(event, None)) \
+            or bool(self._waiters.get(event, None)) \
+            or (event.startswith("msg:") and bool(self._pending_requests.get(event[4:], None)))
+
+    def feed(self, data: str) -> None:
+        """
+        Processes a raw incoming TEXT frame.
+        Frames that nobody is interested in are dropped without decoding them.
+
+        :param data: raw json frame
+        :return:
+        """
+        type_ = WsClient.peek_type(data)
+        if type_ == "ping":
+            self._ping_times.append(time.monotonic())
+        elif type_ is not None and not self.wants(f"msg:{type_}"):
+            return
+        try:
+            d_msg = WsClient.decode_frame(data)
+        except ValueError:
+            self.logger.error(f"Invalid incoming message: {data}")
+            return
+        if type_ is None and d_msg.type_ == "ping":
+            self._ping_times.append(time.monotonic())
+        self._resolve_request(d_msg)
+        self.trigger(f"msg:{d_msg.type_}", **d_msg.data)
+
+    def _resolve_request(self, reply: WsMessage) -> None:
+        """
+        Resolves the oldest pending request that accepts this reply, if any.
+        delta processes the commands sent on a connection in order, so replies of
+        the same type come back in the same order as their requests.
+
+        :param reply: an incoming message
+        :return:
+        """
+        pending = self._pending_requests.get(reply.type_, None)
+        if not pending:
+            return
+        for request, future in pending:
+            if request.matches_reply(reply):
+                future.set_result(reply)
+                self._forget_request(request, future)
+                break
+
+    def _forget_request(self, request: WsMessage, future: asyncio.Future) -> None:
+        for reply_type in request.replies:
+            pending = self._pending_requests.get(reply_type, None)
+            if pending is None:
+                continue
+            try:
+                pending.remove((request, future))
+            except ValueError:
+                pass
+            if not pending:
+                del self._pending_requests[reply_type]
+
+    async def request(self, message: WsMessage, timeout: float = 10) -> WsMessage:
+        """
+        Sends a message and waits for its reply
+
+        :param message: the message. Must have at least one reply type.
+        :param timeout: seconds to wait for the reply
+        :return: the reply. Check its `type_` for messages that have
+                 more than one possible reply (eg: auth_success/auth_failure)
+        :raises asyncio.TimeoutError: if no reply comes in within `timeout` seconds
+        :raises ConnectionError: if the connection is closed before the reply comes in
+        """
+        if not message.replies:
+            raise ValueError(f"{type(message).__name__} has no replies")
+        future = asyncio.get_event_loop().create_future()
+        for reply_type in message.replies:
+            self._pending_requests[reply_type].append((message, future))
+        self.send(message)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            # Timed out or cancelled, a late reply must not resolve someone else's request
+            self._forget_request(message, future)
+
+    def _fail_pending_requests(self) -> None:
+        for pending in self._pending_requests.values():
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed before getting a reply"))
+        self._pending_requests.clear()
+
+    @staticmethod
+    def encode_message(message: WsMessage) -> str:
+        if callable(getattr(message, "__dict__", None)):
+            message = message.__dict__()
+        else:
+            message = dict(message)
+        return json.dumps(message)
+
     async def writer(self):
         try:
             self.logger.debug("Started writer task")
             while True:
-                message = await self._writer_queue.get()
-                if message is None:
-                    self.logger.debug("Writer: Ignored a None message")
-                    continue
-                if callable(getattr(message, "__dict__", None)):
-                    message = message.__dict__()
-                else:
-                    message = dict(message)
-                self.logger.debug(f"<- {message}")
+                if not self._control_queue and not self._writer_queue:
+                    self._writer_wakeup.clear()
+                    await self._writer_wakeup.wait()
                 if self.ws is None or self.ws.closed:
                     raise asyncio.CancelledError()
-                await self.ws.send_json(message)
+                debug = self.logger.isEnabledFor(logging.DEBUG)
+                # Send everything that's ready, up to max_batch_size frames.
+                # The control lane is checked before every frame, so
+                # control messages never wait behind more than one chat message.
+                sent = 0
+                while sent < self.max_batch_size and (self._control_queue or self._writer_queue):
+                    message = (self._control_queue or self._writer_queue).popleft()
+                    sent += 1
+                    if message is None:
+                        if debug:
+                            self.logger.debug("Writer: Ignored a None message")
+                        continue
+                    frame = WsClient.encode_message(message)
+                    if debug:
+                        self.logger.debug(f"<- {frame}")
+                    # send_str writes directly to the transport and suspends
+                    # only if the write buffer is full, so the whole batch
+                    # is sent back to back without yielding to the loop.
+                    await self.ws.send_str(frame)
+                    if message.span is not None:
+                        message.span.finish()
+                    if type(message) is WsPong and self._ping_times:
+                        PONG_LATENCY.observe(time.monotonic() - self._ping_times.popleft())
+                if sent >= self.max_batch_size:
+                    # Let other tasks run before sending the next batch
+                    await asyncio.sleep(0)
         except asyncio.CancelledError:
             self.logger.warning("Writer task stopped.")
 
@@ -89,6 +285,9 @@ class WsClient:
                     if self.suspended:
                         self.logger.debug("Recycling writer queue")
                         self.recycle_queue()
+                    # Pongs for the previous connection are useless now
+                    self._control_queue = deque(x for x in self._control_queue if type(x) is not WsPong)
+                    self._ping_times.clear()
 
                     self.running = True
                     self.ws = ws
@@ -99,12 +298,11 @@ class WsClient:
                     async for message in ws:
                         try:
                             if message.type == aiohttp.WSMsgType.TEXT:
-                                self.logger.debug(f"-> {message.data}")
-                                try:
-                                    d_msg = WsClient.decode_message(message)
-                                    self.trigger(f"msg:{d_msg.type_}", **d_msg.data)
-                                except ValueError:
-                                    self.logger.error(f"Invalid incoming message: {message.data}")
+                                if self.logger.isEnabledFor(logging.DEBUG):
+                                    self.logger.debug(f"-> {message.data}")
+                                if self._capture is not None:
+                                    self.capture(message.data)
+                                self.feed(message.data)
                             elif message.type == aiohttp.WSMsgType.ERROR:
                                 self.logger.error("Connection error")
                                 break
@@ -116,6 +314,8 @@ class WsClient:
         finally:
             if self.writer_task is not None:
                 self.writer_task.cancel()
+            if self._capture is not None:
+                self._capture.flush()
             if self.ws is not None and not self.ws.closed:
                 self.logger.info("Closing connection")
                 try:
@@ -123,6 +323,7 @@ class WsClient:
                 except Exception as e:
                     self.logger.error(f"Error while closing connection: {str(e)}")
             self.running = False
+            self._fail_pending_requests()
             self.trigger("disconnected")
             self.logger.info("Disconnected.")
 
@@ -137,34 +338,74 @@ class WsClient:
     def stop(self):
         self.reader_task.cancel()
 
+    async def dispose(self) -> None:
+        """
+        Cancels all running and pending event handlers
+
+        :return:
+        """
+        await self.dispatcher.dispose()
+        for task in self._internal_tasks:
+            task.cancel()
+        await asyncio.gather(*self._internal_tasks, return_exceptions=True)
+        if self._capture is not None:
+            self._capture.close()
+            self._capture = None
+
     def trigger(self, k_: str, **kwargs) -> None:
         k_ = k_.lower()
-        for handler in self._event_handlers[k_]:
-            asyncio.ensure_future(handler(**kwargs))
-        e = self._events[k_]
-        e.set()
-        e.clear()
-
-    async def _wait_for(self, event: str) -> str:
-        await self._events[event.lower()].wait()
-        return event
+        handlers = self._event_handlers.get(k_, None)
+        if handlers:
+            if k_.startswith("msg:"):
+                key = ordering_key(k_, kwargs)
+                for handler in handlers:
+                    self.dispatcher.submit(k_, handler, kwargs, key=key)
+            else:
+                # Internal events may wait for other events for a long time (eg: reconnection),
+                # they must not take workers away from incoming messages
+                for handler in handlers:
+                    task = asyncio.ensure_future(handler(**kwargs))
+                    self._internal_tasks.add(task)
+                    task.add_done_callback(self._internal_tasks.discard)
+        waiters = self._waiters.pop(k_, None)
+        if waiters is not None:
+            for future in waiters:
+                if not future.done():
+                    future.set_result(None)
 
     async def wait(self, *events, return_when=asyncio.FIRST_COMPLETED) -> Optional[List[str]]:
+        """
+        Waits for one or more events to be triggered.
+        Waiters are registered before this coroutine suspends, so an event triggered
+        right after calling wait() is never lost.
+
+        :param events: event names
+        :param return_when: same as asyncio.wait
+        :return: the names of the events that have been triggered
+        """
         if not events:
             return
-        done, pending = await asyncio.wait(
-            [self._wait_for(event) for event in events],
-            return_when=return_when
-        )
+        loop = asyncio.get_event_loop()
+        futures = {}
+        for event in events:
+            future = loop.create_future()
+            self._waiters[event.lower()].append(future)
+            futures[future] = event
+        try:
+            done, pending = await asyncio.wait(futures.keys(), return_when=return_when)
+        finally:
+            # Forget about the events that didn't come in (or all of them, if we've been cancelled)
+            for future, event in futures.items():
+                if future.done():
+                    continue
+                future.cancel()
+                waiters = self._waiters.get(event.lower(), None)
+                if waiters is not None:
+                    waiters.remove(future)
+                    if not waiters:
+                        del self._waiters[event.lower()]
         self.logger.debug(f"Got something (done:{done}, pending:{pending})")
-
-        # Get the result(s) of the completed task(s).
-        ret = [future.result() for future in done]
-
-        # Cancel any events that didn't come in.
-        for future in pending:
-            future.cancel()
-        return ret
+        return [futures[future] for future in done]
 
     def on(self, event: str, f: Callable = None) -> Callable:
         if f is None:
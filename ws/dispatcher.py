@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import time
+import traceback
+from collections import deque
+from typing import Callable, Dict, Any, Optional, Hashable, Deque, List, Union
+
+from utils import metrics
+
+QUEUE_TIME = metrics.registry.histogram(
+    "fokabot_ws_handler_queue_seconds",
+    "Time spent by ws event handlers waiting for a free worker",
+    ("event",)
+)
+IN_FLIGHT = metrics.registry.gauge(
+    "fokabot_ws_handlers_in_flight",
+    "Ws event handlers currently running"
+)
+BACKLOG = metrics.registry.gauge(
+    "fokabot_ws_handlers_backlog",
+    "Ws event handlers waiting for a free worker"
+)
+HANDLER_TIME = metrics.registry.histogram(
+    "fokabot_ws_handler_seconds",
+    "Time spent running ws event handlers",
+    ("event", "handler")
+)
+HANDLER_ERRORS = metrics.registry.counter(
+    "fokabot_ws_handler_errors_total",
+    "Ws event handlers that raised an unhandled exception",
+    ("event", "handler")
+)
+
+
+def ordering_key(event: str, kwargs: Dict[str, Any]) -> Optional[Hashable]:
+    """
+    Returns the key used to serialize handlers of an incoming ws event.
+    Handlers with the same key run one at a time, in the order the events came in.
+
+    :param event: event name (eg: 'msg:chat_message')
+    :param kwargs: event data
+    :return: a hashable key, or None if the handlers can run in any order
+    """
+    if event == "msg:chat_message":
+        if kwargs.get("pm", False):
+            return "pm", kwargs["sender"]["api_identifier"]
+        return "channel", kwargs["recipient"]["name"]
+    if event.startswith("msg:match_") or event.startswith("msg:lobby_match_"):
+        match = kwargs.get("match", None)
+        match_id = match["id"] if type(match) is dict else kwargs.get("id", None)
+        if match_id is not None:
+            return "match", match_id
+    elif event == "msg:status_update":
+        client = kwargs.get("client", None)
+        if client is not None:
+            return "user", client["user_id"]
+    return None
+
+
+class Job:
+    __slots__ = "event", "handler", "kwargs", "enqueued_at"
+
+    def __init__(self, event: str, handler: Callable, kwargs: Dict[str, Any]):
+        self.event = event
+        self.handler = handler
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+
+
+class HandlerDispatcher:
+    """
+    Runs ws event handlers on a bounded pool of workers.
+    Handlers that share the same ordering key (same channel, same match...)
+    are queued and run one after the other, handlers with no key run as
+    soon as a worker is free.
+    """
+    logger = logging.getLogger("ws_dispatcher")
+
+    def __init__(self, workers: int = 32):
+        self.workers = workers
+        # Per-key serial queues. A key is in here while it has pending or running jobs.
+        self._keyed: Dict[Hashable, Deque[Job]] = {}
+        # Jobs with no key and keys that have pending jobs, in arrival order
+        self._ready: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+        self.in_flight: int = 0
+        self.backlog: int = 0
+
+    def _start(self) -> None:
+        self._ready = asyncio.Queue()
+        self._worker_tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        self.logger.debug(f"Started {self.workers} handler workers")
+
+    def submit(self, event: str, handler: Callable, kwargs: Dict[str, Any], key: Optional[Hashable] = None) -> None:
+        """
+        Schedules a handler
+
+        :param event: event name, used for logging and metrics
+        :param handler: the handler coroutine function
+        :param kwargs: kwargs to pass to the handler
+        :param key: ordering key, or None
+        :return:
+        """
+        if not self._worker_tasks:
+            self._start()
+        job = Job(event, handler, kwargs)
+        self.backlog += 1
+        BACKLOG.inc()
+        if key is None:
+            self._ready.put_nowait(job)
+            return
+        queue = self._keyed.get(key, None)
+        if queue is None:
+            # Nothing pending or running for this key, schedule it right away
+            self._keyed[key] = deque((job,))
+            self._ready.put_nowait(key)
+        else:
+            # The key is already scheduled, the job will run after the ones in front of it
+            queue.append(job)
+
+    async def _run(self, job: Job) -> None:
+        self.backlog -= 1
+        BACKLOG.dec()
+        QUEUE_TIME.observe(time.monotonic() - job.enqueued_at, event=job.event)
+        self.in_flight += 1
+        IN_FLIGHT.inc()
+        name = metrics.handler_name(job.handler)
+        start = time.monotonic()
+        try:
+            await job.handler(**job.kwargs)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            HANDLER_ERRORS.inc(event=job.event, handler=name)
+            self.logger.error(f"Unhandled exception in {job.event} handler {job.handler}: {e}")
+            self.logger.error(traceback.format_exc())
+        finally:
+            HANDLER_TIME.observe(time.monotonic() - start, event=job.event, handler=name)
+            self.in_flight -= 1
+            IN_FLIGHT.dec()
+
+    async def _worker(self) -> None:
+        while True:
+            item: Union[Job, Hashable] = await self._ready.get()
+            if type(item) is not Job:
+                queue = self._keyed[item]
+                try:
+                    await self._run(queue[0])
+                finally:
+                    queue.popleft()
+                    if queue:
+                        # Go back in line, so a busy key doesn't starve the others
+                        self._ready.put_nowait(item)
+                    else:
+                        del self._keyed[item]
+            else:
+                await self._run(item)
+
+    async def dispose(self) -> None:
+        """
+        Cancels all workers, including the running handlers, and drops all pending handlers
+
+        :return:
+        """
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        BACKLOG.dec(self.backlog)
+        self.backlog = 0
+        self._worker_tasks = []
+        self._keyed.clear()
+        self._ready = None
@@ -1,15 +1,24 @@
-from typing import Dict, Any, TypeVar, Optional, Union
+from typing import Dict, Any, TypeVar, Optional, Union, Tuple
 
 from constants.events import WsEvent
+from utils import tracing
 
 
 class WsMessage:
-    def __init__(self, type_: str, data=None):
+    # Control messages are sent through WsClient's priority lane
+    control: bool = False
+    # Types of the messages the server replies with, used by WsClient.request
+    replies: Tuple[str, ...] = ()
+    # Tracing span, finished by WsClient.writer once the message is written
+    span: Optional["tracing.Span"] = None
+
+    def __init__(self, type_: str, data=None, copy: bool = True):
         if data is None:
             data = {}
         self.type_ = type_
         if type(data) is dict:
-            data = dict(data)
+            if copy:
+                data = dict(data)
         elif callable(getattr(data, "__dict__", None)):
             # lol pycharm
             data = data.__dict__()
@@ -23,7 +32,8 @@ class WsMessage:
         data = ws_message_dict.get("data", None)
         if type_ is None or data is None:
             raise ValueError("Invalid ws message structure")
-        return cls(type_=type_, data=data)
+        # Freshly decoded data is not shared with anyone, no need to copy it
+        return cls(type_=type_, data=data, copy=False)
 
     def __dict__(self) -> Dict[str, Any]:
         return {
@@ -31,26 +41,51 @@ class WsMessage:
             "data": self.data
         }
 
+    def matches_reply(self, reply: "WsMessage") -> bool:
+        """
+        Called by WsClient with an incoming message of one of the `replies` types.
+
+        :param reply: the incoming message
+        :return: True if `reply` is the reply to this message
+        """
+        return True
+
 
 class WsAuth(WsMessage):
+    control = True
+    replies = ("auth_success", "auth_failure")
+
     def __init__(self, token: str):
         super(WsAuth, self).__init__("auth", {"token": token})
 
 
 class WsSubscribe(WsMessage):
+    control = True
+    replies = ("subscribed",)
+
     def __init__(self, event: WsEvent, data: Optional[Dict[str, Any]] = None):
         o = {"event": event.value}
         if data is not None:
             o['data'] = data
         super(WsSubscribe, self).__init__("subscribe", o)
 
+    def matches_reply(self, reply: WsMessage) -> bool:
+        # If the server echoes what we've subscribed to, use it to pick the right
+        # request. Otherwise, rely on the order of the replies.
+        return reply.data.get("event", self.data["event"]) == self.data["event"] \
+            and reply.data.get("data", self.data.get("data", None)) == self.data.get("data", None)
+
 
 class WsJoinChatChannel(WsMessage):
+    control = True
+
     def __init__(self, channel: str):
         super(WsJoinChatChannel, self).__init__("join_chat_channel", {"name": channel})
 
 
 class WsPong(WsMessage):
+    control = True
+
     def __init__(self):
         super(WsPong, self).__init__("pong")
 
@@ -71,10 +106,16 @@ class WsUnsubscribeMatch(WsSubscribe):
 
 
 class WsResume(WsMessage):
+    control = True
+    replies = ("resume_success", "resume_failure")
+
     def __init__(self, token: str):
         super(WsResume, self).__init__("resume", {"token": token})
 
 
 class WsSuspend(WsMessage):
+    control = True
+    replies = ("suspend",)
+
     def __init__(self):
         super(WsSuspend, self).__init__("suspend")
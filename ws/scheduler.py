@@ -0,0 +1,314 @@
+import asyncio
+import logging
+import time
+from collections import deque, OrderedDict
+from typing import Dict, Deque, Optional, Union, Any, Tuple, List
+
+from utils import metrics
+from ws.client import WsClient
+from ws.messages import WsChatMessage
+
+QUEUE_WAIT = metrics.registry.histogram(
+    "fokabot_outbound_queue_wait_seconds",
+    "Time spent by chat messages in the outbound scheduler",
+    ("kind",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+QUEUE_DEPTH = metrics.registry.gauge(
+    "fokabot_outbound_queue_depth",
+    "Chat messages waiting in the outbound scheduler",
+    ("kind",)
+)
+DROPPED = metrics.registry.counter(
+    "fokabot_outbound_dropped_total",
+    "Chat messages dropped because too many were buffered while disconnected",
+    ("kind",)
+)
+
+
+def recipient_kind(recipient: Union[str, int]) -> str:
+    """
+    Returns the class of a recipient, used as a low cardinality metrics label
+
+    :param recipient: channel name, username or user id
+    :return: 'multi', 'spect', 'channel' or 'pm'
+    """
+    if type(recipient) is str and recipient.startswith("#"):
+        if recipient.startswith("#multi_"):
+            return "multi"
+        if recipient.startswith("#spect_"):
+            return "spect"
+        return "channel"
+    return "pm"
+
+
+class TokenBucket:
+    __slots__ = "rate", "capacity", "tokens", "updated_at"
+
+    def __init__(self, rate: float, capacity: float):
+        """
+        A classic token bucket. A rate <= 0 means unlimited.
+
+        :param rate: tokens added per second
+        :param capacity: maximum number of tokens (burst size)
+        """
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self) -> None:
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+    def delay(self, now: float) -> float:
+        """
+        :return: seconds to wait before a token is available
+        """
+        if self.available(now):
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RecipientQueue:
+    __slots__ = "messages", "bucket"
+
+    def __init__(self, bucket: TokenBucket):
+        self.messages: Deque[Tuple[WsChatMessage, float]] = deque()
+        self.bucket = bucket
+
+
+class RecipientStats:
+    __slots__ = "sent", "total_wait", "max_wait"
+
+    def __init__(self):
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+
+class OutboundScheduler:
+    """
+    Sits in front of WsClient.send for chat messages.
+    Every recipient has its own queue and token bucket, and recipients with pending
+    messages are served round-robin, so a busy channel can't starve the others.
+    A global token bucket caps the overall rate.
+    """
+    logger = logging.getLogger("outbound_scheduler")
+
+    def __init__(
+        self, client: WsClient,
+        global_rate: float = 100, global_burst: float = 200,
+        recipient_rate: float = 5, recipient_burst: float = 10,
+        max_buffered: int = 1000, stats_max_recipients: int = 1000
+    ):
+        """
+        Initializes a new OutboundScheduler.
+        Rates are in messages per second, a rate <= 0 disables that limit.
+
+        :param client: the ws client that will send the messages
+        :param global_rate: maximum number of messages per second, all recipients combined
+        :param global_burst: maximum global burst
+        :param recipient_rate: maximum number of messages per second to the same recipient
+        :param recipient_burst: maximum burst to the same recipient
+        :param max_buffered: maximum number of messages kept while disconnected.
+                             New messages are dropped past this limit. <= 0 means unlimited.
+        :param stats_max_recipients: maximum number of recipients whose statistics are kept.
+                                     The least recently served ones are forgotten first.
+        """
+        self.client = client
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.recipient_rate = recipient_rate
+        self.recipient_burst = recipient_burst
+        self.max_buffered = max_buffered
+        self.dropped: int = 0
+        self._pending: int = 0
+        self._queues: Dict[Union[str, int], RecipientQueue] = {}
+        # Outlives the queues, which are forgotten as soon as they're idle
+        self.stats_max_recipients = stats_max_recipients
+        self._stats: "OrderedDict[Union[str, int], RecipientStats]" = OrderedDict()
+        # Recipients with pending messages, in round-robin order
+        self._ready: Deque[Union[str, int]] = deque()
+        self._wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def enqueue(self, message: WsChatMessage) -> None:
+        """
+        Schedules a chat message
+
+        :param message: the chat message
+        :return:
+        """
+        recipient = message.data["target"]
+        if not self.client.running and 0 < self.max_buffered <= self._pending:
+            # Don't pile up an unbounded amount of stale messages during an outage
+            if self.dropped == 0:
+                self.logger.warning(f"Too many messages buffered while disconnected ({self._pending}). Dropping.")
+            self.dropped += 1
+            DROPPED.inc(kind=recipient_kind(recipient))
+            return
+        queue = self._queues.get(recipient, None)
+        if queue is None:
+            queue = self._queues[recipient] = RecipientQueue(TokenBucket(self.recipient_rate, self.recipient_burst))
+        if not queue.messages:
+            self._ready.append(recipient)
+        queue.messages.append((message, time.monotonic()))
+        self._pending += 1
+        QUEUE_DEPTH.inc(kind=recipient_kind(recipient))
+        self._wakeup.set()
+
+    def _send_next(self, recipient: Union[str, int], queue: RecipientQueue, now: float) -> None:
+        message, enqueued_at = queue.messages.popleft()
+        self._pending -= 1
+        queue.bucket.take()
+        self.global_bucket.take()
+        wait = now - enqueued_at
+        stats = self._stats.get(recipient, None)
+        if stats is None:
+            stats = self._stats[recipient] = RecipientStats()
+            while len(self._stats) > self.stats_max_recipients:
+                self._stats.popitem(last=False)
+        else:
+            self._stats.move_to_end(recipient)
+        stats.sent += 1
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        kind = recipient_kind(recipient)
+        QUEUE_DEPTH.dec(kind=kind)
+        QUEUE_WAIT.observe(wait, kind=kind)
+        if message.span is not None:
+            message.span.set("queue_wait", wait)
+        self.client.send(message)
+
+    def _run_once(self) -> float:
+        """
+        Sends as many messages as the buckets allow, one per recipient per round.
+
+        :return: seconds to wait before something can be sent again,
+                 or 0 if there's nothing left to send
+        """
+        while self._ready:
+            now = time.monotonic()
+            sent = False
+            min_delay = None
+            for _ in range(len(self._ready)):
+                if not self.global_bucket.available(now):
+                    return self.global_bucket.delay(now)
+                recipient = self._ready.popleft()
+                queue = self._queues[recipient]
+                if queue.bucket.available(now):
+                    self._send_next(recipient, queue, now)
+                    sent = True
+                else:
+                    d = queue.bucket.delay(now)
+                    min_delay = d if min_delay is None else min(min_delay, d)
+                if queue.messages:
+                    self._ready.append(recipient)
+            if not sent:
+                return min_delay
+        return 0
+
+    def _purge(self) -> None:
+        """
+        Forgets about idle recipients with a full bucket, so the
+        recipients dict doesn't grow forever with one-off PMs.
+
+        :return:
+        """
+        now = time.monotonic()
+        for recipient in [k for k, v in self._queues.items() if not v.messages and v.bucket.full(now)]:
+            del self._queues[recipient]
+
+    async def run(self) -> None:
+        self.logger.debug("Started outbound scheduler")
+        try:
+            while True:
+                if not self.client.running:
+                    # Keep messages in here while disconnected
+                    await self.client.wait("connected")
+                    if self.dropped:
+                        self.logger.warning(f"Dropped {self.dropped} messages while disconnected")
+                        self.dropped = 0
+                delay = self._run_once()
+                if delay > 0:
+                    # A message for another recipient may be sendable before then
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self._purge()
+                self._wakeup.clear()
+                await self._wakeup.wait()
+        except asyncio.CancelledError:
+            self.logger.info("Outbound scheduler stopped")
+
+    def start(self) -> None:
+        if self.task is not None and not self.task.done():
+            raise RuntimeError("Scheduler already running")
+        self.task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+
+    def drain(self) -> List[WsChatMessage]:
+        """
+        Removes and returns all pending messages, without sending them.
+        Messages to the same recipient are kept in order.
+
+        :return: list of messages
+        """
+        messages = []
+        for recipient in self._ready:
+            queue = self._queues[recipient]
+            QUEUE_DEPTH.dec(len(queue.messages), kind=recipient_kind(recipient))
+            messages.extend(message for message, _ in queue.messages)
+            queue.messages.clear()
+        self._ready.clear()
+        self._pending = 0
+        return messages
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def stats(self) -> Dict[Union[str, int], Dict[str, Any]]:
+        """
+        Returns per-recipient statistics about the recipients with pending
+        messages and the last `stats_max_recipients` recipients served
+
+        :return: dict, recipient -> {depth, sent, avg_wait, max_wait, oldest_wait}
+        """
+        now = time.monotonic()
+        result = {}
+        for k in list(self._stats.keys()) + [x for x in self._queues.keys() if x not in self._stats]:
+            stats = self._stats.get(k, None)
+            queue = self._queues.get(k, None)
+            messages = queue.messages if queue is not None else ()
+            sent = stats.sent if stats is not None else 0
+            result[k] = {
+                "depth": len(messages),
+                "sent": sent,
+                "avg_wait": stats.total_wait / sent if sent else 0.0,
+                "max_wait": stats.max_wait if stats is not None else 0.0,
+                "oldest_wait": now - messages[0][1] if messages else 0.0,
+            }
+        return result